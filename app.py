@@ -5,8 +5,18 @@ import uuid
 import base64
 
 # Import from other modules
-from chatbot import process_question, get_chat_history_markdown
+from chatbot import (process_question, get_chat_history_markdown, collect_turn_analyses, add_notice_message,
+                     finalize_interrupted_reply, resume_interrupted_reply, warm_prompt_cache, get_prompt_cache_stats)
+from reply_checkpoint import get_reply_checkpoint, clear_reply_checkpoint, sign_session_id, verify_session_token
+from learner_memory import collect_learner_memory
+from llm_client import get_setting, get_pool_stats
+from llm_backends import get_backend_stats
+from llm_scheduler import get_llm_scheduler
+from llm_resilience import get_resilience_stats
+from helper_gateway import get_helper_gateway
+from model_policy import get_model_policy
 from utils import process_uploaded_file, get_level_color, format_level_badge
+from languages import SUPPORTED_LANGUAGES, get_language_greetings
 
 # Configure page
 st.set_page_config(
@@ -289,60 +299,12 @@ st.markdown("""
 </style>
 """, unsafe_allow_html=True)
 
-# Define supported languages with their ISO codes, names and flags
-# This can be extended with more languages as needed
-SUPPORTED_LANGUAGES = {
-    "fin": {"name": "Finnish", "flag": "🇫🇮", "native_name": "Suomi"},
-    "spa": {"name": "Spanish", "flag": "🇪🇸", "native_name": "Español"},
-    "fra": {"name": "French", "flag": "🇫🇷", "native_name": "Français"},
-    "deu": {"name": "German", "flag": "🇩🇪", "native_name": "Deutsch"},
-    "ita": {"name": "Italian", "flag": "🇮🇹", "native_name": "Italiano"},
-    "rus": {"name": "Russian", "flag": "🇷🇺", "native_name": "Русский"},
-    "swe": {"name": "Swedish", "flag": "🇸🇪", "native_name": "Svenska"},
-}
-
-# Define common greetings for each language
-LANGUAGE_GREETINGS = {
-    "fin": {
-        "morning": "Hyvää huomenta!",
-        "afternoon": "Hyvää päivää!",
-        "evening": "Hyvää iltaa!"
-    },
-    "spa": {
-        "morning": "¡Buenos días!",
-        "afternoon": "¡Buenas tardes!",
-        "evening": "¡Buenas noches!"
-    },
-    "fra": {
-        "morning": "Bonjour!",
-        "afternoon": "Bon après-midi!",
-        "evening": "Bonsoir!"
-    },
-    "deu": {
-        "morning": "Guten Morgen!",
-        "afternoon": "Guten Tag!",
-        "evening": "Guten Abend!"
-    },
-    "ita": {
-        "morning": "Buongiorno!",
-        "afternoon": "Buon pomeriggio!",
-        "evening": "Buonasera!"
-    },
-    "rus": {
-        "morning": "Доброе утро!",
-        "afternoon": "Добрый день!",
-        "evening": "Добрый вечер!"
-    },
-    "swe": {
-        "morning": "God morgon!",
-        "afternoon": "God dag!",
-        "evening": "God kväll!"
-    }
-}
-
 # Define Finnish language levels with detailed descriptions
 level_options = ["A1 (Beginner)", "A2 (Elementary)", "B1 (Intermediate)", "B2 (Upper Intermediate)", "C1 (Advanced)"]
 
+# Precompile the static tutor prompts (once per process)
+warm_prompt_cache(level_options)
+
 level_descriptions = {
     "A1 (Beginner)": "Basic phrases and everyday expressions. Simple personal details.",
     "A2 (Elementary)": "Familiar expressions for basic routines. Simple communication about immediate needs.",
@@ -404,7 +366,16 @@ detailed_descriptions = {
 if 'messages' not in st.session_state:
     st.session_state.messages = []
 if 'session_id' not in st.session_state:
-    st.session_state.session_id = str(uuid.uuid4())
+    if get_setting("REPLY_CHECKPOINT_DIR", None):
+        # Keep the signed session id in the URL so a reloaded page (or a restarted server)
+        # finds its interrupted reply in the durable checkpoint store. Unsigned or
+        # tampered ids start a new session.
+        st.session_state.session_id = verify_session_token(st.query_params.get("session")) or str(uuid.uuid4())
+        session_token = sign_session_id(st.session_state.session_id)
+        if session_token:
+            st.query_params["session"] = session_token
+    else:
+        st.session_state.session_id = str(uuid.uuid4())
 if 'chat_history' not in st.session_state:
     st.session_state.chat_history = []
 if 'chat_started' not in st.session_state:
@@ -418,13 +389,39 @@ if 'selected_level' not in st.session_state:
 if 'level_history' not in st.session_state:
     st.session_state.level_history = []  # Track level changes for adaptive learning
 if 'user_topics' not in st.session_state:
-    st.session_state.user_topics = []
+    st.session_state.user_topics = {}  # Topics the learner has shown interest in, per language
 if 'current_level_changed' not in st.session_state:
     st.session_state.current_level_changed = False
 if 'selected_language' not in st.session_state:
     st.session_state.selected_language = "fin"  # Default to Finnish
 if 'language_changed' not in st.session_state:
     st.session_state.language_changed = False
+if 'pending_turn_analyses' not in st.session_state:
+    st.session_state.pending_turn_analyses = []  # Background turn analyses not yet applied
+if 'turn_budget_report' not in st.session_state:
+    st.session_state.turn_budget_report = None  # Stage timings and skip reasons of the latest turn
+if 'last_intent' not in st.session_state:
+    st.session_state.last_intent = None  # Execution profile chosen for the latest message
+if 'active_stream' not in st.session_state:
+    st.session_state.active_stream = None  # Cancellation token of the reply being streamed
+if 'reply_checkpoint' not in st.session_state:
+    st.session_state.reply_checkpoint = None  # Partial reply saved while streaming
+if 'last_reply_usage' not in st.session_state:
+    st.session_state.last_reply_usage = None  # Prompt, output and cached tokens of the latest reply
+if 'prompt_assembly' not in st.session_state:
+    st.session_state.prompt_assembly = None  # Prompt fragments sent with the latest reply and tokens saved
+if 'token_breakdown' not in st.session_state:
+    st.session_state.token_breakdown = None  # Estimated tokens per section of the latest request
+if 'history_window' not in st.session_state:
+    st.session_state.history_window = None  # Earlier messages and tokens sent with the latest request
+if 'learner_memory' not in st.session_state:
+    st.session_state.learner_memory = None  # Running summary per language of the turns that left the history window
+if 'history_index' not in st.session_state:
+    st.session_state.history_index = None  # Search index over the exchanges of the chat history
+
+# Apply any turn analyses and learner memory updates that finished in the background since the last run
+collect_turn_analyses(st.session_state)
+collect_learner_memory(st.session_state)
 
 # Sidebar
 with st.sidebar:
@@ -467,15 +464,10 @@ with st.sidebar:
         st.session_state.selected_language = selected_language_code
         st.session_state.language_changed = True
         
-        # Add a system message about the language change
+        # Add a notice about the language change
         new_lang = SUPPORTED_LANGUAGES[selected_language_code]
         language_message = f"Your target language has been changed to {new_lang['flag']} {new_lang['name']}. All content will now be adapted to this language."
-        st.session_state.messages.append({"role": "assistant", "content": language_message})
-        st.session_state.chat_history.append({
-            "role": "assistant", 
-            "content": language_message, 
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        })
+        add_notice_message(st.session_state, language_message)
         
         st.rerun()
     
@@ -520,15 +512,10 @@ with st.sidebar:
         st.session_state.selected_level = selected_level
         st.session_state.current_level_changed = True
         
-        # Add a system message about the level change
+        # Add a notice about the level change
         lang_info = SUPPORTED_LANGUAGES[st.session_state.selected_language]
         level_message = f"Your {lang_info['name']} level has been changed to {selected_level}. All content will now be adapted to this level."
-        st.session_state.messages.append({"role": "assistant", "content": level_message})
-        st.session_state.chat_history.append({
-            "role": "assistant", 
-            "content": level_message, 
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        })
+        add_notice_message(st.session_state, level_message)
         
         st.rerun()
     
@@ -569,14 +556,9 @@ with st.sidebar:
                 # Get language info
                 lang_info = SUPPORTED_LANGUAGES[st.session_state.selected_language]
                 
-                # Add a system message to inform the user that the file was uploaded
+                # Add a notice to inform the user that the file was uploaded
                 system_msg = f"{level_badge} File '{uploaded_file.name}' has been uploaded. You can now ask questions about it, request translations of text in the file, or ask for exercises based on it that are adapted to your {level_code} level {lang_info['name']} learning."
-                st.session_state.messages.append({"role": "assistant", "content": system_msg})
-                st.session_state.chat_history.append({
-                    "role": "assistant", 
-                    "content": system_msg, 
-                    "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                })
+                add_notice_message(st.session_state, system_msg)
                 st.rerun()
     
     st.markdown("---")
@@ -590,9 +572,22 @@ with st.sidebar:
         st.session_state.chat_started = False
         st.session_state.greeting_added = False
         st.session_state.uploaded_file = None
-        st.session_state.user_topics = []
+        st.session_state.user_topics = {}
+        st.session_state.pending_turn_analyses = []
+        st.session_state.turn_budget_report = None
+        st.session_state.last_intent = None
+        st.session_state.last_reply_usage = None
+        st.session_state.prompt_assembly = None
+        st.session_state.token_breakdown = None
+        st.session_state.history_window = None
+        st.session_state.learner_memory = None
+        st.session_state.history_index = None
+        clear_reply_checkpoint(st.session_state)
         # Keep the level history for learning progression tracking
         st.session_state.session_id = str(uuid.uuid4())
+        session_token = sign_session_id(st.session_state.session_id)
+        if get_setting("REPLY_CHECKPOINT_DIR", None) and session_token:
+            st.query_params["session"] = session_token
         st.rerun()
 
     if st.button("📝 Export Chat History", key="export_chat", use_container_width=True):
@@ -622,6 +617,47 @@ with st.sidebar:
         
         st.markdown(f"<div style='font-size: 0.9rem;'>{level_history_md}</div>", unsafe_allow_html=True)
 
+    # Token usage of the latest request, for debugging the prompt budget
+    if get_setting("DEBUG_PANEL", False) and st.session_state.token_breakdown:
+        with st.expander("🔍 Token usage of the last request"):
+            breakdown = st.session_state.token_breakdown
+            st.table([{"Section": name.replace("_", " "), "Tokens (estimated)": tokens}
+                      for name, tokens in breakdown["sections"].items() if tokens])
+            st.markdown(f"**Prompt:** {breakdown['prompt_tokens']} tokens, **max_tokens:** {breakdown['max_tokens']}")
+            if st.session_state.history_window:
+                window = st.session_state.history_window
+                st.markdown(f"**History:** {window['messages_included']} of {window['messages_total']} earlier messages "
+                            f"({window['tokens_included']} of {window['budget_tokens']} tokens)")
+            memory = (st.session_state.learner_memory or {}).get(st.session_state.selected_language)
+            if memory and memory["summary"]:
+                st.markdown(f"**Learner memory:** summary of the first {memory['covered']} messages")
+            if st.session_state.prompt_assembly:
+                st.markdown(f"**Saved by prompt assembly:** {st.session_state.prompt_assembly['tokens_saved']} tokens")
+            if st.session_state.last_reply_usage:
+                usage = st.session_state.last_reply_usage
+                st.markdown(f"**Reported by the API:** {usage['input_tokens']} prompt tokens "
+                            f"({usage['cached_tokens']} cached), {usage['output_tokens']} response tokens")
+
+    # Process-wide LLM statistics, shared by all sessions
+    if get_setting("DEBUG_PANEL", False):
+        with st.expander("📊 LLM statistics (all sessions)"):
+            st.markdown("**Backends**")
+            st.json(get_backend_stats(), expanded=False)
+            st.markdown("**Rate limiter**")
+            st.json(get_llm_scheduler().get_stats(), expanded=False)
+            st.markdown("**Retries, hedging and circuit breaker**")
+            st.json(get_resilience_stats(), expanded=False)
+            st.markdown("**Model policy**")
+            st.json(get_model_policy().get_stats(), expanded=False)
+            st.markdown("**Connection pool**")
+            st.json(get_pool_stats(), expanded=False)
+            st.markdown("**Static prompt cache**")
+            st.json(get_prompt_cache_stats(), expanded=False)
+            # The gateway only exists with batching enabled, asking for its stats would start it
+            if get_setting("HELPER_BATCHING", False):
+                st.markdown("**Helper batching**")
+                st.json(get_helper_gateway().get_stats(), expanded=False)
+
 # Main content
 # Get level code and badge
 level_code = st.session_state.selected_level.split()[0]
@@ -722,6 +758,37 @@ if st.session_state.messages:
                 else:
                     st.markdown(message['content'], unsafe_allow_html=True)
 
+# Function to stop the reply being streamed
+def stop_streaming():
+    """
+    Cancel the streamed reply (on_click callback of the Stop button)
+    """
+    if st.session_state.active_stream is not None:
+        st.session_state.active_stream.cancel()
+    # The interrupted run checkpointed the partial reply, keep it as it is
+    finalize_interrupted_reply(st.session_state)
+
+# Show a reply that was interrupted while streaming, with options to continue or keep it
+interrupted_reply = get_reply_checkpoint(st.session_state)
+if interrupted_reply and interrupted_reply["partial"]:
+    with st.chat_message("assistant"):
+        st.markdown(f"{format_level_badge(interrupted_reply['level'].split()[0])} {interrupted_reply['partial']}", unsafe_allow_html=True)
+        st.caption("This reply was interrupted before it was complete.")
+    continue_col, keep_col = st.columns(2)
+    with continue_col:
+        continue_clicked = st.button("▶️ Continue reply", key="continue_reply", use_container_width=True)
+    with keep_col:
+        st.button("✔️ Keep as it is", key="keep_reply", on_click=finalize_interrupted_reply,
+                  args=(st.session_state,), use_container_width=True)
+    if continue_clicked:
+        # Stop control for the resumed reply, like for a new one
+        st.button("⏹ Stop", key="stop_streaming", on_click=stop_streaming)
+        resume_interrupted_reply(st.session_state)
+        st.rerun()
+elif interrupted_reply:
+    # Nothing was received before the interruption
+    clear_reply_checkpoint(st.session_state)
+
 # Chat input
 user_input = st.chat_input("Type your message here...")
 if user_input:
@@ -732,7 +799,7 @@ if user_input:
         
         # Get appropriate greeting based on time of day and language
         lang_code = st.session_state.selected_language
-        greetings = LANGUAGE_GREETINGS.get(lang_code, LANGUAGE_GREETINGS["fin"])  # Default to Finnish if not found
+        greetings = get_language_greetings(lang_code)  # Finnish greetings if the language has none
         
         if now < 12:
             greeting = f"{greetings['morning']} (Good morning!) 🌞"
@@ -746,14 +813,13 @@ if user_input:
         lang_info = SUPPORTED_LANGUAGES[lang_code]
         
         intro_message = f"{greeting} I'm your {lang_info['name']} language tutor. {level_badge} You've selected the {st.session_state.selected_level} level. I'll adapt all my responses, exercises, and vocabulary to this level. How can I help you today?"
-        st.session_state.messages.append({"role": "assistant", "content": intro_message})
-        st.session_state.chat_history.append({
-            "role": "assistant", 
-            "content": intro_message, 
-            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        })
+        add_notice_message(st.session_state, intro_message)
         st.session_state.greeting_added = True
     
+    # Stop control for the streamed reply. Clicking it interrupts this run, which
+    # aborts the upstream request and keeps the partial reply marked as truncated.
+    st.button("⏹ Stop", key="stop_streaming", on_click=stop_streaming)
+    
     # Process the user's question
     process_question(user_input, st.session_state)
     st.rerun()
@@ -3,8 +3,34 @@ import time
 from datetime import datetime
 import re
 import base64
-from langchain_openai import ChatOpenAI
-from utils import get_level_appropriate_content, get_level_color, format_level_badge
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from llm_client import get_setting, llm_cache, llm_singleflight, request_key, normalize_request_text
+from helper_gateway import invoke_helper, parse_json_output
+from llm_scheduler import PRIORITY_INTERACTIVE
+from llm_backends import get_reply_backend
+from stream_control import CancellationToken, iterate_async_stream, TRUNCATED_NOTE
+from reply_checkpoint import ReplyCheckpointer, get_reply_checkpoint, clear_reply_checkpoint
+from llm_resilience import stream_resilient, reply_latency
+from turn_deadline import start_turn_deadline
+from model_policy import get_model_policy
+from intent_router import route_intent, get_profile_model, get_profile_max_tokens, EXECUTION_PROFILES
+from prompt_assembler import (SECTION_TAGS, ALL_PROMPT_TAGS, GUIDELINE_FRAGMENTS, split_exercise_catalogue,
+                              select_prompt_tags, get_prefix_prompt_tags, assemble_prompt, record_prompt_assembly,
+                              apply_prompt_variant)
+from token_estimator import estimate_tokens, analyze_request_tokens, record_token_breakdown
+from guidelines import GUIDELINES
+from languages import SUPPORTED_LANGUAGES, get_language_display_name, get_language_flag
+from history_window import (fit_history, record_history_window, get_context_positions,
+                            MESSAGE_KIND_DIALOGUE, MESSAGE_KIND_NOTICE)
+from learner_memory import (collect_learner_memory, schedule_learner_memory, start_learner_memory_update,
+                            get_learner_memory_message)
+from history_retrieval import retrieve_relevant_history
+from utils import get_level_appropriate_content, get_level_color, format_level_badge, strip_level_badge
+from utils import (detect_language_llm, detect_language_traditional, extract_exercise_parameters_llm,
+                   extract_exercise_parameters_rule_based, get_detectable_languages, normalize_language_code,
+                   normalize_exercise_parameters)
 
 # Generic system prompt with language-specific adaptation
 SYSTEM_PROMPT = """ 
@@ -82,420 +108,40 @@ Reading exercise should be followed by its translation for reference.
 Remember: It is ESSENTIAL that you never introduce vocabulary or grammar that is beyond the learner's current level, as this will confuse and discourage them. Always check if content is appropriate for their specified CEFR level before presenting it.
 """
 
+# Split SYSTEM_PROMPT into its introduction and "## " sections, so execution
+# profiles can send only the sections a request type needs
+_prompt_parts = re.split(r'\n(?=## )', SYSTEM_PROMPT)
+SYSTEM_PROMPT_INTRO = _prompt_parts[0]
+SYSTEM_PROMPT_SECTIONS = {part.split("\n", 1)[0][3:].strip(): part for part in _prompt_parts[1:]}
+
+# Function to build the system prompt for an execution profile
+def get_system_prompt(sections=None):
+    """
+    Build the system prompt from selected sections of SYSTEM_PROMPT
+    
+    Parameters:
+    - sections: Section titles to include (None returns the full SYSTEM_PROMPT)
+    
+    Returns:
+    - System prompt text
+    """
+    if sections is None:
+        return SYSTEM_PROMPT
+    return "\n".join([SYSTEM_PROMPT_INTRO] + [SYSTEM_PROMPT_SECTIONS[name] for name in sections if name in SYSTEM_PROMPT_SECTIONS])
+
 # Function to get detailed CEFR level guidelines for each level and language
-def get_cefr_level_guidelines(level_code, language_code):
+def get_cefr_level_guidelines(level_code, language_code, include_base=True):
     """
     Returns detailed guidelines for a specific CEFR level and language
+    (only the language-specific part when include_base is False)
     """
     # Base guidelines applicable to most languages
-    base_guidelines = {
-        "A1": """
-            A1 LEVEL GUIDELINES:
-            - Vocabulary: Only basic words (around 500-800 words) related to immediate needs
-            - Grammar: Present tense only, basic question formation, simple negation
-            - Sentence structure: Simple, short sentences with basic connectors (and, but)
-            - Topics: Personal information, basic everyday activities, simple needs
-            - Numbers 1-100, basic time expressions
-            - Avoid any advanced structures, past tenses, conditional forms
-        """,
-        "A2": """
-            A2 LEVEL GUIDELINES:
-            - Vocabulary: Expanded everyday vocabulary (around 1500 words)
-            - Grammar: Simple past tense, basic verb conjugation patterns
-            - Sentence structure: Simple sentences with some coordination
-            - Topics: Daily routines, shopping, local environment, simple past experiences
-            - Simple descriptive adjectives
-            - Avoid complex tenses, conditionals, complex clauses
-        """,
-        "B1": """
-            B1 LEVEL GUIDELINES:
-            - Vocabulary: More varied vocabulary (around 3000 words), some abstract terms
-            - Grammar: Perfect and imperfect tenses, conditional mood, passive forms
-            - Sentence structure: Compound sentences, simple subordination
-            - Topics: Work, school, leisure, travel, current events, feelings
-            - Comparative forms
-            - Avoid literary language, complex constructions
-        """,
-        "B2": """
-            B2 LEVEL GUIDELINES:
-            - Vocabulary: Broader vocabulary (around 5000 words), some specialized terms
-            - Grammar: All tense forms, more complex verbal constructions
-            - Sentence structure: Complex sentences with various clause types
-            - Topics: Social issues, professional topics, abstract concepts, hypothetical situations
-            - Imperative forms, indirect speech
-            - Avoid highly specialized terminology, dialectal expressions
-        """,
-        "C1": """
-            C1 LEVEL GUIDELINES:
-            - Vocabulary: Rich vocabulary (8000+ words), specialized terms, colloquial expressions
-            - Grammar: All grammatical structures, including rare forms
-            - Sentence structure: Sophisticated, complex sentences with embedded clauses
-            - Topics: Any academic, professional or abstract topic, cultural references
-            - Complex constructions, literary expressions
-            - Nuanced differences in word meanings and connotations
-            - Full range of language features
-        """
-    }
-    
-    # Language-specific guidelines
-    language_specific = {
-        "fin": {
-            "A1": """
-                FINNISH A1 SPECIFIC GUIDELINES:
-                - Focus on nominative/partitive/genitive cases only
-                - Simple consonant gradation patterns (kk-k, pp-p, tt-t)
-                - Basic subject-verb agreement
-                - Simple question particles and words
-                - Personal pronouns (minä, sinä, hän, etc.)
-            """,
-            "A2": """
-                FINNISH A2 SPECIFIC GUIDELINES:
-                - Include inessive, elative, illative cases
-                - All basic verb types
-                - Standard consonant gradation patterns
-                - Simple possessive suffixes
-                - More extensive use of partitive case
-            """,
-            "B1": """
-                FINNISH B1 SPECIFIC GUIDELINES:
-                - All locative cases (also adessive, ablative, allative)
-                - Object cases and their rules
-                - Perfect and pluperfect tenses
-                - Passive voice (present and past)
-                - More complex uses of pronouns and demonstratives
-            """,
-            "B2": """
-                FINNISH B2 SPECIFIC GUIDELINES:
-                - Potential mood
-                - Complex object rules
-                - Multiple infinitive forms
-                - Participles
-                - Complex sentence structures
-            """,
-            "C1": """
-                FINNISH C1 SPECIFIC GUIDELINES:
-                - Complex participle constructions
-                - Literary expressions and rare forms
-                - Dialectal variations
-                - Subtle case usage differences
-                - Advanced idiomatic expressions
-            """
-        },
-        "spa": {
-            "A1": """
-                SPANISH A1 SPECIFIC GUIDELINES:
-                - Regular verb conjugations in present tense
-                - Basic gender and number agreement
-                - Simple prepositions
-                - Question formation with intonation
-                - Basic adjective placement
-                - Common irregular verbs (ser, estar, ir, tener)
-            """,
-            "A2": """
-                SPANISH A2 SPECIFIC GUIDELINES:
-                - Preterite vs. imperfect tenses
-                - Reflexive verbs
-                - Direct and indirect object pronouns
-                - Common irregular verbs
-                - Comparative forms
-                - Simple commands
-            """,
-            "B1": """
-                SPANISH B1 SPECIFIC GUIDELINES:
-                - Present subjunctive
-                - Future and conditional tenses
-                - Perfect tenses
-                - Por vs. para distinctions
-                - Relative pronouns
-                - Formal commands
-            """,
-            "B2": """
-                SPANISH B2 SPECIFIC GUIDELINES:
-                - All subjunctive uses (present and imperfect)
-                - Compound tenses
-                - Passive structures
-                - Advanced connecting phrases
-                - Idiomatic expressions
-                - Reported speech
-            """,
-            "C1": """
-                SPANISH C1 SPECIFIC GUIDELINES:
-                - Regional variations and dialectal features
-                - Literary language
-                - Complex hypothetical structures
-                - Subtle tense distinctions
-                - Cultural and historical references
-                - Specialized vocabulary in various domains
-            """
-        },
-        "fra": {
-            "A1": """
-                FRENCH A1 SPECIFIC GUIDELINES:
-                - Regular -er verb conjugations
-                - Basic irregular verbs (être, avoir, aller, faire)
-                - Gender of nouns
-                - Definite and indefinite articles
-                - Basic prepositions
-                - Question formation with est-ce que
-                - Negation with ne...pas
-            """,
-            "A2": """
-                FRENCH A2 SPECIFIC GUIDELINES:
-                - Passé composé with avoir and être
-                - Reflexive verbs
-                - Direct and indirect object pronouns
-                - Imperative mood
-                - Futur proche (aller + infinitive)
-                - Introduction to imparfait
-                - Comparative forms
-            """,
-            "B1": """
-                FRENCH B1 SPECIFIC GUIDELINES:
-                - All past tenses (passé composé, imparfait, plus-que-parfait)
-                - Future simple
-                - Conditional present
-                - Introduction to subjunctive
-                - Relative pronouns (qui, que, où, dont)
-                - Passive voice
-                - Reported speech
-            """,
-            "B2": """
-                FRENCH B2 SPECIFIC GUIDELINES:
-                - Advanced subjunctive uses
-                - Conditional past
-                - Literary tenses (recognition)
-                - Complex pronouns (y, en, lequel)
-                - Advanced connecting expressions
-                - Nominalizations
-                - Idiomatic expressions
-            """,
-            "C1": """
-                FRENCH C1 SPECIFIC GUIDELINES:
-                - Literary tenses (passé simple, subjonctif imparfait)
-                - Complex hypothetical structures
-                - Advanced nominalizations
-                - Stylistic variations
-                - Regional expressions
-                - Linguistic nuances and connotations
-                - Specialized terminology
-            """
-        },
-        "deu": {
-            "A1": """
-                GERMAN A1 SPECIFIC GUIDELINES:
-                - Present tense regular and irregular verbs
-                - Word order in main clauses
-                - Nominative and accusative cases
-                - Modal verbs
-                - Definite and indefinite articles
-                - Question formation
-                - Negation with nicht and kein
-            """,
-            "A2": """
-                GERMAN A2 SPECIFIC GUIDELINES:
-                - Perfect tense
-                - Dative case
-                - Prepositions with fixed case
-                - Imperative forms
-                - Possessive articles
-                - Comparative and superlative
-                - Subordinate clauses with weil, dass, wenn
-            """,
-            "B1": """
-                GERMAN B1 SPECIFIC GUIDELINES:
-                - Genitive case
-                - Adjective declension
-                - Simple passive voice
-                - Subjunctive II (würde + infinitive, hätte, wäre)
-                - Relative clauses
-                - Temporal prepositions and conjunctions
-                - Future tense
-            """,
-            "B2": """
-                GERMAN B2 SPECIFIC GUIDELINES:
-                - Konjunktiv I (reported speech)
-                - Extended passive voice (with modal verbs)
-                - N-declension nouns
-                - Participle constructions
-                - Advanced connecting phrases
-                - Extended attributes
-                - Advanced subordinate clauses
-            """,
-            "C1": """
-                GERMAN C1 SPECIFIC GUIDELINES:
-                - Advanced verbal constructions
-                - All passive and subjunctive forms
-                - Nominalized verbs
-                - Literary and formal expressions
-                - Idiomatic expressions and collocations
-                - Regional variations
-                - Complex sentence structures
-            """
-        },
-        "ita": {
-            "A1": """
-                ITALIAN A1 SPECIFIC GUIDELINES:
-                - Present tense of regular verbs (-are, -ere, -ire)
-                - Common irregular verbs (essere, avere, fare, andare)
-                - Definite and indefinite articles
-                - Noun gender and number
-                - Basic adjective agreement
-                - Simple prepositions
-                - Question formation
-            """,
-            "A2": """
-                ITALIAN A2 SPECIFIC GUIDELINES:
-                - Passato prossimo with avere and essere
-                - Introduction to imperfetto
-                - Reflexive verbs
-                - Direct object pronouns
-                - Comparative forms
-                - Future tense (introduction)
-                - Modal verbs (dovere, potere, volere)
-            """,
-            "B1": """
-                ITALIAN B1 SPECIFIC GUIDELINES:
-                - Contrasting imperfetto and passato prossimo
-                - Future tense
-                - Conditional present
-                - Introduction to congiuntivo
-                - Combined pronouns
-                - Relative pronouns (che, cui, quale)
-                - Introduction to passive voice
-            """,
-            "B2": """
-                ITALIAN B2 SPECIFIC GUIDELINES:
-                - All subjunctive tenses
-                - Passato remoto (recognition)
-                - Conditional past
-                - Advanced pronoun usage
-                - Passive constructions
-                - Gerund and participle forms
-                - Complex connecting expressions
-            """,
-            "C1": """
-                ITALIAN C1 SPECIFIC GUIDELINES:
-                - Literary tenses
-                - Complex sentence structures
-                - Stylistic variations
-                - Idiomatic expressions
-                - Regional language variations
-                - Advanced formal registers
-                - Specialized terminology
-            """
-        },
-        "rus": {
-            "A1": """
-                RUSSIAN A1 SPECIFIC GUIDELINES:
-                - Cyrillic alphabet and pronunciation
-                - Present tense of common verbs
-                - Gender of nouns
-                - Personal and possessive pronouns
-                - Nominative case
-                - Simple questions
-                - Numerals 1-100
-            """,
-            "A2": """
-                RUSSIAN A2 SPECIFIC GUIDELINES:
-                - Past tense
-                - Future tense (imperfective and simple perfective)
-                - Introduction to cases (accusative, prepositional)
-                - Basic aspects of verbs
-                - Possessive pronouns
-                - Adjective agreement
-                - More question types
-            """,
-            "B1": """
-                RUSSIAN B1 SPECIFIC GUIDELINES:
-                - All cases (nominative, accusative, genitive, dative, instrumental, prepositional)
-                - Verbal aspects (perfective and imperfective)
-                - Basic verbs of motion
-                - Imperatives
-                - Conditional expressions
-                - Complex sentence structures
-                - Time expressions
-            """,
-            "B2": """
-                RUSSIAN B2 SPECIFIC GUIDELINES:
-                - Verbs of motion with prefixes
-                - Participles and verbal adverbs (introduction)
-                - Passive constructions
-                - Complex sentences
-                - Advanced use of cases
-                - Numerals and counting
-                - Formal and informal registers
-            """,
-            "C1": """
-                RUSSIAN C1 SPECIFIC GUIDELINES:
-                - Complex verbal constructions
-                - Advanced participles and verbal adverbs
-                - Nuanced aspects usage
-                - Idiomatic expressions
-                - Stylistic variations
-                - Language of literature and media
-                - Dialectal features
-            """
-        },
-        "swe": {
-            "A1": """
-                SWEDISH A1 SPECIFIC GUIDELINES:
-                - Present tense of regular verbs
-                - Common irregular verbs (är, har, gör)
-                - En/ett gender system
-                - Indefinite and definite forms of nouns
-                - Personal pronouns
-                - Word order in main clauses
-                - Simple questions
-            """,
-            "A2": """
-                SWEDISH A2 SPECIFIC GUIDELINES:
-                - Past tense (preteritum)
-                - Present perfect (perfekt)
-                - Adjective agreement
-                - Modal verbs
-                - Adverbs and word order
-                - Possessive pronouns
-                - Comparative forms
-            """,
-            "B1": """
-                SWEDISH B1 SPECIFIC GUIDELINES:
-                - Future constructions
-                - Conditional forms
-                - Subordinate clauses and word order
-                - Relative clauses
-                - Passive voice
-                - Reflexive verbs
-                - Particles and phrasal verbs
-            """,
-            "B2": """
-                SWEDISH B2 SPECIFIC GUIDELINES:
-                - Past perfect (pluskvamperfekt)
-                - Subjunctive in fixed expressions
-                - Advanced subordinate clauses
-                - Extended attributes
-                - S-passiv vs. bli-passiv
-                - Advanced connecting expressions
-                - Formal language
-            """,
-            "C1": """
-                SWEDISH C1 SPECIFIC GUIDELINES:
-                - Complex verbal constructions
-                - Advanced word order variations
-                - Stylistic nuances
-                - Idiomatic expressions
-                - Regional language variations
-                - Literary language
-                - Specialized terminology
-            """
-        }
-    }
-    
-    # Start with base guidelines
-    guidelines = base_guidelines.get(level_code, "")
+    guidelines = GUIDELINES["cefr_guidelines"].get(level_code, "") if include_base else ""
     
     # Add language-specific guidelines if available
-    if language_code in language_specific and level_code in language_specific[language_code]:
-        guidelines += language_specific[language_code][level_code]
+    language_guidelines = GUIDELINES["language_guidelines"].get(language_code)
+    if language_guidelines and level_code in language_guidelines:
+        guidelines += language_guidelines[level_code]
     
     return guidelines
 
@@ -506,26 +152,7 @@ def get_chat_history_markdown(session_state):
     """
     # Get language info if available
     lang_code = session_state.selected_language if hasattr(session_state, 'selected_language') else "fin"
-    lang_name = "Finnish"  # Default
-    
-    # Try to get language name from app.py's SUPPORTED_LANGUAGES
-    try:
-        import app
-        if hasattr(app, 'SUPPORTED_LANGUAGES') and lang_code in app.SUPPORTED_LANGUAGES:
-            lang_name = app.SUPPORTED_LANGUAGES[lang_code]["name"]
-    except:
-        # If can't import, use a basic mapping
-        lang_mapping = {
-            "fin": "Finnish",
-            "spa": "Spanish",
-            "fra": "French",
-            "deu": "German",
-            "ita": "Italian",
-            "jpn": "Japanese",
-            "zho": "Chinese",
-            "rus": "Russian"
-        }
-        lang_name = lang_mapping.get(lang_code, "Unknown")
+    lang_name = get_language_display_name(lang_code)
     
     markdown_text = f"# Polyglot {lang_name} Language Tutor - Chat History\n\n"
     markdown_text += f"Session ID: {session_state.session_id}\n"
@@ -538,13 +165,7 @@ def get_chat_history_markdown(session_state):
         markdown_text += "## Level Progression\n\n"
         for change in session_state.level_history:
             lang = change.get('language', lang_code)
-            lang_display = ""
-            try:
-                import app
-                if hasattr(app, 'SUPPORTED_LANGUAGES') and lang in app.SUPPORTED_LANGUAGES:
-                    lang_display = f" ({app.SUPPORTED_LANGUAGES[lang]['name']})"
-            except:
-                pass
+            lang_display = f" ({SUPPORTED_LANGUAGES[lang]['name']})" if lang in SUPPORTED_LANGUAGES else ""
             
             markdown_text += f"- Changed from {change['from']} to {change['to']} on {change['timestamp']}{lang_display}\n"
         markdown_text += "\n"
@@ -568,14 +189,39 @@ def get_chat_history_markdown(session_state):
     
     return markdown_text
 
+# Merge newly found topics into the tracked topic list
+def merge_topics(current_topics, new_topics):
+    """
+    Add new topics to the current list, avoiding duplicates
+    
+    Parameters:
+    - current_topics: List of previously identified topics
+    - new_topics: Topics found in the latest message
+    
+    Returns:
+    - Updated list of topics (at most 30, most recent last)
+    """
+    updated_topics = current_topics.copy()
+    for topic in new_topics:
+        if topic and topic not in updated_topics:
+            updated_topics.append(topic)
+    
+    # Keep list at reasonable size
+    if len(updated_topics) > 30:
+        updated_topics = updated_topics[-30:]
+        
+    return updated_topics
+
 # Extract and track topics from user messages
-def extract_topics(message, current_topics):
+def extract_topics(message, current_topics, language_name="unknown", level="unknown"):
     """
     Extract potential learning topics from user messages using LLM to personalize future exercises
     
     Parameters:
     - message: User's message text
     - current_topics: List of previously identified topics
+    - language_name: Name of the language the user is learning
+    - level: The user's current level (e.g. "B1 (Intermediate)")
     
     Returns:
     - Updated list of topics
@@ -586,108 +232,67 @@ def extract_topics(message, current_topics):
     
     try:
         # Try to use LLM for topic extraction
-        new_topics = extract_topics_llm(message)
-        
-        # Add new topics to current list, avoiding duplicates
-        updated_topics = current_topics.copy()
-        for topic in new_topics:
-            if topic and topic not in updated_topics:
-                updated_topics.append(topic)
-        
-        # Keep list at reasonable size
-        if len(updated_topics) > 30:
-            updated_topics = updated_topics[-30:]
-            
-        return updated_topics
+        new_topics = extract_topics_llm(message, language_name, level)
+        return merge_topics(current_topics, new_topics)
         
     except Exception as e:
         # Fallback to simplified rule-based method if LLM fails
         import logging
         logging.warning(f"LLM topic extraction failed: {str(e)}. Using rule-based method.")
-        
-        # Simplified rule-based fallback (similar to original implementation)
-        # Look for potential words excluding common stopwords
-        import re
-        words = re.findall(r'\b[a-zA-Z\u00C0-\u00FF\u0100-\u017F\u0180-\u024F\u0370-\u03FF\u0400-\u04FF]{4,}\b', 
-                         message.lower())
-        
-        # Basic stopwords to filter out
-        stopwords = {"about", "after", "all", "also", "and", "any", "because", "but", "can", "come", "could", 
-                    "day", "even", "first", "from", "get", "give", "have", "here", "him", "his", "how", 
-                    "into", "its", "just", "know", "like", "look", "make", "many", "more", "most", "much", 
-                    "must", "new", "now", "one", "only", "other", "our", "out", "over", "people", "say", 
-                    "see", "she", "some", "take", "than", "that", "the", "their", "them", "then", "there", 
-                    "these", "they", "think", "this", "time", "two", "use", "very", "want", "way", "well", 
-                    "what", "when", "which", "who", "will", "with", "would", "your"}
-        
-        # Filter out stopwords
-        filtered_words = [word for word in words if word not in stopwords]
-        
-        # Grammar terms to specifically look for
-        grammar_terms = re.findall(r'\b(verb|noun|case|tense|plural|singular|adjective|adverb|conjugation|particle|preposition|article|gender|declension)\b', 
-                                message.lower())
-        
-        # Learning-related terms to specifically look for
-        learning_terms = re.findall(r'\b(exercise|translate|vocabulary|grammar|pronunciation|reading|writing|speaking|listening)\b', 
-                                   message.lower())
-        
-        # Combine filtered words with grammar and learning terms
-        all_topics = filtered_words + grammar_terms + learning_terms
-        
-        # Add new topics to current list, avoiding duplicates
-        updated_topics = current_topics.copy()
-        for topic in all_topics:
-            if topic not in updated_topics:
-                updated_topics.append(topic)
-        
-        # Keep list at reasonable size
-        if len(updated_topics) > 30:
-            updated_topics = updated_topics[-30:]
-            
-        return updated_topics
+        return merge_topics(current_topics, extract_topics_rule_based(message))
 
-# Use caching for LLM-based topic extraction to improve performance
-import functools
+# Extract topics from a user message without an LLM
+def extract_topics_rule_based(message):
+    """
+    Find potential learning topics with simple word rules (similar to the original implementation)
+    
+    Parameters:
+    - message: User's message text
+    
+    Returns:
+    - List of topics found in the message
+    """
+    # Look for potential words excluding common stopwords
+    words = re.findall(r'\b[a-zA-Z\u00C0-\u00FF\u0100-\u017F\u0180-\u024F\u0370-\u03FF\u0400-\u04FF]{4,}\b', 
+                     message.lower())
+    
+    # Basic stopwords to filter out
+    stopwords = {"about", "after", "all", "also", "and", "any", "because", "but", "can", "come", "could", 
+                "day", "even", "first", "from", "get", "give", "have", "here", "him", "his", "how", 
+                "into", "its", "just", "know", "like", "look", "make", "many", "more", "most", "much", 
+                "must", "new", "now", "one", "only", "other", "our", "out", "over", "people", "say", 
+                "see", "she", "some", "take", "than", "that", "the", "their", "them", "then", "there", 
+                "these", "they", "think", "this", "time", "two", "use", "very", "want", "way", "well", 
+                "what", "when", "which", "who", "will", "with", "would", "your"}
+    
+    # Filter out stopwords
+    filtered_words = [word for word in words if word not in stopwords]
+    
+    # Grammar terms to specifically look for
+    grammar_terms = re.findall(r'\b(verb|noun|case|tense|plural|singular|adjective|adverb|conjugation|particle|preposition|article|gender|declension)\b', 
+                            message.lower())
+    
+    # Learning-related terms to specifically look for
+    learning_terms = re.findall(r'\b(exercise|translate|vocabulary|grammar|pronunciation|reading|writing|speaking|listening)\b', 
+                               message.lower())
+    
+    # Combine filtered words with grammar and learning terms
+    all_topics = filtered_words + grammar_terms + learning_terms
+    
+    return all_topics
 
-@functools.lru_cache(maxsize=100)
-def extract_topics_llm(message):
+# Use caching for LLM-based topic extraction to improve performance
+@llm_cache(maxsize=100)
+def extract_topics_llm(message, current_language="unknown", current_level="unknown"):
     """
-    Extract learning topics from message using LLM with caching
+    Extract learning topics from message using LLM with caching.
+    Language and level are passed in rather than read from session state
+    so this can run in a background thread.
     """
     # Import required libraries
-    from langchain_openai import ChatOpenAI
-    import streamlit as st
     import json
     import re
     
-    # Get API key from Streamlit secrets
-    api_key = st.secrets.get("OPENAI_API_KEY", "")
-    if not api_key:
-        raise ValueError("OpenAI API key not configured in Streamlit secrets")
-    
-    # Initialize the LLM
-    model_name = st.secrets.get("MODEL_NAME", "gpt-4.1-mini-2025-04-14")
-    chat = ChatOpenAI(
-        openai_api_key=api_key,
-        model=model_name,
-        max_tokens=150  # Small context for topic extraction
-    )
-    
-    # Get current language and level if available
-    current_language = "unknown"
-    current_level = "unknown"
-    try:
-        if hasattr(st.session_state, 'selected_language'):
-            language_code = st.session_state.selected_language
-            import app
-            if hasattr(app, 'SUPPORTED_LANGUAGES') and language_code in app.SUPPORTED_LANGUAGES:
-                current_language = app.SUPPORTED_LANGUAGES[language_code]["name"]
-        
-        if hasattr(st.session_state, 'selected_level'):
-            current_level = st.session_state.selected_level
-    except:
-        pass
-    
     # Prepare the prompt
     prompt = [
         {
@@ -717,8 +322,7 @@ def extract_topics_llm(message):
     ]
     
     # Get the response from the LLM
-    response = chat.invoke(prompt)
-    response_content = response.content.strip()
+    response_content = invoke_helper(prompt, max_tokens=150).strip()  # Small context for topic extraction
     
     # Try to parse the response as JSON
     try:
@@ -746,10 +350,251 @@ def extract_topics_llm(message):
     
     return topics
 
+# JSON schema for the combined turn analysis response
+TURN_ANALYSIS_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "topics": {"type": "array", "items": {"type": "string"}},
+        "exercise_parameters": {
+            "type": "object",
+            "properties": {
+                "exercise_type": {"type": ["string", "null"], "enum": ["reading", "writing", "vocabulary", "quiz", None]},
+                "language_direction": {"type": ["string", "null"], "enum": ["target-to-english", "english-to-target", None]},
+                "topic": {"type": ["string", "null"]}
+            },
+            "required": ["exercise_type", "language_direction", "topic"],
+            "additionalProperties": False
+        },
+        "language": {"type": "string"}
+    },
+    "required": ["topics", "exercise_parameters", "language"],
+    "additionalProperties": False
+}
+
+# Use caching for the combined turn analysis
+@llm_cache(maxsize=100)
+def analyze_turn_llm(message, current_language="unknown", current_level="unknown"):
+    """
+    Extract topics, exercise parameters and the message language with a single
+    JSON-schema-constrained LLM call, and fill the caches of extract_topics_llm,
+    extract_exercise_parameters_llm and detect_language_llm with the results
+    
+    Parameters:
+    - message: User's message text
+    - current_language: Name of the language the user is learning
+    - current_level: The user's current level (e.g. "B1 (Intermediate)")
+    
+    Returns:
+    - Dictionary with "topics", "exercise_parameters" and "language" keys
+    """
+    supported_languages = get_detectable_languages()
+    language_options = ", ".join(f"{code} ({name})" for code, name in supported_languages.items())
+    
+    # Prepare the prompt
+    prompt = [
+        {
+            "role": "system",
+            "content": f"""You are a turn analysis system for a language learning application.
+            The user is learning {current_language} at {current_level} level. Analyze the user's message and return:
+            1. topics: 2-8 learning topics actually present in the message (grammar concepts, vocabulary themes,
+               language skills, features of {current_language}, learning goals), each a single word or short phrase.
+               Use an empty array if there are none.
+            2. exercise_parameters: exercise_type (reading, writing, vocabulary, quiz or null), language_direction
+               (target-to-english, english-to-target or null) and topic (theme of the requested exercise or null).
+            3. language: the three-letter code of the language the message is written in, one of: {language_options}.
+            """
+        },
+        {
+            "role": "user",
+            "content": f"Analyze this message: \"{message}\""
+        }
+    ]
+    
+    # Constrain the response to the schema so no regex recovery is needed
+    response_content = invoke_helper(prompt, max_tokens=250, response_format={  # Room for topics, parameters and a language code
+        "type": "json_schema",
+        "json_schema": {"name": "turn_analysis", "strict": True, "schema": TURN_ANALYSIS_SCHEMA}
+    })
+    analysis = parse_json_output(response_content)
+    
+    topics = [str(topic).lower() for topic in analysis.get("topics", []) if topic]
+    params = normalize_exercise_parameters(analysis.get("exercise_parameters"))
+    language_code = normalize_language_code(str(analysis.get("language", "")), supported_languages)
+    
+    # Fill the caches of the individual helpers so later calls for this message are free
+    extract_topics_llm.cache_put(message, current_language, current_level, value=topics)
+    extract_exercise_parameters_llm.cache_put(message, current_language, value=params)
+    detect_language_llm.cache_put(message, value=language_code)
+    
+    return {"topics": topics, "exercise_parameters": params, "language": language_code}
+
+# Analyze a user message for topics, exercise parameters and language
+def analyze_turn(message, language_name="unknown", level="unknown"):
+    """
+    Analyze a user message with one combined LLM call, falling back to the
+    rule-based methods (without further LLM calls) if it fails
+    
+    Parameters:
+    - message: User's message text
+    - language_name: Name of the language the user is learning
+    - level: The user's current level (e.g. "B1 (Intermediate)")
+    
+    Returns:
+    - Dictionary with "topics", "exercise_parameters" and "language" keys
+    """
+    # Short messages carry no useful topics or parameters
+    if not message or len(message.strip()) < 10:
+        return {
+            "topics": [],
+            "exercise_parameters": extract_exercise_parameters_rule_based(message or ""),
+            "language": detect_language_traditional(message)
+        }
+    
+    try:
+        return analyze_turn_llm(message, language_name, level)
+    except Exception as e:
+        # No more LLM calls while the API is failing, the rule-based methods are enough
+        logging.warning(f"LLM turn analysis failed: {str(e)}. Using rule-based methods.")
+        return {
+            "topics": merge_topics([], extract_topics_rule_based(message)),
+            "exercise_parameters": extract_exercise_parameters_rule_based(message),
+            "language": detect_language_traditional(message)
+        }
+
+# Shared worker pool for helper tasks that should not block the tutor reply
+_helper_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="polyglot-helper")
+
+# Function to start turn analysis in the background
+def start_turn_analysis(message, session_state):
+    """
+    Run turn analysis (topics, exercise parameters, language) for a message on the helper thread pool
+    
+    Parameters:
+    - message: User's message text
+    - session_state: Streamlit session state (read here, never from the worker thread)
+    
+    Returns:
+    - Future resolving to the turn analysis dictionary
+    """
+    lang_code = session_state.selected_language if hasattr(session_state, 'selected_language') else "fin"
+    language_name = get_language_display_name(lang_code)
+    level = session_state.selected_level if hasattr(session_state, 'selected_level') else "unknown"
+    
+    future = _helper_executor.submit(analyze_turn, message, language_name, level)
+    
+    # The topics belong to the language the message was written for
+    pending = session_state.pending_turn_analyses if hasattr(session_state, 'pending_turn_analyses') else []
+    session_state.pending_turn_analyses = pending + [(future, lang_code)]
+    return future
+
+# Function to get the topics of a language
+def get_user_topics(session_state, lang_code):
+    """
+    Get the topics the learner has shown interest in while studying a language.
+    Each language keeps its own topics, like its own conversation.
+    
+    Parameters:
+    - session_state: Streamlit session state
+    - lang_code: Language code
+    
+    Returns:
+    - List of topics (most recent last)
+    """
+    if not hasattr(session_state, 'user_topics') or not isinstance(session_state.user_topics, dict):
+        session_state.user_topics = {}
+    return session_state.user_topics.get(lang_code, [])
+
+# Function to apply finished background turn analyses
+def collect_turn_analyses(session_state, timeout=0):
+    """
+    Merge the topics of finished background turn analyses into the user_topics of
+    their language. The exercise parameters and language of an analysis are not kept
+    in session state; they only fill the caches of the individual helpers.
+    
+    Parameters:
+    - session_state: Streamlit session state
+    - timeout: Maximum number of seconds to wait for unfinished analyses
+    """
+    if not hasattr(session_state, 'pending_turn_analyses') or not session_state.pending_turn_analyses:
+        return
+    
+    deadline = time.monotonic() + timeout
+    still_pending = []
+    for future, lang_code in session_state.pending_turn_analyses:
+        try:
+            analysis = future.result(timeout=max(0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            # Leave it running, the result is applied on a later turn
+            still_pending.append((future, lang_code))
+            continue
+        except Exception as e:
+            logging.warning(f"Background turn analysis failed: {str(e)}")
+            continue
+        
+        session_state.user_topics[lang_code] = merge_topics(get_user_topics(session_state, lang_code), analysis["topics"])
+    
+    session_state.pending_turn_analyses = still_pending
+
+# Function to add an assistant reply to the chat
+def add_assistant_message(session_state, content, level, lang_code, model=None, intent=None, truncated=False, usage=None):
+    """
+    Append an assistant reply to the displayed messages and the chat history
+    
+    Parameters:
+    - session_state: Streamlit session state
+    - content: Reply text
+    - level: The learner's level at the time of the reply
+    - lang_code: The language at the time of the reply
+    - model: Model that produced the reply
+    - intent: Execution profile used for the reply
+    - truncated: Whether the reply was stopped before it was complete
+    - usage: Token usage reported by the API (input, output and cached prompt tokens)
+    """
+    message = {"role": "assistant", "content": content, "kind": MESSAGE_KIND_DIALOGUE, "language": lang_code}
+    if truncated:
+        message["truncated"] = True
+    session_state.messages.append(message)
+    session_state.chat_history.append({
+        "role": "assistant", 
+        "content": content, 
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "kind": MESSAGE_KIND_DIALOGUE,
+        "level": level,          # Track level at time of message
+        "language": lang_code,   # Track language at time of message
+        "model": model,          # Track the model that answered
+        "intent": intent,        # Track the execution profile used
+        "truncated": truncated,  # Track replies stopped before they were complete
+        "usage": usage           # Track prompt tokens and how many came from the provider's cache
+    })
+
+# Function to add a notice to the chat
+def add_notice_message(session_state, content):
+    """
+    Append a notice (greeting, language or level change, file upload) to the displayed
+    messages and the chat history. Notices are shown to the learner but never sent to
+    the model as part of the conversation.
+    
+    Parameters:
+    - session_state: Streamlit session state
+    - content: Notice text
+    """
+    lang_code = session_state.selected_language if hasattr(session_state, 'selected_language') else "fin"
+    session_state.messages.append({"role": "assistant", "content": content, "kind": MESSAGE_KIND_NOTICE,
+                                   "language": lang_code})
+    session_state.chat_history.append({
+        "role": "assistant", 
+        "content": content, 
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "kind": MESSAGE_KIND_NOTICE,
+        "language": lang_code
+    })
+
 # Function to process user messages
 def process_question(question, session_state):
     """
-    Process a user message, update topic tracking, and generate assistant response
+    Process a user message, update topic tracking, and generate assistant response.
+    The whole turn runs against one latency budget (see turn_deadline.py); its
+    report is kept in session_state.turn_budget_report.
     """
     # Get current level code
     current_level = session_state.selected_level
@@ -758,40 +603,203 @@ def process_question(question, session_state):
     # Get current language
     lang_code = session_state.selected_language if hasattr(session_state, 'selected_language') else "fin"
     
-    # Add user question to the chat
-    session_state.messages.append({"role": "user", "content": question})
-    session_state.chat_history.append({
-        "role": "user", 
-        "content": question, 
-        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "level": current_level,  # Track level at time of message
-        "language": lang_code    # Track language at time of message
-    })
+    # Collapse duplicate submissions of the same message (e.g. Enter pressed twice)
+    normalized_question = normalize_request_text(question)
+    last_submission = session_state.last_submission if hasattr(session_state, 'last_submission') else None
+    session_state.last_submission = {"text": normalized_question, "time": time.time()}
+    last_message = session_state.messages[-1] if session_state.messages else None
     
-    # Extract topics from the user message
-    session_state.user_topics = extract_topics(question, session_state.user_topics)
+    if (last_submission and last_submission["text"] == normalized_question
+            and time.time() - last_submission["time"] < float(get_setting("DUPLICATE_SUBMISSION_WINDOW", 5.0))
+            and last_message and last_message["role"] == "assistant"
+            and len(session_state.messages) >= 2
+            and normalize_request_text(session_state.messages[-2]["content"]) == normalized_question):
+        # The same message was just answered, nothing to do
+        return
+    
+    # If the previous run was interrupted before answering this message, answer it
+    # without adding it a second time
+    already_added = (last_message and last_message["role"] == "user"
+                     and normalize_request_text(last_message["content"]) == normalized_question)
+    if not already_added:
+        # Add user question to the chat
+        session_state.messages.append({"role": "user", "content": question, "kind": MESSAGE_KIND_DIALOGUE,
+                                       "language": lang_code})
+        session_state.chat_history.append({
+            "role": "user", 
+            "content": question, 
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "kind": MESSAGE_KIND_DIALOGUE,
+            "level": current_level,  # Track level at time of message
+            "language": lang_code    # Track language at time of message
+        })
+    
+    # Start the latency budget for this turn
+    deadline = start_turn_deadline()
+    session_state.turn_budget_report = None
+    
+    # Pick the execution profile (model, max_tokens, history depth, prompt sections)
+    intent, profile = route_intent(question, session_state)
+    session_state.last_intent = intent
+    
+    # Apply analyses from earlier turns that finished in the background
+    collect_turn_analyses(session_state)
+    
+    # Analyze the user message (topics, exercise parameters, language). In "parallel"
+    # mode this overlaps with the streamed reply, in "deferred" mode it starts once
+    # the reply is complete, and in "sync" mode the reply waits for it (up to the timeout).
+    analysis_mode = get_setting("TURN_ANALYSIS_MODE", "parallel")
+    analysis_timeout = float(get_setting("TURN_ANALYSIS_TIMEOUT", 1.5))
+    if not profile["turn_analysis"]:
+        # Nothing worth learning from e.g. a "T:" translation request
+        analysis_mode = "off"
+        deadline.skip("turn_analysis", f"not needed for {intent} requests")
+    if analysis_mode in ("sync", "parallel"):
+        start_turn_analysis(question, session_state)
+    if analysis_mode == "sync":
+        # Wait for the analysis only as long as the budget allows, keeping the reply's reserve;
+        # an analysis that is not ready by then is applied on a later turn
+        if deadline.allows_optional("turn_analysis"):
+            with deadline.stage("turn_analysis"):
+                collect_turn_analyses(session_state, deadline.optional_timeout(analysis_timeout))
+        else:
+            collect_turn_analyses(session_state)
     
     # Set chat as started
     session_state.chat_started = True
     
-    # Get AI response
-    response = call_openai_api(session_state)
+    # Choose the model for this turn (a faster fallback while the primary is degraded),
+    # unless the execution profile names its own
+    model = get_reply_backend().resolve_model(get_profile_model(profile, get_model_policy().select_model()))
+    
+    # Get AI response, checkpointed while it streams. The Stop button (like any other
+    # widget) reruns the script, which interrupts this call with an exception.
+    cancel_token = CancellationToken()
+    session_state.active_stream = cancel_token
+    checkpointer = ReplyCheckpointer(session_state, question, current_level, lang_code, model=model, intent=intent)
+    try:
+        with deadline.stage("reply"):
+            response = call_openai_api(session_state, deadline, model, profile, cancel_token, checkpointer)
+    except BaseException:
+        # The script run was interrupted (Stop pressed or another widget used): abort
+        # the upstream request and keep what was streamed so far for the next run
+        cancel_token.cancel()
+        if cancel_token.partial:
+            checkpointer.interrupted(cancel_token.partial)
+        else:
+            checkpointer.finish()
+        raise
+    finally:
+        session_state.active_stream = None
+    
+    if analysis_mode == "parallel":
+        if deadline.expired():
+            # Don't hold the turn up any longer, the result is applied on a later turn
+            deadline.skip("turn_analysis", "budget spent while streaming the reply")
+            collect_turn_analyses(session_state)
+        else:
+            with deadline.stage("turn_analysis"):
+                collect_turn_analyses(session_state, deadline.timeout(analysis_timeout))
+    elif analysis_mode == "deferred":
+        start_turn_analysis(question, session_state)
     
     # Add assistant response to chat
-    session_state.messages.append({"role": "assistant", "content": response})
-    session_state.chat_history.append({
-        "role": "assistant", 
-        "content": response, 
-        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        "level": current_level,  # Track level at time of message
-        "language": lang_code    # Track language at time of message
-    })
+    add_assistant_message(session_state, response, current_level, lang_code, model=model, intent=intent,
+                          usage=session_state.last_reply_usage)
+    checkpointer.finish()
+    
+    # Fold turns that left the history window into the learner memory, between turns. When the
+    # reply used up the budget the LLM is slow right now, so the update is left for the next turn.
+    if deadline.expired():
+        deadline.skip("learner_memory", "budget spent, the messages are folded after the next turn")
+    else:
+        start_learner_memory_update(session_state, lang_code)
     
     # Reset level and language change flags if they were set
     if hasattr(session_state, 'current_level_changed') and session_state.current_level_changed:
         session_state.current_level_changed = False
     if hasattr(session_state, 'language_changed') and session_state.language_changed:
         session_state.language_changed = False
+    
+    session_state.turn_budget_report = deadline.get_report()
+
+# Function to make sure an interrupted reply's question is in the chat
+def _restore_checkpoint_question(session_state, checkpoint):
+    # After a server restart the conversation may no longer contain the question
+    last_message = session_state.messages[-1] if session_state.messages else None
+    if not (last_message and last_message["role"] == "user"
+            and normalize_request_text(last_message["content"]) == normalize_request_text(checkpoint["question"])):
+        session_state.messages.append({"role": "user", "content": checkpoint["question"],
+                                       "kind": MESSAGE_KIND_DIALOGUE, "language": checkpoint["language"]})
+        session_state.chat_history.append({
+            "role": "user",
+            "content": checkpoint["question"],
+            "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "kind": MESSAGE_KIND_DIALOGUE,
+            "level": checkpoint["level"],
+            "language": checkpoint["language"]
+        })
+
+# Function to keep an interrupted reply as it is
+def finalize_interrupted_reply(session_state):
+    """
+    Add the checkpointed part of an interrupted reply to the chat, marked as truncated
+    
+    Parameters:
+    - session_state: Streamlit session state
+    """
+    checkpoint = get_reply_checkpoint(session_state)
+    if not checkpoint:
+        return
+    
+    if checkpoint["partial"]:
+        _restore_checkpoint_question(session_state, checkpoint)
+        level_code = checkpoint["level"].split()[0]
+        add_assistant_message(session_state, f"{format_level_badge(level_code)} {checkpoint['partial']}{TRUNCATED_NOTE}",
+                              checkpoint["level"], checkpoint["language"], model=checkpoint["model"],
+                              intent=checkpoint["intent"], truncated=True)
+    clear_reply_checkpoint(session_state)
+
+# Function to continue an interrupted reply
+def resume_interrupted_reply(session_state):
+    """
+    Continue an interrupted reply from its checkpoint, generating only the
+    missing part, and add the complete reply to the chat
+    
+    Parameters:
+    - session_state: Streamlit session state
+    """
+    checkpoint = get_reply_checkpoint(session_state)
+    if not checkpoint:
+        return
+    
+    _restore_checkpoint_question(session_state, checkpoint)
+    profile = EXECUTION_PROFILES.get(checkpoint["intent"], EXECUTION_PROFILES["general"])
+    
+    cancel_token = CancellationToken()
+    session_state.active_stream = cancel_token
+    checkpointer = ReplyCheckpointer(session_state, checkpoint["question"], checkpoint["level"], checkpoint["language"],
+                                     model=checkpoint["model"], intent=checkpoint["intent"])
+    checkpointer.update(checkpoint["partial"])
+    # Continue in the language and level the reply was started in, even if the
+    # learner changed them since
+    selected = (session_state.selected_language, session_state.selected_level)
+    session_state.selected_language = checkpoint["language"]
+    session_state.selected_level = checkpoint["level"]
+    try:
+        response = call_openai_api(session_state, start_turn_deadline(), checkpoint["model"], profile,
+                                   cancel_token, checkpointer, resume_from=checkpoint["partial"])
+    except BaseException:
+        cancel_token.cancel()
+        checkpointer.interrupted(cancel_token.partial or checkpoint["partial"])
+        raise
+    finally:
+        session_state.active_stream = None
+        session_state.selected_language, session_state.selected_level = selected
+    
+    add_assistant_message(session_state, response, checkpoint["level"], checkpoint["language"],
+                          model=checkpoint["model"], intent=checkpoint["intent"], usage=session_state.last_reply_usage)
+    checkpointer.finish()
 
 # Function to get MIME type description
 def get_file_type_description(mime_type):
@@ -829,116 +837,93 @@ def get_file_type_description(mime_type):
     else:
         return "file"
 
-# Function to get language display name
-def get_language_display_name(lang_code):
+# Function to build the static part of the tutor system prompt
+@functools.lru_cache(maxsize=None)
+def build_static_prompt(lang_code, lang_name, lang_flag, level, intent="general", tags=None, variant="full"):
     """
-    Get the display name for a language code
+    Build the static system prompt for a language, level and execution profile
+    from the prompt fragments relevant to the request. It only depends on its
+    arguments, so it is compiled once and cached (see warm_prompt_cache).
+    
+    Parameters:
+    - lang_code: Language code (e.g. "fin")
+    - lang_name: Display name of the language
+    - lang_flag: Flag emoji of the language
+    - level: Full level name (e.g. "B1 (Intermediate)")
+    - intent: Execution profile name
+    - tags: Frozenset of fragment tags to include (see prompt_assembler.py;
+      None uses the profile's fixed prefix)
+    - variant: Prompt variant ("full", "compact" or "minimal", see PROMPT_VARIANTS)
+    
+    Returns:
+    - System prompt text
     """
-    try:
-        # Try to import app.py to get language info
-        import app
-        if hasattr(app, 'SUPPORTED_LANGUAGES') and lang_code in app.SUPPORTED_LANGUAGES:
-            return app.SUPPORTED_LANGUAGES[lang_code]["name"]
-    except:
-        # Fallback if import fails
-        language_names = {
-            "fin": "Finnish",
-            "spa": "Spanish",
-            "fra": "French",
-            "deu": "German",
-            "ita": "Italian",
-            "jpn": "Japanese",
-            "zho": "Chinese",
-            "rus": "Russian",
-            "ara": "Arabic",
-            "por": "Portuguese",
-            "hin": "Hindi",
-            "swe": "Swedish",
-            "nld": "Dutch",
-            "tur": "Turkish"
-        }
-        return language_names.get(lang_code, "Unknown")
+    if tags is None:
+        tags = get_prefix_prompt_tags(intent)
+    return assemble_prompt(get_prompt_fragments(lang_code, lang_name, lang_flag, level, intent, variant), tags)[0]
 
-# Function to get language flag emoji
-def get_language_flag(lang_code):
+# Function to split the tutor system prompt into tagged fragments
+@functools.lru_cache(maxsize=None)
+def get_prompt_fragments(lang_code, lang_name, lang_flag, level, intent="general", variant="full"):
     """
-    Get the flag emoji for a language code
+    Get the fragments of the static system prompt in prompt order, each tagged
+    with what it is relevant to
+    
+    Parameters:
+    - lang_code: Language code (e.g. "fin")
+    - lang_name: Display name of the language
+    - lang_flag: Flag emoji of the language
+    - level: Full level name (e.g. "B1 (Intermediate)")
+    - intent: Execution profile name
+    - variant: Prompt variant
+    
+    Returns:
+    - Tuple of (name, tag, text) fragments
     """
-    try:
-        # Try to import app.py to get language info
-        import app
-        if hasattr(app, 'SUPPORTED_LANGUAGES') and lang_code in app.SUPPORTED_LANGUAGES:
-            return app.SUPPORTED_LANGUAGES[lang_code]["flag"]
-    except:
-        # Fallback if import fails
-        language_flags = {
-            "fin": "🇫🇮",
-            "spa": "🇪🇸",
-            "fra": "🇫🇷",
-            "deu": "🇩🇪",
-            "ita": "🇮🇹",
-            "jpn": "🇯🇵",
-            "zho": "🇨🇳",
-            "rus": "🇷🇺",
-            "ara": "🇸🇦",
-            "por": "🇵🇹",
-            "hin": "🇮🇳",
-            "swe": "🇸🇪",
-            "nld": "🇳🇱",
-            "tur": "🇹🇷"
-        }
-        return language_flags.get(lang_code, "🌍")
+    profile = EXECUTION_PROFILES.get(intent, EXECUTION_PROFILES["general"])
+    level_code = level.split()[0]  # Extract just the level code (A1, A2, etc.)
+    
+    # SYSTEM_PROMPT sections of the profile, the exercise catalogue split per exercise type
+    fragments = [("INTRO", "always", SYSTEM_PROMPT_INTRO)]
+    for title, section in SYSTEM_PROMPT_SECTIONS.items():
+        if profile["sections"] is not None and title not in profile["sections"]:
+            continue
+        if title == "EXERCISE TYPES":
+            catalogue = split_exercise_catalogue(section)
+            fragments.append((catalogue[0][0], catalogue[0][1], "\n" + catalogue[0][2]))
+            fragments.extend(catalogue[1:])
+        else:
+            fragments.append((title, SECTION_TAGS.get(title, "always"), "\n" + section))
+    
+    # Level-specific and language-specific part
+    fragments.append(("CURRENT LEARNER", "always", f"""
 
-# Function to call OpenAI API using LangChain's ChatOpenAI
-def call_openai_api(session_state):
-    try:
-        # Get API key and model from Streamlit secrets
-        api_key = st.secrets.get("OPENAI_API_KEY", "")
-        model_name = st.secrets.get("MODEL_NAME", "gpt-4.1-mini-2025-04-14")
-        max_tokens = st.secrets.get("MAX_TOKENS", 8000)
-        
-        if not api_key:
-            return "Error: OpenAI API key not configured. Please set up your API key in the .streamlit/secrets.toml file."
-        
-        # Initialize the LangChain OpenAI client
-        chat = ChatOpenAI(
-            openai_api_key=api_key,
-            model=model_name,
-            max_tokens=max_tokens,
-            streaming=True
-        )
-        
-        # Get current level and code
-        level = session_state.selected_level
-        level_code = level.split()[0]  # Extract just the level code (A1, A2, etc.)
-        
-        # Get current language
-        lang_code = session_state.selected_language if hasattr(session_state, 'selected_language') else "fin"
-        lang_name = get_language_display_name(lang_code)
-        lang_flag = get_language_flag(lang_code)
-        
+## CURRENT LEARNER LANGUAGE: {lang_flag} {lang_name}
+## CURRENT LEARNER LEVEL: {level} 
+"""))
+    
+    if profile["level_guidelines"]:
         # Get level-appropriate content guidelines
         level_content = get_level_appropriate_content(level_code, lang_code)
         
-        # Get CEFR level guidelines
-        cefr_guidelines = get_cefr_level_guidelines(level_code, lang_code)
-        
-        # Create a detailed level-specific and language-specific prompt
-        specific_prompt = SYSTEM_PROMPT + f"""
-
-## CURRENT LEARNER LANGUAGE: {lang_flag} {lang_name}
-## CURRENT LEARNER LEVEL: {level} 
-{cefr_guidelines}
+        fragments += [
+            # CEFR level guidelines, then the language's grammar at this level
+            ("CEFR GUIDELINES", "always", get_cefr_level_guidelines(level_code, None)),
+            ("LANGUAGE GUIDELINES", "language_grammar", get_cefr_level_guidelines(level_code, lang_code, include_base=False)),
+            ("VOCABULARY GUIDELINES", "vocabulary", f"""
 
 VOCABULARY GUIDELINES FOR {lang_name} {level_code}:
 {', '.join(level_content.get('vocabulary', ['No specific vocabulary guidelines available']))}
-
+"""),
+            ("GRAMMAR GUIDELINES", "grammar", f"""
 GRAMMAR GUIDELINES FOR {lang_name} {level_code}:
 {', '.join(level_content.get('grammar', ['No specific grammar guidelines available']))}
-
+"""),
+            ("EXAMPLE SENTENCES", "examples", f"""
 EXAMPLE SENTENCES FOR {lang_name} {level_code}:
 {' '.join(level_content.get('example_sentences', ['No example sentences available']))}
-
+"""),
+            ("LEVEL RULES", "always", f"""
 YOU MUST STRICTLY ADHERE TO THESE GUIDELINES FOR {lang_name} {level_code} LEVEL:
 1. ONLY use vocabulary appropriate for {level_code} level
 2. ONLY use grammar structures appropriate for {level_code} level
@@ -946,33 +931,79 @@ YOU MUST STRICTLY ADHERE TO THESE GUIDELINES FOR {lang_name} {level_code} LEVEL:
 4. Format your responses clearly with the level indicator
 
 Remember: Always visually include the {level_code} level indicator in your responses using a badge or highlight.
-"""
-        
-        # Add personalization based on user topics if available
-        if session_state.user_topics and len(session_state.user_topics) > 0:
-            topics_str = ", ".join(session_state.user_topics[-10:])  # Use last 10 topics for relevance
-            specific_prompt += f"\n\nThe learner has shown interest in these topics: {topics_str}. Try to incorporate these topics into examples and exercises when appropriate to personalize the learning experience. Remember to ONLY use vocabulary and grammar structures appropriate for {level_code} level when incorporating these topics."
-        
-        # Add level history information if available
-        if hasattr(session_state, 'level_history') and session_state.level_history:
-            # If user has changed levels, provide context
-            specific_prompt += "\n\nLevel progression history:"
-            for change in session_state.level_history[-3:]:  # Last 3 changes
-                change_lang = change.get('language', lang_code)
-                change_lang_name = get_language_display_name(change_lang)
-                specific_prompt += f"\n- Changed from {change['from']} to {change['to']} on {change['timestamp']} for {change_lang_name}"
-            
-            # If user recently moved up, note potential need for review
-            if session_state.level_history and len(session_state.level_history) > 0:
-                last_change = session_state.level_history[-1]
-                prev_level_code = last_change['from'].split()[0]
-                curr_level_code = last_change['to'].split()[0]
-                
-                # Check if this is a move up the CEFR scale
-                cefr_progression = {"A1": 1, "A2": 2, "B1": 3, "B2": 4, "C1": 5}
-                
-                if cefr_progression.get(prev_level_code, 0) < cefr_progression.get(curr_level_code, 0):
-                    specific_prompt += f"""
+""")
+        ]
+    else:
+        fragments.append(("LEVEL RULES", "always", f"\nKeep all explanations and examples at {level_code} level.\n"))
+    
+    return tuple(apply_prompt_variant(fragments, variant, level_code))
+
+# Function to build the per-turn part of the tutor system prompt
+def build_dynamic_prompt(session_state, profile, lang_code, lang_name, level):
+    """
+    Build the small per-turn part of the tutor prompt: learner topics, level
+    history and level/language change alerts
+    
+    Parameters:
+    - session_state: Streamlit session state
+    - profile: Execution profile dictionary
+    - lang_code: Language code
+    - lang_name: Display name of the language
+    - level: Full level name
+    
+    Returns:
+    - Per-turn context text (may be empty)
+    """
+    return "".join(get_dynamic_prompt_parts(session_state, profile, lang_code, lang_name, level).values())
+
+# Function to build the per-turn prompt context by section
+def get_dynamic_prompt_parts(session_state, profile, lang_code, lang_name, level):
+    """
+    Build the per-turn prompt context, section by section
+    
+    Parameters:
+    - session_state: Streamlit session state
+    - profile: Execution profile dictionary
+    - lang_code: Language code
+    - lang_name: Display name of the language
+    - level: Full level name
+    
+    Returns:
+    - Dictionary with the "topics", "level_history" and "alerts" texts (each may be empty)
+    """
+    level_code = level.split()[0]
+    parts = {"topics": "", "level_history": "", "alerts": ""}
+    
+    # Topics and level changes of this language only, each language is learnt separately
+    user_topics = get_user_topics(session_state, lang_code)
+    level_history = [change for change in (session_state.level_history if hasattr(session_state, 'level_history') else [])
+                     if change.get('language', "fin") == lang_code]  # Finnish for changes recorded without a language
+    
+    # Add personalization based on user topics if available
+    if profile["personalization"] and user_topics:
+        topics_str = ", ".join(user_topics[-10:])  # Use last 10 topics for relevance
+        parts["topics"] += f"\n\nThe learner has shown interest in these topics: {topics_str}. Try to incorporate these topics into examples and exercises when appropriate to personalize the learning experience. Remember to ONLY use vocabulary and grammar structures appropriate for {level_code} level when incorporating these topics."
+
+    # Add level history information if available
+    if profile["personalization"] and level_history:
+        # If user has changed levels, provide context
+        parts["level_history"] += "\n\nLevel progression history:"
+        for change in level_history[-3:]:  # Last 3 changes
+            change_lang = change.get('language', lang_code)
+            change_lang_name = get_language_display_name(change_lang)
+            parts["level_history"] += f"\n- Changed from {change['from']} to {change['to']} on {change['timestamp']} for {change_lang_name}"
+
+        # If user recently moved up, note potential need for review
+        if level_history:
+            last_change = level_history[-1]
+            prev_level_code = last_change['from'].split()[0]
+            curr_level_code = last_change['to'].split()[0]
+
+            # Check if this is a move up the CEFR scale
+            cefr_progression = {"A1": 1, "A2": 2, "B1": 3, "B2": 4, "C1": 5}
+
+            if cefr_progression.get(prev_level_code, 0) < cefr_progression.get(curr_level_code, 0):
+                parts["level_history"] += f"""
                     \n\nIMPORTANT: The learner recently progressed from {prev_level_code} to {curr_level_code}. 
                     This means:
                     1. Occasionally include review material from {prev_level_code} level
@@ -980,98 +1011,382 @@ Remember: Always visually include the {level_code} level indicator in your respo
                     3. Build bridges between what they already know and new concepts
                     4. Give extra encouragement when they master new {curr_level_code} level structures
                     """
+
+    # Check if level was recently changed
+    if hasattr(session_state, 'current_level_changed') and session_state.current_level_changed:
+        parts["alerts"] += f"""
+        \n\nALERT: The learner JUST changed their level to {level_code}. In your next response:
+        1. Acknowledge this level change explicitly
+        2. Briefly explain what {level_code} level means for {lang_name} learning
+        3. Give a short example of appropriate content for this level
+        4. Be encouraging about their language learning journey
+        """
+
+    # Check if language was recently changed
+    if hasattr(session_state, 'language_changed') and session_state.language_changed:
+        parts["alerts"] += f"""
+        \n\nALERT: The learner JUST changed their language to {lang_name}. In your next response:
+        1. Acknowledge this language change explicitly
+        2. Include a brief, appropriate greeting in {lang_name}
+        3. Briefly explain how you'll adapt to teaching {lang_name} at their {level_code} level
+        4. Be encouraging about their decision to learn {lang_name}
+        """
+    
+    return parts
+
+_prompt_cache_warmed = False
+
+# Function to precompile the static prompts
+def warm_prompt_cache(levels):
+    """
+    Compile the static prompt of every supported language, level and execution
+    profile once per process, so no turn pays for building it
+    
+    Parameters:
+    - levels: Full level names
+    """
+    global _prompt_cache_warmed
+    if _prompt_cache_warmed:
+        return
+    _prompt_cache_warmed = True
+    variant = get_setting("PROMPT_VARIANT", "full")
+    for lang_code, lang_info in SUPPORTED_LANGUAGES.items():
+        for level in levels:
+            # The complete prompt, which the tokens saved by prompt assembly are measured against
+            build_static_prompt(lang_code, lang_info["name"], lang_info["flag"], level, "general", ALL_PROMPT_TAGS)
+            for intent in EXECUTION_PROFILES:
+                build_static_prompt(lang_code, lang_info["name"], lang_info["flag"], level, intent,
+                                    get_prefix_prompt_tags(intent), variant)
+
+# Function to report static prompt cache usage
+def get_prompt_cache_stats():
+    """
+    Report how often the static prompt came from the cache
+    
+    Returns:
+    - Dictionary with hits, misses, number of cached prompts and whether the cache was warmed
+    """
+    info = build_static_prompt.cache_info()
+    return {"hits": info.hits, "misses": info.misses, "cached_prompts": info.currsize, "warmed": _prompt_cache_warmed}
+
+# Function to build the instructions of a request
+def build_request_prompt(lang_code, lang_name, lang_flag, level, intent, message, file_attached=False, variant="full"):
+    """
+    Build the tutor instructions for a request. The fragments every request of the
+    profile gets form the static system prompt, which stays byte-identical for a
+    language, level, profile and variant; the fragments chosen for this message
+    (e.g. the requested exercise type, file handling) are returned separately to
+    be sent after the cacheable prefix.
+    
+    Parameters:
+    - lang_code: Language code (e.g. "fin")
+    - lang_name: Display name of the language
+    - lang_flag: Flag emoji of the language
+    - level: Full level name (e.g. "B1 (Intermediate)")
+    - intent: Execution profile name
+    - message: Learner's message text
+    - file_attached: Whether an uploaded file is sent with the request
+    - variant: Prompt variant
+    
+    Returns:
+    - Tuple of (static system prompt, instructions for this message, names of all included fragments)
+    """
+    prefix_tags = get_prefix_prompt_tags(intent)
+    request_tags = select_prompt_tags(message, intent, file_attached) - prefix_tags
+    static_prompt = build_static_prompt(lang_code, lang_name, lang_flag, level, intent, prefix_tags, variant)
+    fragments = get_prompt_fragments(lang_code, lang_name, lang_flag, level, intent, variant)
+    request_prompt, request_fragments = assemble_prompt(fragments, request_tags)
+    return static_prompt, request_prompt, assemble_prompt(fragments, prefix_tags)[1] + request_fragments
+
+# Function to find the uploaded file sent with the current request
+def get_attached_file(session_state):
+    """
+    Get the uploaded file if it was uploaded just before this request (the latest
+    assistant message announces it), so it is sent with it
+    
+    Parameters:
+    - session_state: Streamlit session state
+    
+    Returns:
+    - Uploaded file dictionary, or None
+    """
+    uploaded_file = session_state.uploaded_file if hasattr(session_state, 'uploaded_file') else None
+    if not uploaded_file:
+        return None
+    last_assistant_message = next((msg["content"] for msg in reversed(session_state.messages)
+                                   if msg["role"] == "assistant"), None)
+    if isinstance(last_assistant_message, str) and "has been uploaded" in last_assistant_message:
+        return uploaded_file
+    return None
+
+# Function to estimate how long the reply stage still needs
+def estimate_reply_seconds(deadline, extra_prompt_tokens=0):
+    """
+    Estimate the seconds until the first token of the reply: the 90th percentile
+    of recent reply times to first token (the deadline's reserve until there are
+    samples), plus the time to read the extra prompt tokens
+    
+    Parameters:
+    - deadline: TurnDeadline of the turn
+    - extra_prompt_tokens: Prompt tokens beyond a usual request (e.g. an uploaded file)
+    
+    Returns:
+    - Estimated seconds
+    """
+    ttft = reply_latency.percentile(90)
+    if ttft is None:
+        ttft = deadline.optional_reserve
+    return ttft + extra_prompt_tokens / float(get_setting("PREFILL_TOKENS_PER_SECOND", 2000))
+
+# Function to call OpenAI API using LangChain's ChatOpenAI
+def call_openai_api(session_state, deadline=None, model=None, profile=None, cancel_token=None, checkpointer=None,
+                    resume_from=None):
+    """
+    Build the tutor prompt and stream the reply
+    
+    Parameters:
+    - session_state: Streamlit session state
+    - deadline: Optional TurnDeadline for the current turn; optional work is
+      shortened when it is nearly spent
+    - model: Model to answer with (defaults to MODEL_NAME)
+    - profile: Execution profile from intent_router (defaults to the "general" profile)
+    - cancel_token: Optional CancellationToken; cancelling it aborts the stream and
+      the partial reply is returned
+    - checkpointer: Optional ReplyCheckpointer saving the reply while it streams
+    - resume_from: Start of an interrupted reply to continue instead of answering afresh
+    
+    The messages are laid out so the provider can cache the prompt prefix: the
+    static instructions come first and are byte-identical for a language, level,
+    profile and prompt variant, then the learner memory (a summary of turns that left
+    the history window) and the conversation (without level badges). Earlier exchanges
+    relevant to the question and the per-turn context, including the instructions
+    chosen for this message, go in system messages just before the latest user message. The API's token usage is kept in session_state.last_reply_usage.
+    
+    Returns:
+    - The reply text with its level badge
+    """
+    session_state.last_reply_usage = None
+    try:
+        profile = profile or EXECUTION_PROFILES["general"]
         
-        # Check if level was recently changed
-        if hasattr(session_state, 'current_level_changed') and session_state.current_level_changed:
-            specific_prompt += f"""
-            \n\nALERT: The learner JUST changed their level to {level_code}. In your next response:
-            1. Acknowledge this level change explicitly
-            2. Briefly explain what {level_code} level means for {lang_name} learning
-            3. Give a short example of appropriate content for this level
-            4. Be encouraging about their language learning journey
-            """
+        # Get max tokens for the profile from Streamlit secrets, or the profile's default
+        max_tokens = get_profile_max_tokens(profile)
         
-        # Check if language was recently changed
-        if hasattr(session_state, 'language_changed') and session_state.language_changed:
-            specific_prompt += f"""
-            \n\nALERT: The learner JUST changed their language to {lang_name}. In your next response:
-            1. Acknowledge this language change explicitly
-            2. Include a brief, appropriate greeting in {lang_name}
-            3. Briefly explain how you'll adapt to teaching {lang_name} at their {level_code} level
-            4. Be encouraging about their decision to learn {lang_name}
-            """
+        # Get the backend for tutor replies and the model it will use
+        backend = get_reply_backend()
+        if not backend.has_credentials():
+            return "Error: OpenAI API key not configured. Please set up your API key in the .streamlit/secrets.toml file."
+        model = backend.resolve_model(model)
+        
+        # Get current level and code
+        level = session_state.selected_level
+        level_code = level.split()[0]  # Extract just the level code (A1, A2, etc.)
+        
+        # Get current language
+        lang_code = session_state.selected_language if hasattr(session_state, 'selected_language') else "fin"
+        lang_name = get_language_display_name(lang_code)
+        lang_flag = get_language_flag(lang_code)
+        
+        # Static instructions for this language, level and profile (precompiled and cached). Nothing
+        # that changes between turns goes in here, so the provider can reuse its cached prefix; the
+        # fragments chosen for this message go in the per-turn context instead.
+        question = next((msg["content"] for msg in reversed(session_state.messages) if msg["role"] == "user"), "")
+        attached_file = get_attached_file(session_state)
+        prompt_variant = get_setting("PROMPT_VARIANT", "full")
+        specific_prompt, request_prompt, included = build_request_prompt(
+            lang_code, lang_name, lang_flag, level, profile["name"], question if isinstance(question, str) else "",
+            attached_file is not None, prompt_variant)
+        
+        # Report the tokens saved compared with sending every section
+        full_prompt = build_static_prompt(lang_code, lang_name, lang_flag, level, "general", ALL_PROMPT_TAGS)
+        fragments = get_prompt_fragments(lang_code, lang_name, lang_flag, level, profile["name"], prompt_variant)
+        record_prompt_assembly(session_state, profile["name"], included,
+                               estimate_tokens(specific_prompt + request_prompt), estimate_tokens(full_prompt))
         
         formatted_messages = [{"role": "system", "content": specific_prompt}]
         
-        # Add conversation history
-        for msg in session_state.messages:
+        # Earlier turns that left the history window are sent as a summary (learner memory),
+        # after the static prefix so the prompt cache still covers the instructions
+        collect_learner_memory(session_state)
+        memory_message = get_learner_memory_message(session_state, lang_code) if profile["personalization"] else None
+        if memory_message:
+            formatted_messages.append(memory_message)
+        memory_end = len(formatted_messages)
+        
+        # Add conversation history (the dialogue in the current language, as much of it as the
+        # profile asks for and the history token budget allows, plus the current message). Notices
+        # and level badges are display-only, and dropping them keeps earlier turns identical when
+        # the level changes.
+        positions = get_context_positions(session_state.messages, lang_code)
+        if profile["history_messages"] is not None:
+            positions = positions[-(profile["history_messages"] + 1):]
+        history = [session_state.messages[position] for position in positions]
+        earlier_messages = [{"role": msg["role"],
+                             "content": strip_level_badge(msg["content"]) if msg["role"] == "assistant" else msg["content"]}
+                            for msg in history[:-1]]
+        window, dropped, window_report = fit_history(earlier_messages)
+        record_history_window(session_state, window_report)
+        window_start = positions[len(dropped)] if positions else len(session_state.messages)
+        if dropped:
+            # Fold the dropped messages into the learner memory after the turn
+            schedule_learner_memory(session_state, lang_code, window_start)
+        formatted_messages.extend(window)
+        
+        history_end = len(formatted_messages)
+        
+        # Bring back earlier exchanges relevant to the question that are no longer sent as history
+        if profile["history_messages"] != 0 and isinstance(question, str) \
+                and (deadline is None or deadline.allows_optional("history_retrieval")):
+            retrieved_message = retrieve_relevant_history(session_state, question, window_start, lang_code)
+            if retrieved_message:
+                formatted_messages.append(retrieved_message)
+        retrieved_end = len(formatted_messages)
+        
+        # Per-turn context (instructions chosen for this message, topics, level history, change
+        # alerts) after the cacheable part
+        context_parts = get_dynamic_prompt_parts(session_state, profile, lang_code, lang_name, level)
+        turn_context = (request_prompt + "".join(context_parts.values())).strip()
+        if turn_context:
+            formatted_messages.append({"role": "system", "content": turn_context})
+        
+        for msg in history[-1:]:
             formatted_messages.append({"role": msg["role"], "content": msg["content"]})
+        message_end = len(formatted_messages)
         
-        # Add file if present and it's a recent upload (check if it's in the last message)
-        if session_state.uploaded_file:
-            # Check if the file was just uploaded (mentioned in the last assistant message)
-            last_assistant_message = None
-            for msg in reversed(session_state.messages):
-                if msg["role"] == "assistant":
-                    last_assistant_message = msg["content"]
-                    break
+        # Add the file if it was uploaded just before this request
+        file_attached = False
+        if attached_file:
+            # Create a message about the uploaded file with explicit level instructions
+            level_code = session_state.selected_level.split()[0]  # Extract just the level code (A1, A2, etc.)
+            
+            # Get a friendly file type description
+            file_type_desc = get_file_type_description(session_state.uploaded_file['type'])
             
-            if last_assistant_message and "has been uploaded" in last_assistant_message:
-                # Create a message about the uploaded file with explicit level instructions
-                level_code = session_state.selected_level.split()[0]  # Extract just the level code (A1, A2, etc.)
-                
-                # Get a friendly file type description
-                file_type_desc = get_file_type_description(session_state.uploaded_file['type'])
-                
-                # Different handling based on file type
-                if session_state.uploaded_file['type'].startswith('image/'):
-                    # For images, use image_url parameter
-                    file_message = {
-                        "role": "user", 
-                        "content": [
-                            {"type": "text", "text": f"Here's an image I've uploaded. I'm learning {lang_name} at {session_state.selected_level} level. Please extract any {lang_name} text from it, translate it, and create exercises based on it that are STRICTLY appropriate for {level_code} level students. Ensure all vocabulary and grammar is EXACTLY at {level_code} level complexity - do not use any structures or words from higher levels."},
-                            {"type": "image_url", "image_url": {"url": f"data:{session_state.uploaded_file['type']};base64,{session_state.uploaded_file['base64']}"}}
-                        ]
-                    }
-                elif session_state.uploaded_file.get('is_text_file', False) and session_state.uploaded_file.get('text_content'):
-                    # For text files, include the content directly
-                    file_message = {
-                        "role": "user",
-                        "content": f"Here's a {file_type_desc} I've uploaded named '{session_state.uploaded_file['name']}'. I'm learning {lang_name} at {session_state.selected_level} level. Here's the content of the file:\n\n```\n{session_state.uploaded_file['text_content']}\n```\n\nPlease analyze this text, translate any {lang_name} content, explain grammar concepts, and create exercises based on it that are STRICTLY appropriate for {level_code} level students. Ensure all vocabulary and grammar is EXACTLY at {level_code} level complexity - do not use any structures or words from higher levels."
-                    }
-                else:
-                    # For other file types, just describe the file
-                    file_message = {
-                        "role": "user",
-                        "content": f"I've uploaded a {file_type_desc} named '{session_state.uploaded_file['name']}'. I'm learning {lang_name} at {session_state.selected_level} level. Please help me learn {lang_name} from this file by creating appropriate exercises and content for {level_code} level students. Ensure all vocabulary and grammar is EXACTLY at {level_code} level complexity - do not use any structures or words from higher levels."
-                    }
-                
-                formatted_messages.append(file_message)
+            # Different handling based on file type
+            if session_state.uploaded_file['type'].startswith('image/'):
+                # For images, use image_url parameter
+                file_message = {
+                    "role": "user", 
+                    "content": [
+                        {"type": "text", "text": f"Here's an image I've uploaded. I'm learning {lang_name} at {session_state.selected_level} level. Please extract any {lang_name} text from it, translate it, and create exercises based on it that are STRICTLY appropriate for {level_code} level students. Ensure all vocabulary and grammar is EXACTLY at {level_code} level complexity - do not use any structures or words from higher levels."},
+                        {"type": "image_url", "image_url": {"url": f"data:{session_state.uploaded_file['type']};base64,{session_state.uploaded_file['base64']}"}}
+                    ]
+                }
+            elif session_state.uploaded_file.get('is_text_file', False) and session_state.uploaded_file.get('text_content'):
+                # For text files, include the content directly
+                text_content = session_state.uploaded_file['text_content']
+                short_limit = int(get_setting("FILE_TEXT_SHORT_CHARS", 4000))
+                if deadline and len(text_content) > short_limit:
+                    # A long file delays the first token of the reply; when the reply would
+                    # not start within the remaining budget, send only the file's beginning
+                    estimate = estimate_reply_seconds(deadline, estimate_tokens(text_content))
+                    if estimate > deadline.remaining():
+                        text_content = text_content[:short_limit] + "\n[...]"
+                        deadline.skip("file_content", f"shortened to {short_limit} characters, the reply would need "
+                                                      f"about {estimate:.1f}s of {deadline.remaining():.1f}s left")
+                file_message = {
+                    "role": "user",
+                    "content": f"Here's a {file_type_desc} I've uploaded named '{session_state.uploaded_file['name']}'. I'm learning {lang_name} at {session_state.selected_level} level. Here's the content of the file:\n\n```\n{text_content}\n```\n\nPlease analyze this text, translate any {lang_name} content, explain grammar concepts, and create exercises based on it that are STRICTLY appropriate for {level_code} level students. Ensure all vocabulary and grammar is EXACTLY at {level_code} level complexity - do not use any structures or words from higher levels."
+                }
+            else:
+                # For other file types, just describe the file
+                file_message = {
+                    "role": "user",
+                    "content": f"I've uploaded a {file_type_desc} named '{session_state.uploaded_file['name']}'. I'm learning {lang_name} at {session_state.selected_level} level. Please help me learn {lang_name} from this file by creating appropriate exercises and content for {level_code} level students. Ensure all vocabulary and grammar is EXACTLY at {level_code} level complexity - do not use any structures or words from higher levels."
+                }
+            
+            formatted_messages.append(file_message)
+            file_attached = True
+        
+        if resume_from:
+            # Ask for the rest of an interrupted reply rather than a new one
+            formatted_messages.append({"role": "assistant", "content": resume_from})
+            formatted_messages.append({"role": "user", "content": "Your reply was cut off. Continue it exactly where it stopped, without repeating anything or adding an introduction."})
+        
+        # Break the request's tokens down by section, to see where the budget goes
+        fragment_texts = {name: text for name, _, text in fragments}
+        record_token_breakdown(session_state, analyze_request_tokens({
+            "system_prompt": "".join(fragment_texts[name] for name in included if name not in GUIDELINE_FRAGMENTS),
+            "cefr_guidelines": "".join(fragment_texts[name] for name in included if name in GUIDELINE_FRAGMENTS),
+            "topics": context_parts["topics"],
+            "level_history": context_parts["level_history"],
+            "alerts": context_parts["alerts"],
+            "learner_memory": formatted_messages[1:memory_end],
+            "conversation_history": formatted_messages[memory_end:history_end],
+            "retrieved_history": formatted_messages[history_end:retrieved_end],
+            "current_message": formatted_messages[message_end - 1:message_end],
+            "uploaded_file": formatted_messages[message_end:message_end + 1] if file_attached else [],
+            "resumed_reply": formatted_messages[message_end + (1 if file_attached else 0):]
+        }, max_tokens))
         
         # Set up placeholder for streaming
         placeholder = st.empty()
-        collected_content = ""
         
         # Add visual level badge to responses
         level_badge = format_level_badge(level_code)
         
+        def render(content):
+            # Check if level badge is already in the content
+            if not content.startswith('<span class="level-badge'):
+                display_content = f"{level_badge} {content}"
+            else:
+                display_content = content
+            
+            placeholder.markdown(f"""
+            <div class="chat-message assistant">
+                <div class="avatar">{lang_flag}</div>
+                <div class="message">{display_content}</div>
+            </div>
+            """, unsafe_allow_html=True)
+        
+        # Requests sharing the static prefix are routed to the same provider-side cache
+        cache_key = f"polyglot-{lang_code}-{level_code}-{profile['name']}-{prompt_variant}"
+        usage = {}
+        
         # Process streaming response
-        for chunk in chat.stream(formatted_messages):
-            if chunk.content:
-                collected_content += chunk.content
-                
-                # Check if level badge is already in the content
-                if not collected_content.startswith('<span class="level-badge'):
-                    display_content = f"{level_badge} {collected_content}"
-                else:
-                    display_content = collected_content
-                
-                placeholder.markdown(f"""
-                <div class="chat-message assistant">
-                    <div class="avatar">{lang_flag}</div>
-                    <div class="message">{display_content}</div>
-                </div>
-                """, unsafe_allow_html=True)
+        def start_stream(attempt_token):
+            # Stream on the background event loop so cancelling aborts the upstream request: the
+            # attempt's token is cancelled when a hedged duplicate wins, and with the reply's token.
+            # Rate-limited backends serve tutor replies ahead of queued helper calls.
+            if cancel_token:
+                cancel_token.on_cancel(attempt_token.cancel)
+            return iterate_async_stream(
+                lambda: backend.astream(formatted_messages, max_tokens, model, PRIORITY_INTERACTIVE,
+                                        usage=usage, cache_key=cache_key), attempt_token)
+        
+        def stream_reply():
+            collected = resume_from or ""
+            started = time.monotonic()
+            ttft = None
+            try:
+                # Transient failures before the first token are retried, and a slow
+                # first token triggers a hedged duplicate request
+                for text in stream_resilient(start_stream, reply_latency, deadline):
+                    if ttft is None:
+                        ttft = time.monotonic() - started
+                    if text:
+                        collected += text
+                        if cancel_token:
+                            cancel_token.partial = collected
+                        if checkpointer:
+                            checkpointer.update(collected)
+                        render(collected)
+            except Exception:
+                get_model_policy().record_reply(model, ttft, ok=False)
+                raise
+            get_model_policy().record_reply(model, ttft)
+            return collected, dict(usage)
+        
+        # A duplicate submission of the same request in this session (e.g. a rerun while the
+        # reply is streaming) shares its upstream call; only the first run streams, the other
+        # shows the complete reply when it is done. Other sessions never share a reply.
+        session_id = session_state.session_id if hasattr(session_state, 'session_id') else None
+        reply_key = request_key("reply", session_id, backend.name, model, max_tokens, formatted_messages)
+        collected_content, reply_usage = llm_singleflight.do(reply_key, stream_reply)
+        render(collected_content)
+        
+        # The usage numbers of the shared request
+        session_state.last_reply_usage = reply_usage or None
         
         # Add level badge to the beginning of the response if it's not already there
         if not collected_content.startswith('<span class="level-badge'):
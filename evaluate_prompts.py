@@ -0,0 +1,218 @@
+"""
+Offline evaluation of the tutor prompt variants.
+
+Replays a fixed corpus of learner requests (prompt_eval_corpus.json) against
+every prompt variant (see PROMPT_VARIANTS in prompt_assembler.py) and reports
+prompt tokens, response tokens, latency and a rule-based level-adherence
+score, so the smallest prompt that keeps quality can be adopted with the
+PROMPT_VARIANT setting.
+
+Usage:
+    python evaluate_prompts.py --backend local --record recordings.json
+    python evaluate_prompts.py --backend recorded --recordings recordings.json
+
+The "local" and "openai" backends are configured in .streamlit/secrets.toml
+(see llm_backends.py). The "recorded" backend replays responses saved with
+--record, so variants can be compared again without calling any model.
+"""
+import re
+import json
+import time
+import argparse
+from types import SimpleNamespace
+from llm_backends import get_backend
+from token_estimator import get_token_estimator, MESSAGE_OVERHEAD_TOKENS
+from intent_router import route_intent, get_profile_max_tokens
+from prompt_assembler import PROMPT_VARIANTS, select_prompt_tags
+from chatbot import build_static_prompt
+from languages import get_language_display_name, get_language_flag
+
+# Longest average sentence (in words) expected at each level
+MAX_SENTENCE_WORDS = {"A1": 12, "A2": 15, "B1": 20, "B2": 25, "C1": 40}
+
+# Grammar that should not be introduced below the level after it
+ABOVE_LEVEL_TERMS = {
+    "A1": ["subjunctive", "conditional", "passive", "pluperfect", "participle", "imperfect"],
+    "A2": ["subjunctive", "passive", "pluperfect", "participle"],
+    "B1": ["participle construction", "literary tense", "passé simple", "konjunktiv i"]
+}
+
+class RecordedBackend:
+    """Replays responses saved by an earlier run with --record"""
+    name = "recorded"
+
+    def __init__(self, path):
+        with open(path, encoding="utf-8") as f:
+            self.recordings = json.load(f)
+
+    def run(self, key, messages, max_tokens):
+        recording = self.recordings.get(key)
+        if recording is None:
+            raise KeyError(f"No recorded response for {key}")
+        return recording
+
+class LiveBackend:
+    """Sends the requests to an LLM backend and measures them"""
+    def __init__(self, name):
+        self.name = name
+        self.backend = get_backend(name)
+
+    def run(self, key, messages, max_tokens):
+        usage = {}
+        start = time.monotonic()
+        response = "".join(self.backend.stream(messages, max_tokens, usage=usage))
+        return {
+            "response": response,
+            "latency": time.monotonic() - start,
+            "prompt_tokens": usage.get("input_tokens"),
+            "response_tokens": usage.get("output_tokens")
+        }
+
+# Function to score how well a response keeps to the learner's level
+def score_level_adherence(response, level_code):
+    """
+    Rule-based level-adherence score of a tutor response
+
+    Parameters:
+    - response: Response text
+    - level_code: Learner's level code (A1, A2, etc.)
+
+    Returns:
+    - Tuple of (score between 0 and 1, dictionary of rule name to whether it passed)
+    """
+    sentences = [s for s in re.split(r'[.!?]+\s', re.sub(r'[#*|>`_-]+', ' ', response)) if s.strip()]
+    average_words = sum(len(s.split()) for s in sentences) / len(sentences) if sentences else 0
+    lowered = response.lower()
+    rules = {
+        # The level indicator is shown in the response
+        "level_indicator": level_code in response,
+        # Sentences are no longer than expected at the level
+        "sentence_length": average_words <= MAX_SENTENCE_WORDS.get(level_code, 40),
+        # No grammar from higher levels is introduced
+        "grammar_scope": not any(term in lowered for term in ABOVE_LEVEL_TERMS.get(level_code, []))
+    }
+    return sum(rules.values()) / len(rules), rules
+
+# Function to build the request of a corpus entry
+def build_request(case, variant):
+    """
+    Build the chat messages the tutor would send for a corpus entry
+
+    Parameters:
+    - case: Corpus entry (id, language, level, message)
+    - variant: Prompt variant name
+
+    Returns:
+    - Tuple of (messages, max_tokens, intent)
+    """
+    state = SimpleNamespace(messages=[], uploaded_file=None, current_level_changed=False, language_changed=False)
+    intent, profile = route_intent(case["message"], state)
+    system_prompt = build_static_prompt(case["language"], get_language_display_name(case["language"]),
+                                        get_language_flag(case["language"]), case["level"],
+                                        intent, select_prompt_tags(case["message"], intent), variant)
+    messages = [{"role": "system", "content": system_prompt}, {"role": "user", "content": case["message"]}]
+    return messages, get_profile_max_tokens(profile), intent
+
+# Function to evaluate the prompt variants
+def evaluate_variants(corpus, runner, variants, recordings=None, samples=None):
+    """
+    Replay the corpus against every variant
+
+    Parameters:
+    - corpus: List of corpus entries
+    - runner: RecordedBackend or LiveBackend
+    - variants: Variant names to evaluate
+    - recordings: Optional dictionary filled with the responses, for --record
+    - samples: Optional list filled with (prompt text, reported prompt tokens), for --calibrate
+
+    Returns:
+    - Dictionary of variant name to averaged results and per-request results
+    """
+    results = {}
+    for variant in variants:
+        cases = []
+        for case in corpus:
+            messages, max_tokens, intent = build_request(case, variant)
+            key = f"{variant}/{case['id']}"
+            run = runner.run(key, messages, max_tokens)
+            if recordings is not None:
+                recordings[key] = run
+            if samples is not None and run.get("prompt_tokens"):
+                text = "".join(m["content"] for m in messages)
+                samples.append((text, run["prompt_tokens"] - MESSAGE_OVERHEAD_TOKENS * len(messages)))
+            score, rules = score_level_adherence(run["response"], case["level"].split()[0])
+            cases.append({
+                "id": case["id"],
+                "intent": intent,
+                # Estimates when the backend reports no usage
+                "prompt_tokens": run.get("prompt_tokens") or get_token_estimator().estimate_messages(messages),
+                "response_tokens": run.get("response_tokens") or get_token_estimator().estimate(run["response"]),
+                "latency": run["latency"],
+                "adherence": score,
+                "rules": rules
+            })
+        count = len(cases) or 1
+        results[variant] = {
+            "prompt_tokens": sum(c["prompt_tokens"] for c in cases) / count,
+            "response_tokens": sum(c["response_tokens"] for c in cases) / count,
+            "latency": sum(c["latency"] for c in cases) / count,
+            "adherence": sum(c["adherence"] for c in cases) / count,
+            "cases": cases
+        }
+    return results
+
+# Function to pick the variant to adopt
+def recommend_variant(results, tolerance=0.05):
+    """
+    Pick the smallest prompt whose adherence is within the tolerance of the best one
+
+    Parameters:
+    - results: Output of evaluate_variants
+    - tolerance: Adherence that may be given up for a smaller prompt
+
+    Returns:
+    - Variant name
+    """
+    best = max(r["adherence"] for r in results.values())
+    candidates = [name for name, r in results.items() if r["adherence"] >= best - tolerance]
+    return min(candidates, key=lambda name: results[name]["prompt_tokens"])
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the tutor prompt variants on a fixed request corpus")
+    parser.add_argument("--backend", default="recorded", choices=["recorded", "local", "openai"])
+    parser.add_argument("--corpus", default="prompt_eval_corpus.json")
+    parser.add_argument("--recordings", default="prompt_eval_recordings.json",
+                        help="Responses replayed by the recorded backend")
+    parser.add_argument("--record", help="Save the responses of a live backend to this file")
+    parser.add_argument("--variants", nargs="+", default=list(PROMPT_VARIANTS))
+    parser.add_argument("--output", help="Write the detailed results as JSON to this file")
+    parser.add_argument("--calibrate", action="store_true",
+                        help="Fit the token estimator to the prompt tokens the backend reports")
+    args = parser.parse_args()
+
+    with open(args.corpus, encoding="utf-8") as f:
+        corpus = json.load(f)
+    runner = RecordedBackend(args.recordings) if args.backend == "recorded" else LiveBackend(args.backend)
+    recordings = {} if args.record else None
+    samples = [] if args.calibrate else None
+
+    results = evaluate_variants(corpus, runner, args.variants, recordings, samples)
+
+    print(f"{'variant':<10} {'prompt tokens':>14} {'response tokens':>16} {'latency (s)':>12} {'adherence':>10}")
+    for name, r in results.items():
+        print(f"{name:<10} {r['prompt_tokens']:>14.0f} {r['response_tokens']:>16.0f} {r['latency']:>12.2f} {r['adherence']:>10.2f}")
+    print(f"\nSmallest prompt that keeps quality: {recommend_variant(results)}")
+
+    if samples:
+        ratios = get_token_estimator().calibrate(samples)
+        print(f"\nCalibrated token estimator: TOKEN_CHARS_PER_TOKEN = {json.dumps(ratios)}")
+
+    if args.record:
+        with open(args.record, "w", encoding="utf-8") as f:
+            json.dump(recordings, f, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    main()
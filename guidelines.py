@@ -0,0 +1,61 @@
+import os
+import json
+from types import MappingProxyType
+
+# Versioned data file with the CEFR guidelines, level content and grammar features
+GUIDELINES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "guidelines.json")
+GUIDELINES_VERSION = 1
+
+# Function to make loaded data read-only
+def _freeze(value):
+    # Dicts become read-only mappings and lists become tuples, all the way down
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+# Function to load the guideline tables
+def load_guidelines(path=GUIDELINES_FILE):
+    """
+    Load the guideline data file and precompute every lookup
+
+    Parameters:
+    - path: Path of the JSON data file
+
+    Returns:
+    - Read-only mapping with "version", "cefr_guidelines" (level -> text),
+      "language_guidelines" (language -> level -> text), "level_content"
+      ((level, language) -> content, with the language's entries taking
+      precedence over the base ones) and "grammar_features" (language -> features)
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("version") != GUIDELINES_VERSION:
+        raise ValueError(f"Unsupported guidelines version {data.get('version')} in {path}, "
+                         f"expected {GUIDELINES_VERSION}")
+
+    def render(lines):
+        return "\n" + "\n".join(lines) + "\n"
+
+    cefr = data["cefr_guidelines"]
+    content = data["level_content"]
+    level_content = {}
+    for level_code, base in content["base"].items():
+        level_content[(level_code, None)] = base
+        for language_code, levels in content["languages"].items():
+            # A new mapping per language, so the base content is never modified
+            level_content[(level_code, language_code)] = {**base, **levels.get(level_code, {})}
+
+    return _freeze({
+        "version": data["version"],
+        "cefr_guidelines": {level_code: render(lines) for level_code, lines in cefr["base"].items()},
+        "language_guidelines": {language_code: {level_code: render(lines) for level_code, lines in levels.items()}
+                                for language_code, levels in cefr["languages"].items()},
+        "level_content": level_content,
+        "grammar_features": data["grammar_features"]
+    })
+
+# Loaded once when the module is imported. The tables are read-only, so every
+# session and thread shares them, and forked worker processes inherit them.
+GUIDELINES = load_guidelines()
@@ -0,0 +1,295 @@
+import json
+import re
+import queue
+import threading
+import time
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from llm_client import get_setting, llm_singleflight, request_key
+from llm_backends import get_helper_backend
+from llm_resilience import invoke_resilient, call_with_retry, helper_latency, get_helper_breaker
+from stream_control import run_async
+
+# System prompt for packing several small helper requests into one LLM call
+BATCH_SYSTEM_PROMPT = """You are a batch processor for a language learning application.
+You receive a JSON array of independent requests. Each request has an "index", its own "instructions" and an "input".
+Handle every request on its own, exactly as its instructions say, as if it were the only request.
+Return one result per request, with the request's index and the complete answer as the "output" string."""
+
+# JSON schema for the batched response
+BATCH_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "results": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "index": {"type": "integer"},
+                    "output": {"type": "string"}
+                },
+                "required": ["index", "output"],
+                "additionalProperties": False
+            }
+        }
+    },
+    "required": ["results"],
+    "additionalProperties": False
+}
+
+# Response tokens a batch needs per request beyond the request's own answer: the
+# {"index": ..., "output": ...} wrapper and the escaping of the answer as a JSON string
+BATCH_ITEM_OVERHEAD_TOKENS = 24
+
+class _HelperRequest:
+    """A single helper request (system + user message) waiting to be sent, alone or in a batch"""
+    def __init__(self, messages, max_tokens, response_format):
+        self.messages = messages
+        self.system_prompt = messages[0]["content"]
+        self.user_content = messages[-1]["content"]
+        self.max_tokens = max_tokens
+        self.response_format = response_format
+        self.future = Future()
+
+    def batch_tokens(self):
+        """Response tokens this request takes up in a batched call"""
+        return self.max_tokens + BATCH_ITEM_OVERHEAD_TOKENS
+
+class HelperBatchGateway:
+    """
+    Collects small helper LLM requests from all sessions over a short window,
+    sends them as one batched prompt with indexed outputs, and fans the
+    results back out to the waiting callers. A batch's response token limit is
+    the sum of its requests' limits, and requests are only packed together
+    while that sum stays within batch_max_tokens.
+    """
+    def __init__(self, window_ms=10, max_batch_size=8, batch_max_tokens=2400):
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.batch_max_tokens = batch_max_tokens
+        self._queue = queue.Queue()
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="polyglot-batch")
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "batches": 0, "batched_requests": 0, "fill_ratio_total": 0.0, "fallbacks": 0}
+        self._batch_sizes = {}
+        self._thread = threading.Thread(target=self._collect_loop, name="polyglot-batch-collector", daemon=True)
+        self._thread.start()
+
+    def submit(self, messages, max_tokens, response_format=None):
+        """
+        Queue a helper request
+
+        Parameters:
+        - messages: System and user message of the helper task
+        - max_tokens: Maximum tokens for this request's answer
+        - response_format: Optional OpenAI response_format for the answer
+
+        Returns:
+        - Future resolving to the answer text
+        """
+        request = _HelperRequest(messages, max_tokens, response_format)
+        with self._lock:
+            self._stats["requests"] += 1
+        self._queue.put(request)
+        return request.future
+
+    def _collect_loop(self):
+        carried = None
+        while True:
+            batch = [carried if carried is not None else self._queue.get()]
+            carried = None
+            batch_tokens = batch[0].batch_tokens()
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if batch_tokens + request.batch_tokens() > self.batch_max_tokens:
+                    # Does not fit this batch's token limit, it starts the next batch
+                    carried = request
+                    break
+                batch.append(request)
+                batch_tokens += request.batch_tokens()
+            self._executor.submit(self._dispatch, batch)
+
+    def _dispatch(self, batch):
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["fill_ratio_total"] += len(batch) / self.max_batch_size
+            self._batch_sizes[len(batch)] = self._batch_sizes.get(len(batch), 0) + 1
+
+        # A batch of one gains nothing from packing, so send it as is
+        if len(batch) == 1:
+            self._send_single(batch[0])
+            return
+
+        with self._lock:
+            self._stats["batched_requests"] += len(batch)
+
+        try:
+            outputs = self._send_batch(batch)
+        except Exception as e:
+            logging.warning(f"Batched helper request failed: {str(e)}. Sending requests individually.")
+            outputs = {}
+
+        for index, request in enumerate(batch):
+            if index in outputs:
+                request.future.set_result(outputs[index])
+            else:
+                # Missing or unparsable result, retry this request on its own
+                with self._lock:
+                    self._stats["fallbacks"] += 1
+                self._executor.submit(self._send_single, request)
+
+    def _send_single(self, request):
+        try:
+            request.future.set_result(invoke_helper_direct(
+                request.messages, request.max_tokens, request.response_format))
+        except Exception as e:
+            request.future.set_exception(e)
+
+    def _send_batch(self, batch):
+        items = []
+        for index, request in enumerate(batch):
+            instructions = request.system_prompt
+            if request.response_format and request.response_format.get("type") == "json_schema":
+                schema = json.dumps(request.response_format["json_schema"]["schema"])
+                instructions += f"\nThe output must be a JSON document matching this JSON schema: {schema}"
+            items.append({"index": index, "instructions": instructions, "input": request.user_content})
+
+        prompt = [
+            {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+            {"role": "user", "content": json.dumps(items, ensure_ascii=False)}
+        ]
+        backend = get_helper_backend()
+        # Every request keeps its own answer limit within the batched response
+        batch_max_tokens = sum(request.batch_tokens() for request in batch)
+        
+        def attempt():
+            return backend.invoke(prompt, batch_max_tokens, response_format={
+                "type": "json_schema",
+                "json_schema": {"name": "helper_batch", "strict": True, "schema": BATCH_RESPONSE_SCHEMA}
+            })
+        
+        # Batches are retried but not hedged, their latency is not comparable to single calls
+        response_content = call_with_retry(attempt)
+
+        outputs = {}
+        for result in parse_json_output(response_content).get("results", []):
+            index = result.get("index")
+            if isinstance(index, int) and 0 <= index < len(batch):
+                outputs[index] = result.get("output", "")
+        return outputs
+
+    def get_stats(self):
+        """
+        Report batching metrics
+
+        Returns:
+        - Dictionary with request/batch counts, average batch size and fill ratio
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["batch_sizes"] = dict(self._batch_sizes)
+        batches = stats["batches"]
+        stats["average_batch_size"] = stats["requests"] / batches if batches else 0.0
+        fill_ratio_total = stats.pop("fill_ratio_total")
+        stats["average_fill_ratio"] = fill_ratio_total / batches if batches else 0.0
+        stats["queue_depth"] = self._queue.qsize()
+        return stats
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+# Function to get the shared batching gateway
+def get_helper_gateway():
+    """
+    Get the process-wide helper batching gateway, creating it on first use
+
+    Returns:
+    - HelperBatchGateway instance
+    """
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            _gateway = HelperBatchGateway(
+                window_ms=float(get_setting("HELPER_BATCH_WINDOW_MS", 10)),
+                max_batch_size=int(get_setting("HELPER_BATCH_MAX_SIZE", 8)),
+                batch_max_tokens=int(get_setting("HELPER_BATCH_MAX_TOKENS", 2400))
+            )
+        return _gateway
+
+# Function to send one helper request straight to the LLM
+def invoke_helper_direct(messages, max_tokens, response_format=None):
+    """
+    Send a helper request as its own LLM call, on the backend named by HELPER_BACKEND
+
+    Parameters:
+    - messages: Chat messages for the request
+    - max_tokens: Maximum tokens for the answer
+    - response_format: Optional OpenAI response_format
+
+    Returns:
+    - Answer text
+    """
+    backend = get_helper_backend()
+    
+    def attempt(token):
+        # Rate-limited backends queue helper calls behind any tutor replies. The call runs
+        # on the background event loop so a losing hedged duplicate is aborted at once.
+        return run_async(lambda: backend.ainvoke(messages, max_tokens, response_format), token)
+    
+    # Transient failures are retried with backoff, slow calls are hedged
+    return invoke_resilient(attempt, helper_latency)
+
+# Function to run a small helper LLM request
+def invoke_helper(messages, max_tokens, response_format=None):
+    """
+    Run a small helper LLM request (language detection, topic extraction, ...),
+    through the batching gateway when HELPER_BATCHING is enabled. Concurrent
+    identical requests are collapsed into one upstream call. While the helper
+    circuit breaker is open this raises CircuitOpenError immediately, so
+    callers go straight to their rule-based fallbacks.
+
+    Parameters:
+    - messages: System and user message of the helper task
+    - max_tokens: Maximum tokens for the answer
+    - response_format: Optional OpenAI response_format for the answer
+
+    Returns:
+    - Answer text
+    """
+    def run():
+        if not get_setting("HELPER_BATCHING", False):
+            return invoke_helper_direct(messages, max_tokens, response_format)
+
+        future = get_helper_gateway().submit(messages, max_tokens, response_format)
+        return future.result(timeout=float(get_setting("LLM_REQUEST_TIMEOUT", 60.0)))
+
+    # Identical requests already in flight (from any session) share one upstream call
+    breaker = get_helper_breaker()
+    return llm_singleflight.do(request_key("helper", max_tokens, response_format, messages),
+                               lambda: breaker.call(run))
+
+# Function to parse a JSON answer from a helper request
+def parse_json_output(content):
+    """
+    Parse JSON from a helper answer, tolerating text around the JSON document
+
+    Parameters:
+    - content: Answer text
+
+    Returns:
+    - Parsed JSON value
+    """
+    try:
+        return json.loads(content)
+    except ValueError:
+        json_match = re.search(r'[\[{].*[\]}]', content, re.DOTALL)
+        if not json_match:
+            raise
+        return json.loads(json_match.group(0))
@@ -0,0 +1,199 @@
+import re
+import math
+import logging
+from llm_client import get_setting
+from utils import strip_level_badge
+from token_estimator import get_token_estimator
+from history_window import MESSAGE_KIND_DIALOGUE
+
+# BM25 parameters: term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Words are cut to this length, a rough stemmer that also matches inflected
+# forms such as "partitive" and "partitiivi"
+STEM_LENGTH = 7
+
+# Common English words of learner questions, which say nothing about the topic
+STOPWORDS = frozenset("""a an and are as at be but by can could do does for from have how i if in is it me
+my of on or please should so tell that the this to use used was we what when where which why will with
+would you your again more about""".split())
+
+# Longest part of a reply sent with a retrieved exchange
+MAX_RETRIEVED_REPLY_CHARS = 1200
+
+# Heading of the retrieved exchanges message sent with a request
+RETRIEVED_HEADING = "EARLIER EXCHANGES RELEVANT TO THE LEARNER'S QUESTION (from earlier in this conversation):"
+
+# Function to split text into index terms
+def tokenize(text):
+    """
+    Split text into lowercase index terms
+
+    Parameters:
+    - text: Text to split
+
+    Returns:
+    - List of terms (words of two or more letters except STOPWORDS, cut to STEM_LENGTH)
+    """
+    return [word[:STEM_LENGTH] for word in re.findall(r"\w{2,}", text.lower())
+            if not word.isdigit() and word not in STOPWORDS]
+
+class ExchangeIndex:
+    """
+    BM25 index over the exchanges (a learner message and the reply to it) of
+    session_state.chat_history. New entries are indexed incrementally, so a
+    search costs only the entries appended since the last one.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """Forget everything indexed so far"""
+        self.indexed = 0        # Entries of chat_history indexed so far
+        self.postings = {}      # Term -> {exchange id: term frequency}
+        self.lengths = {}       # Exchange id -> number of terms
+        self.languages = {}     # Exchange id -> language of the exchange
+        self.total_length = 0
+
+    def _add_terms(self, exchange_id, text):
+        terms = tokenize(text)
+        for term in terms:
+            postings = self.postings.setdefault(term, {})
+            postings[exchange_id] = postings.get(exchange_id, 0) + 1
+        self.lengths[exchange_id] = self.lengths.get(exchange_id, 0) + len(terms)
+        self.total_length += len(terms)
+
+    def update(self, chat_history):
+        """
+        Index the entries appended to the chat history since the last update
+
+        Parameters:
+        - chat_history: session_state.chat_history
+        """
+        if len(chat_history) < self.indexed:
+            # The conversation was reset, start over
+            self.reset()
+        for position in range(self.indexed, len(chat_history)):
+            entry = chat_history[position]
+            if not isinstance(entry["content"], str) or entry.get("kind", MESSAGE_KIND_DIALOGUE) != MESSAGE_KIND_DIALOGUE:
+                # Notices are not part of an exchange
+                continue
+            if entry["role"] == "user":
+                # An exchange is identified by the position of its learner message
+                self._add_terms(position, entry["content"])
+                self.languages[position] = entry.get("language")
+            elif position > 0 and chat_history[position - 1]["role"] == "user":
+                self._add_terms(position - 1, strip_level_badge(entry["content"]))
+            # Other assistant messages (e.g. greetings) are not part of an exchange
+        self.indexed = len(chat_history)
+
+    def search(self, query, k=3, before=None, language=None):
+        """
+        Find the exchanges most relevant to a query
+
+        Parameters:
+        - query: Query text (usually the learner's question)
+        - k: Maximum number of exchanges
+        - before: Only consider exchanges whose learner message comes before this position
+        - language: Only consider exchanges in this language
+
+        Returns:
+        - List of (exchange id, score) pairs, best first
+        """
+        count = len(self.lengths)
+        if not count:
+            return []
+        average_length = self.total_length / count
+        scores = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for exchange_id, frequency in postings.items():
+                if before is not None and exchange_id >= before:
+                    continue
+                if language is not None and self.languages[exchange_id] not in (None, language):
+                    continue
+                length_norm = 1 - BM25_B + BM25_B * self.lengths[exchange_id] / average_length
+                scores[exchange_id] = scores.get(exchange_id, 0.0) + \
+                    idf * frequency * (BM25_K1 + 1) / (frequency + BM25_K1 * length_norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+# Function to get the exchange index of a session
+def get_exchange_index(session_state):
+    """
+    Get the session's exchange index, brought up to date with the chat history
+
+    Parameters:
+    - session_state: Streamlit session state
+
+    Returns:
+    - ExchangeIndex instance
+    """
+    if not hasattr(session_state, 'history_index') or session_state.history_index is None:
+        session_state.history_index = ExchangeIndex()
+    session_state.history_index.update(session_state.chat_history)
+    return session_state.history_index
+
+# Function to build the message with the relevant earlier exchanges
+def retrieve_relevant_history(session_state, question, window_start, lang_code=None):
+    """
+    Find the earlier exchanges most relevant to the learner's question, among those
+    no longer sent as conversation history, and build the message that brings them back
+
+    session_state.messages and session_state.chat_history are appended to and reset
+    together (see add_assistant_message and add_notice_message in chatbot.py), so a
+    position in one is the same position in the other. The index is built over
+    chat_history, whose entries carry timestamps.
+
+    Parameters:
+    - session_state: Streamlit session state
+    - question: The learner's current message
+    - window_start: Position in session_state.messages of the first message still sent as history
+    - lang_code: Language being studied (None searches every language)
+
+    Returns:
+    - System message dictionary, or None when nothing relevant was found
+    """
+    if not get_setting("HISTORY_RETRIEVAL", True) or not question or window_start <= 0:
+        return None
+    if len(session_state.messages) != len(session_state.chat_history):
+        # The positions would point at the wrong exchanges
+        logging.warning(f"Messages ({len(session_state.messages)}) and chat history ({len(session_state.chat_history)}) "
+                        f"are out of step, earlier exchanges are not retrieved")
+        return None
+    # Position in the chat history of the first message still sent as history
+    before = window_start
+
+    index = get_exchange_index(session_state)
+    min_score = float(get_setting("HISTORY_RETRIEVAL_MIN_SCORE", 2.0))
+    results = [(exchange_id, score) for exchange_id, score
+               in index.search(question, int(get_setting("HISTORY_RETRIEVAL_TOP_K", 3)), before, lang_code)
+               if score >= min_score]
+    if not results:
+        return None
+
+    # Add exchanges from the best match down while they fit the budget, then put them in conversation order
+    budget = int(get_setting("HISTORY_RETRIEVAL_TOKEN_BUDGET", 600))
+    estimator = get_token_estimator()
+    chat_history = session_state.chat_history
+    selected = []
+    used = 0
+    for exchange_id, score in results:
+        reply = ""
+        if exchange_id + 1 < len(chat_history) and chat_history[exchange_id + 1]["role"] == "assistant" \
+                and chat_history[exchange_id + 1].get("kind", MESSAGE_KIND_DIALOGUE) == MESSAGE_KIND_DIALOGUE:
+            reply = strip_level_badge(chat_history[exchange_id + 1]["content"])[:MAX_RETRIEVED_REPLY_CHARS]
+        text = f"[{chat_history[exchange_id].get('timestamp', '')}]\nLEARNER: {chat_history[exchange_id]['content']}\nTUTOR: {reply}"
+        tokens = estimator.estimate(text)
+        if used + tokens > budget:
+            continue
+        selected.append((exchange_id, text))
+        used += tokens
+    if not selected:
+        return None
+
+    logging.info(f"Retrieved {len(selected)} earlier exchanges ({used} tokens) for the question")
+    return {"role": "system", "content": RETRIEVED_HEADING + "\n\n" + "\n\n".join(text for _, text in sorted(selected))}
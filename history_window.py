@@ -0,0 +1,134 @@
+import logging
+from llm_client import get_setting
+from intent_router import is_exercise
+from token_estimator import get_token_estimator, MESSAGE_OVERHEAD_TOKENS
+
+# Kinds of chat messages: dialogue with the tutor is sent to the model, notices (greetings,
+# language and level changes, file uploads) are only shown to the learner
+MESSAGE_KIND_DIALOGUE = "dialogue"
+MESSAGE_KIND_NOTICE = "notice"
+
+# Note put in place of the part of an elided message
+ELIDED_NOTE = "\n[... rest of this earlier message left out ...]"
+
+# Function to find the exercise the learner is still working on
+def _in_progress_exercise(messages):
+    # The latest exercise the tutor gave, if the learner has not asked for anything new since
+    # (at most one user message after it, i.e. the answers)
+    for index in range(len(messages) - 1, -1, -1):
+        message = messages[index]
+        if message["role"] == "assistant" and is_exercise(message["content"]):
+            later_user_messages = sum(1 for m in messages[index + 1:] if m["role"] == "user")
+            return index if later_user_messages <= 1 else None
+    return None
+
+# Function to check whether a message belongs to a language's conversation
+def is_in_context(message, lang_code):
+    """
+    Check whether a chat message is part of the conversation sent to the model
+    for a language
+
+    Parameters:
+    - message: Chat message (from session_state.messages or chat_history)
+    - lang_code: Language being studied
+
+    Returns:
+    - True for dialogue in that language (messages without tags count as dialogue in every language)
+    """
+    return (message.get("kind", MESSAGE_KIND_DIALOGUE) == MESSAGE_KIND_DIALOGUE
+            and message.get("language", lang_code) == lang_code)
+
+# Function to find a language's conversation among the chat messages
+def get_context_positions(messages, lang_code):
+    """
+    Find the messages of the conversation for a language. Each language keeps its
+    own conversation, so switching back to a language continues where it was left.
+
+    Parameters:
+    - messages: session_state.messages
+    - lang_code: Language being studied
+
+    Returns:
+    - Positions in messages of the dialogue in that language, oldest first
+    """
+    return [position for position, message in enumerate(messages) if is_in_context(message, lang_code)]
+
+# Function to fit the conversation history into a token budget
+def fit_history(messages, budget_tokens=None, keep_turns=None):
+    """
+    Choose the earlier messages sent with a request. The latest turns and any
+    exercise still in progress are always kept; older messages are added from
+    the newest back while they fit the budget, and the first one that does not
+    fit is shortened (elided) if that makes it fit. Everything older is dropped.
+
+    Parameters:
+    - messages: Earlier chat messages, oldest first (without the current message)
+    - budget_tokens: Token budget (defaults to HISTORY_TOKEN_BUDGET)
+    - keep_turns: Latest user/assistant turns always kept (defaults to HISTORY_KEEP_TURNS)
+
+    Returns:
+    - Tuple of (messages to send, dropped messages oldest first, report dictionary
+      with the number of messages included, elided and dropped and the tokens included)
+    """
+    if budget_tokens is None:
+        budget_tokens = int(get_setting("HISTORY_TOKEN_BUDGET", 3000))
+    if keep_turns is None:
+        keep_turns = int(get_setting("HISTORY_KEEP_TURNS", 2))
+    estimator = get_token_estimator()
+
+    def cost(message):
+        return estimator.estimate_content(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+    # The latest turns and the exercise in progress (with everything after it) stay
+    start = max(len(messages) - 2 * keep_turns, 0)
+    exercise = _in_progress_exercise(messages)
+    if exercise is not None:
+        start = min(start, exercise)
+    kept = list(messages[start:])
+    used = sum(cost(m) for m in kept)
+
+    elided = 0
+    index = start - 1
+    while index >= 0:
+        message = messages[index]
+        message_cost = cost(message)
+        if used + message_cost <= budget_tokens:
+            kept.insert(0, message)
+            used += message_cost
+            index -= 1
+            continue
+        # Keep the beginning of a long text message if that fits
+        remaining = budget_tokens - used - MESSAGE_OVERHEAD_TOKENS - estimator.estimate(ELIDED_NOTE)
+        if isinstance(message["content"], str) and remaining >= 50:
+            ratio = remaining / max(message_cost - MESSAGE_OVERHEAD_TOKENS, 1)
+            shortened = dict(message, content=message["content"][:int(len(message["content"]) * ratio)] + ELIDED_NOTE)
+            kept.insert(0, shortened)
+            used += cost(shortened)
+            elided = 1
+            index -= 1
+        break
+
+    dropped = list(messages[:index + 1])
+    report = {
+        "messages_total": len(messages),
+        "messages_included": len(kept),
+        "messages_elided": elided,
+        "messages_dropped": len(dropped),
+        "tokens_included": used,
+        "budget_tokens": budget_tokens
+    }
+    return kept, dropped, report
+
+# Function to record the history window of a turn
+def record_history_window(session_state, report):
+    """
+    Keep the history window report of the turn in session_state.history_window and log it
+
+    Parameters:
+    - session_state: Streamlit session state
+    - report: Report returned by fit_history
+    """
+    session_state.history_window = report
+    logging.info(f"History window: {report['messages_included']} of {report['messages_total']} messages "
+                 f"({report['messages_elided']} elided, {report['messages_dropped']} dropped), "
+                 f"{report['tokens_included']} of {report['budget_tokens']} tokens")
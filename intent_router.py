@@ -0,0 +1,189 @@
+import re
+from llm_client import get_setting
+
+# Execution profiles per request type. Each profile has its name and sets:
+# - model_setting: secret naming a model for this profile (unset uses the turn's model)
+# - max_tokens_setting: secret overriding this profile's response token limit
+# - max_tokens: default response token limit (None uses MAX_TOKENS)
+# - history_messages: earlier chat messages sent along (None sends the whole conversation)
+# - sections: SYSTEM_PROMPT sections to include (None includes all of them)
+# - level_guidelines: whether the CEFR, vocabulary and grammar guidelines are added
+# - personalization: whether learner topics and level history are added
+# - turn_analysis: whether the message is analysed for topics, exercise parameters and language
+EXECUTION_PROFILES = {
+    "translation": {
+        "name": "translation",
+        "model_setting": "TRANSLATION_MODEL_NAME",
+        "max_tokens_setting": "TRANSLATION_MAX_TOKENS",
+        "max_tokens": 800,
+        "history_messages": 0,
+        "sections": ["LEVEL ADAPTATION", "TRANSLATION & EXPLANATIONS", "FORMATTING AND INTERACTION"],
+        "level_guidelines": False,
+        "personalization": False,
+        "turn_analysis": False
+    },
+    "grammar": {
+        "name": "grammar",
+        "model_setting": "GRAMMAR_MODEL_NAME",
+        "max_tokens_setting": "GRAMMAR_MAX_TOKENS",
+        "max_tokens": 2000,
+        "history_messages": 4,
+        "sections": ["LEVEL ADAPTATION", "TRANSLATION & EXPLANATIONS", "PERSONALIZATION", "FORMATTING AND INTERACTION"],
+        "level_guidelines": True,
+        "personalization": False,
+        "turn_analysis": True
+    },
+    "exercise": {
+        "name": "exercise",
+        "model_setting": "EXERCISE_MODEL_NAME",
+        "max_tokens_setting": "EXERCISE_MAX_TOKENS",
+        "max_tokens": 4000,
+        "history_messages": 8,
+        "sections": ["CORE CAPABILITIES", "LEVEL ADAPTATION", "EXERCISE TYPES", "FEEDBACK APPROACH",
+                     "PERSONALIZATION", "FORMATTING AND INTERACTION"],
+        "level_guidelines": True,
+        "personalization": True,
+        "turn_analysis": True
+    },
+    "answer_check": {
+        "name": "answer_check",
+        "model_setting": "ANSWER_CHECK_MODEL_NAME",
+        "max_tokens_setting": "ANSWER_CHECK_MAX_TOKENS",
+        "max_tokens": 3000,
+        "history_messages": 8,
+        "sections": ["LEVEL ADAPTATION", "EXERCISE TYPES", "FEEDBACK APPROACH", "FORMATTING AND INTERACTION"],
+        "level_guidelines": True,
+        "personalization": False,
+        "turn_analysis": True
+    },
+    "general": {
+        "name": "general",
+        "model_setting": None,
+        "max_tokens_setting": None,
+        "max_tokens": None,
+        "history_messages": None,
+        "sections": None,
+        "level_guidelines": True,
+        "personalization": True,
+        "turn_analysis": True
+    }
+}
+
+# Patterns used by the intent router
+TRANSLATION_PATTERN = re.compile(r'^\s*T\s*:', re.IGNORECASE)
+EXERCISE_REQUEST_PATTERN = re.compile(
+    r'\b(give|create|make|generate|want|need|another|new|more|start|let\'?s do|can you)\b.*'
+    r'\b(exercises?|quiz(zes)?|practice|reading|writing|vocabulary|vocab|test)\b'
+    r'|\b(exercises?|quiz)\s+(about|on|for)\b', re.IGNORECASE)
+ANSWER_CHECK_PATTERN = re.compile(r'\b(check|correct|evaluate|grade)\b.*\b(answers?|translation|text|this|my)\b'
+                                  r'|\bmy answers?\b|^\s*(\d+[.)]|[a-d][.)])\s*\S', re.IGNORECASE)
+# "why" and "explain" only count when they ask about a form, not in any question
+GRAMMAR_PATTERN = re.compile(r'\b(grammar|conjugat\w*|declension|declin\w*|tenses?|case|cases|plural|'
+                             r'verb|verbs|noun|nouns|adjectives?|pronouns?|particles?|suffix\w*|prefix\w*|'
+                             r'difference between|when do i use|how do i use)\b'
+                             r'|\bwhy (is|are|do|does) (it|they|you|we|one|this|that)\b.*\b(not|instead of|say|use|written|spelled)\b'
+                             r'|\bexplain (the |this |that )?(rule|ending|form|word order|meaning)\b', re.IGNORECASE)
+# An exercise names itself (exercise, quiz, fill in, ...) and has numbered items
+EXERCISE_MARKER_PATTERN = re.compile(r'\b(exercises?|quiz|translate these|answer the following|fill[ -]in)\b', re.IGNORECASE)
+EXERCISE_ITEM_PATTERN = re.compile(r'^\s*(\*\*)?\d+[.)]\s*\S', re.MULTILINE)
+
+# Function to route a user message to an execution profile
+def route_intent(message, session_state):
+    """
+    Pick the execution profile for a user message with cheap rule-based checks
+
+    Parameters:
+    - message: User's message text
+    - session_state: Streamlit session state (messages, uploaded file and change flags are read)
+
+    Returns:
+    - Tuple of (intent name, profile dictionary)
+    """
+    if not get_setting("INTENT_ROUTING", True):
+        return "general", EXECUTION_PROFILES["general"]
+
+    # Level/language changes and fresh uploads need the full prompt
+    if ((hasattr(session_state, 'current_level_changed') and session_state.current_level_changed)
+            or (hasattr(session_state, 'language_changed') and session_state.language_changed)
+            or _file_just_uploaded(session_state)):
+        return "general", EXECUTION_PROFILES["general"]
+
+    intent = "general"
+    if TRANSLATION_PATTERN.match(message):
+        intent = "translation"
+    elif EXERCISE_REQUEST_PATTERN.search(message):
+        intent = "exercise"
+    elif ANSWER_CHECK_PATTERN.search(message):
+        intent = "answer_check"
+    elif GRAMMAR_PATTERN.search(message):
+        intent = "grammar"
+    elif _follows_exercise(session_state):
+        intent = "answer_check"
+
+    return intent, EXECUTION_PROFILES[intent]
+
+def _last_assistant_message(session_state):
+    messages = session_state.messages if hasattr(session_state, 'messages') else []
+    for msg in reversed(messages):
+        if msg["role"] == "assistant":
+            return msg["content"]
+    return None
+
+def _file_just_uploaded(session_state):
+    # Same check call_openai_api uses to decide whether to attach the file
+    if not (hasattr(session_state, 'uploaded_file') and session_state.uploaded_file):
+        return False
+    last_assistant_message = _last_assistant_message(session_state)
+    return bool(last_assistant_message) and "has been uploaded" in last_assistant_message
+
+def _follows_exercise(session_state):
+    # A message right after an exercise, that is not a new request, is most likely the learner's answers
+    last_assistant_message = _last_assistant_message(session_state)
+    return bool(last_assistant_message) and is_exercise(last_assistant_message)
+
+# Function to check whether a tutor message is an exercise
+def is_exercise(content):
+    """
+    Check whether a tutor message sets an exercise for the learner
+
+    Parameters:
+    - content: Message text
+
+    Returns:
+    - True when the message names an exercise (exercise, quiz, fill in, ...) and has at least two numbered items
+    """
+    return (isinstance(content, str) and bool(EXERCISE_MARKER_PATTERN.search(content))
+            and len(EXERCISE_ITEM_PATTERN.findall(content)) >= 2)
+
+# Function to get the model for an execution profile
+def get_profile_model(profile, default_model):
+    """
+    Get the model configured for a profile
+
+    Parameters:
+    - profile: Execution profile dictionary
+    - default_model: Model chosen for the turn (e.g. by the model policy)
+
+    Returns:
+    - Model name
+    """
+    if profile["model_setting"]:
+        return get_setting(profile["model_setting"], None) or default_model
+    return default_model
+
+# Function to get the response token limit for an execution profile
+def get_profile_max_tokens(profile):
+    """
+    Get the response token limit configured for a profile
+
+    Parameters:
+    - profile: Execution profile dictionary
+
+    Returns:
+    - The profile's setting if set, else its default limit, else MAX_TOKENS
+    """
+    if profile["max_tokens_setting"]:
+        max_tokens = get_setting(profile["max_tokens_setting"], None)
+        if max_tokens:
+            return int(max_tokens)
+    return profile["max_tokens"] or int(get_setting("MAX_TOKENS", 8000))
@@ -0,0 +1,94 @@
+# Registry of the supported languages. It has no dependencies, so every module
+# can import it without pulling in the Streamlit app.
+
+# Define supported languages with their ISO codes, names and flags
+# This can be extended with more languages as needed
+SUPPORTED_LANGUAGES = {
+    "fin": {"name": "Finnish", "flag": "🇫🇮", "native_name": "Suomi"},
+    "spa": {"name": "Spanish", "flag": "🇪🇸", "native_name": "Español"},
+    "fra": {"name": "French", "flag": "🇫🇷", "native_name": "Français"},
+    "deu": {"name": "German", "flag": "🇩🇪", "native_name": "Deutsch"},
+    "ita": {"name": "Italian", "flag": "🇮🇹", "native_name": "Italiano"},
+    "rus": {"name": "Russian", "flag": "🇷🇺", "native_name": "Русский"},
+    "swe": {"name": "Swedish", "flag": "🇸🇪", "native_name": "Svenska"},
+}
+
+# Define common greetings for each language
+LANGUAGE_GREETINGS = {
+    "fin": {
+        "morning": "Hyvää huomenta!",
+        "afternoon": "Hyvää päivää!",
+        "evening": "Hyvää iltaa!"
+    },
+    "spa": {
+        "morning": "¡Buenos días!",
+        "afternoon": "¡Buenas tardes!",
+        "evening": "¡Buenas noches!"
+    },
+    "fra": {
+        "morning": "Bonjour!",
+        "afternoon": "Bon après-midi!",
+        "evening": "Bonsoir!"
+    },
+    "deu": {
+        "morning": "Guten Morgen!",
+        "afternoon": "Guten Tag!",
+        "evening": "Guten Abend!"
+    },
+    "ita": {
+        "morning": "Buongiorno!",
+        "afternoon": "Buon pomeriggio!",
+        "evening": "Buonasera!"
+    },
+    "rus": {
+        "morning": "Доброе утро!",
+        "afternoon": "Добрый день!",
+        "evening": "Добрый вечер!"
+    },
+    "swe": {
+        "morning": "God morgon!",
+        "afternoon": "God dag!",
+        "evening": "God kväll!"
+    }
+}
+
+# Function to get language display name
+def get_language_display_name(lang_code):
+    """
+    Get the display name for a language code
+
+    Parameters:
+    - lang_code: Three-letter language code
+
+    Returns:
+    - Language name, or "Unknown" for unsupported codes
+    """
+    language = SUPPORTED_LANGUAGES.get(lang_code)
+    return language["name"] if language else "Unknown"
+
+# Function to get language flag emoji
+def get_language_flag(lang_code):
+    """
+    Get the flag emoji for a language code
+
+    Parameters:
+    - lang_code: Three-letter language code
+
+    Returns:
+    - Flag emoji, or 🌍 for unsupported codes
+    """
+    language = SUPPORTED_LANGUAGES.get(lang_code)
+    return language["flag"] if language else "🌍"
+
+# Function to get the greetings of a language
+def get_language_greetings(lang_code):
+    """
+    Get the morning, afternoon and evening greetings of a language
+
+    Parameters:
+    - lang_code: Three-letter language code
+
+    Returns:
+    - Dictionary of greetings (Finnish ones for languages without greetings)
+    """
+    return LANGUAGE_GREETINGS.get(lang_code, LANGUAGE_GREETINGS["fin"])
@@ -0,0 +1,178 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from llm_client import get_setting
+from helper_gateway import invoke_helper
+from utils import strip_level_badge
+from languages import get_language_display_name
+from history_window import is_in_context
+
+# Longest part of a single message passed to the summarizer
+MAX_FOLDED_MESSAGE_CHARS = 2000
+
+# Heading of the learner memory message sent with a request
+LEARNER_MEMORY_HEADING = "LEARNER MEMORY (summary of the earlier conversation, which is not shown below):"
+
+# Worker pool for summaries, so they never block the tutor reply
+_memory_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="polyglot-memory")
+
+# Function to get the learner memory of a language
+def get_learner_memory(session_state, lang_code):
+    """
+    Get the session's learner memory for a language, creating it on first use.
+    Each language has its own, like its own conversation.
+
+    Parameters:
+    - session_state: Streamlit session state
+    - lang_code: Language being studied
+
+    Returns:
+    - Dictionary with the running "summary", the position in session_state.messages
+      up to which it covers the conversation ("covered"), the position up to which it
+      should ("fold_until") and the summary being updated in the background ("pending")
+    """
+    if not hasattr(session_state, 'learner_memory') or not session_state.learner_memory:
+        session_state.learner_memory = {}
+    if lang_code not in session_state.learner_memory:
+        session_state.learner_memory[lang_code] = {"summary": "", "covered": 0, "fold_until": 0, "pending": None}
+    return session_state.learner_memory[lang_code]
+
+# Function to fold messages into the running summary
+def fold_into_summary(summary, messages, language_name="unknown", level="unknown", max_tokens=250):
+    """
+    Update the learner memory summary with messages that left the history window.
+    Language and level are passed in rather than read from session state so this
+    can run in a background thread.
+
+    Parameters:
+    - summary: Current summary text (may be empty)
+    - messages: Messages to fold in, oldest first
+    - language_name: Language the learner is studying
+    - level: Learner's level
+    - max_tokens: Maximum tokens of the new summary
+
+    Returns:
+    - New summary text
+    """
+    lines = []
+    for message in messages:
+        content = message["content"] if isinstance(message["content"], str) else "[uploaded file]"
+        if message["role"] == "assistant":
+            content = strip_level_badge(content)
+        lines.append(f"{message['role'].upper()}: {content[:MAX_FOLDED_MESSAGE_CHARS]}")
+
+    prompt = [
+        {
+            "role": "system",
+            "content": f"""You maintain the learner memory of a language tutoring conversation.
+            The learner is studying {language_name} at {level} level.
+
+            Update the current memory with the new conversation excerpt. Keep:
+            1. Grammar points and vocabulary themes already practised
+            2. Mistakes the learner made and concepts they found difficult
+            3. Exercises done and how well the learner did
+            4. The learner's goals, interests and preferences
+
+            Merge the excerpt into the memory instead of appending a retelling of it, and drop details
+            that no longer matter. Use short bullet points and at most {int(max_tokens * 0.6)} words.
+            Return only the updated memory."""
+        },
+        {
+            "role": "user",
+            "content": f"Current memory:\n{summary or '(empty)'}\n\nNew conversation excerpt:\n" + "\n\n".join(lines)
+        }
+    ]
+    return invoke_helper(prompt, max_tokens=max_tokens).strip()
+
+# Function to note which messages left the history window
+def schedule_learner_memory(session_state, lang_code, fold_until):
+    """
+    Note that the language's messages before a position of session_state.messages
+    are no longer sent with requests, so they are folded into the learner memory
+    after the turn
+
+    Parameters:
+    - session_state: Streamlit session state
+    - lang_code: Language being studied
+    - fold_until: Position of the first message still sent with requests
+    """
+    memory = get_learner_memory(session_state, lang_code)
+    memory["fold_until"] = max(memory["fold_until"], fold_until)
+
+# Function to start updating the learner memory in the background
+def start_learner_memory_update(session_state, lang_code):
+    """
+    Fold the messages that left the history window since the last update into the
+    summary, on a worker thread. Only one update runs at a time; messages that leave
+    the window meanwhile are folded in by the next one.
+
+    Parameters:
+    - session_state: Streamlit session state (read here, never from the worker thread)
+    - lang_code: Language of the conversation
+    """
+    if not get_setting("LEARNER_MEMORY", True):
+        return
+    memory = get_learner_memory(session_state, lang_code)
+    if memory["pending"] is not None or memory["fold_until"] <= memory["covered"]:
+        return
+
+    level = session_state.selected_level if hasattr(session_state, 'selected_level') else "unknown"
+    messages = [message for message in session_state.messages[memory["covered"]:memory["fold_until"]]
+                if is_in_context(message, lang_code)]
+    max_tokens = int(get_setting("LEARNER_MEMORY_MAX_TOKENS", 250))
+
+    future = _memory_executor.submit(fold_into_summary, memory["summary"], messages,
+                                     get_language_display_name(lang_code), level, max_tokens)
+    memory["pending"] = (future, memory["fold_until"])
+
+# Function to apply finished learner memory updates
+def collect_learner_memory(session_state, timeout=0):
+    """
+    Replace the summaries with the results of the background updates that have finished
+
+    Parameters:
+    - session_state: Streamlit session state
+    - timeout: Maximum number of seconds to wait for each unfinished update
+    """
+    if not hasattr(session_state, 'learner_memory') or not session_state.learner_memory:
+        return
+
+    for lang_code, memory in session_state.learner_memory.items():
+        if memory["pending"] is None:
+            continue
+
+        future, covered = memory["pending"]
+        try:
+            summary = future.result(timeout=timeout)
+        except FutureTimeoutError:
+            # Leave it running, the result is applied on a later turn
+            continue
+        except Exception as e:
+            # The messages stay unfolded and are tried again after the next turn
+            logging.warning(f"Learner memory update failed: {str(e)}")
+            memory["pending"] = None
+            continue
+
+        memory["pending"] = None
+        if summary:
+            logging.info(f"Learner memory for {lang_code} now covers the first {covered} messages "
+                         f"({len(summary)} characters)")
+            memory["summary"] = summary
+            memory["covered"] = covered
+
+# Function to build the learner memory message of a request
+def get_learner_memory_message(session_state, lang_code):
+    """
+    Build the system message carrying the learner memory, sent in place of the
+    messages that left the history window
+
+    Parameters:
+    - session_state: Streamlit session state
+    - lang_code: Language being studied
+
+    Returns:
+    - System message dictionary, or None while there is no summary
+    """
+    summary = get_learner_memory(session_state, lang_code)["summary"]
+    if not summary:
+        return None
+    return {"role": "system", "content": f"{LEARNER_MEMORY_HEADING}\n{summary}"}
@@ -0,0 +1,383 @@
+import abc
+import json
+import time
+import threading
+from llm_client import get_chat_client, get_setting, DEFAULT_MODEL_NAME
+from llm_scheduler import get_llm_scheduler, estimate_request_tokens, PRIORITY_HELPER
+from token_estimator import get_token_estimator
+
+class LLMBackend(abc.ABC):
+    """
+    Interface for the services that answer LLM requests. Messages are
+    OpenAI-style dicts; results are plain text. Every backend keeps its own
+    latency and throughput statistics so they can be compared side by side.
+    """
+    name = "backend"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {"requests": 0, "errors": 0, "latency_total": 0.0,
+                       "streams": 0, "ttft_total": 0.0, "output_chars": 0, "output_tokens": 0.0, "output_seconds": 0.0,
+                       "input_tokens": 0, "cached_tokens": 0}
+
+    @abc.abstractmethod
+    def resolve_model(self, model=None):
+        """Model this backend will actually use for a requested model name"""
+
+    def has_credentials(self):
+        """Whether the backend has what it needs to authenticate its requests"""
+        return True
+
+    def invoke(self, messages, max_tokens, response_format=None, model=None, priority=PRIORITY_HELPER):
+        """
+        Send a request and wait for the complete answer
+
+        Parameters:
+        - messages: Chat messages
+        - max_tokens: Maximum tokens for the answer
+        - response_format: Optional OpenAI response_format
+        - model: Model name (defaults to the backend's model)
+        - priority: Scheduling priority for rate-limited backends
+
+        Returns:
+        - Answer text
+        """
+        start = time.monotonic()
+        try:
+            content = self._invoke(messages, max_tokens, response_format, model, priority)
+        except Exception:
+            self._record_error()
+            raise
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["latency_total"] += elapsed
+            self._stats["output_chars"] += len(content)
+            self._stats["output_tokens"] += get_token_estimator().count(content)
+            self._stats["output_seconds"] += elapsed
+        return content
+
+    async def ainvoke(self, messages, max_tokens, response_format=None, model=None, priority=PRIORITY_HELPER):
+        """
+        Async version of invoke(); cancelling the task aborts the request
+
+        Returns:
+        - Answer text
+        """
+        start = time.monotonic()
+        try:
+            content = await self._ainvoke(messages, max_tokens, response_format, model, priority)
+        except Exception:
+            self._record_error()
+            raise
+        elapsed = time.monotonic() - start
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["latency_total"] += elapsed
+            self._stats["output_chars"] += len(content)
+            self._stats["output_tokens"] += get_token_estimator().count(content)
+            self._stats["output_seconds"] += elapsed
+        return content
+
+    def stream(self, messages, max_tokens, model=None, priority=PRIORITY_HELPER, usage=None, cache_key=None):
+        """
+        Send a request and yield the answer as it is generated
+
+        Parameters:
+        - messages: Chat messages
+        - max_tokens: Maximum tokens for the answer
+        - model: Model name (defaults to the backend's model)
+        - priority: Scheduling priority for rate-limited backends
+        - usage: Optional dictionary filled with the token usage reported by the API
+          (input_tokens, output_tokens, cached_tokens)
+        - cache_key: Optional key grouping requests that share a prompt prefix
+
+        Returns:
+        - Generator of text chunks (the first one may be empty)
+        """
+        start = time.monotonic()
+        first = None
+        chars = 0
+        tokens = 0.0
+        estimator = get_token_estimator()
+        try:
+            for text, chunk_usage in self._stream(messages, max_tokens, model, priority, cache_key):
+                if chunk_usage:
+                    self._record_usage(chunk_usage, usage)
+                if first is None:
+                    first = time.monotonic()
+                chars += len(text)
+                tokens += estimator.count(text)
+                yield text
+        except Exception:
+            self._record_error()
+            raise
+        self._record_stream(start, first, chars, tokens)
+
+    async def astream(self, messages, max_tokens, model=None, priority=PRIORITY_HELPER, usage=None, cache_key=None):
+        """
+        Async version of stream()
+
+        Returns:
+        - Async generator of text chunks
+        """
+        start = time.monotonic()
+        first = None
+        chars = 0
+        tokens = 0.0
+        estimator = get_token_estimator()
+        try:
+            async for text, chunk_usage in self._astream(messages, max_tokens, model, priority, cache_key):
+                if chunk_usage:
+                    self._record_usage(chunk_usage, usage)
+                if first is None:
+                    first = time.monotonic()
+                chars += len(text)
+                tokens += estimator.count(text)
+                yield text
+        except Exception:
+            self._record_error()
+            raise
+        self._record_stream(start, first, chars, tokens)
+
+    @abc.abstractmethod
+    def _invoke(self, messages, max_tokens, response_format, model, priority):
+        """Send the request and return the answer text"""
+
+    @abc.abstractmethod
+    async def _ainvoke(self, messages, max_tokens, response_format, model, priority):
+        """Async version of _invoke()"""
+
+    @abc.abstractmethod
+    def _stream(self, messages, max_tokens, model, priority, cache_key):
+        """Generator of (text, usage) pairs; usage is None except on the chunk reporting it"""
+
+    @abc.abstractmethod
+    def _astream(self, messages, max_tokens, model, priority, cache_key):
+        """Async generator of (text, usage) pairs, like _stream()"""
+
+    def _record_usage(self, chunk_usage, usage):
+        with self._lock:
+            self._stats["input_tokens"] += chunk_usage["input_tokens"]
+            self._stats["cached_tokens"] += chunk_usage["cached_tokens"]
+        if usage is not None:
+            usage.update(chunk_usage)
+
+    def _record_error(self):
+        with self._lock:
+            self._stats["errors"] += 1
+
+    def _record_stream(self, start, first, chars, tokens):
+        end = time.monotonic()
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["streams"] += 1
+            self._stats["latency_total"] += end - start
+            self._stats["ttft_total"] += (first or end) - start
+            self._stats["output_chars"] += chars
+            self._stats["output_tokens"] += tokens
+            # Generation throughput is measured from the first chunk
+            self._stats["output_seconds"] += end - (first or start)
+
+    def get_stats(self):
+        """
+        Report latency and throughput for this backend
+
+        Returns:
+        - Dictionary with request and error counts, average latency, average
+          time to first token for streams and output throughput
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        requests = stats["requests"]
+        latency_total = stats.pop("latency_total")
+        stats["average_latency"] = latency_total / requests if requests else 0.0
+        ttft_total = stats.pop("ttft_total")
+        stats["average_ttft"] = ttft_total / stats["streams"] if stats["streams"] else 0.0
+        output_seconds = stats.pop("output_seconds")
+        # Output tokens are estimated (see token_estimator.py)
+        output_tokens = stats.pop("output_tokens")
+        stats["output_tokens_per_second"] = output_tokens / output_seconds if output_seconds else 0.0
+        # Share of prompt tokens served from the provider's prompt cache
+        stats["cache_hit_rate"] = stats["cached_tokens"] / stats["input_tokens"] if stats["input_tokens"] else 0.0
+        stats["model"] = self.resolve_model()
+        return stats
+
+def _chunk_usage(chunk):
+    # LangChain reports usage on the last streamed chunk (stream_usage=True)
+    usage = getattr(chunk, "usage_metadata", None)
+    if not usage:
+        return None
+    details = usage.get("input_token_details") or {}
+    return {
+        "input_tokens": usage.get("input_tokens", 0),
+        "output_tokens": usage.get("output_tokens", 0),
+        "cached_tokens": details.get("cache_read", 0) or 0
+    }
+
+class OpenAIBackend(LLMBackend):
+    """The OpenAI API, through the pooled ChatOpenAI clients and the shared rate limiter"""
+    name = "openai"
+    rate_limited = True
+
+    def __init__(self, base_url=None, api_key=None, default_model=None):
+        super().__init__()
+        self.base_url = base_url
+        self.api_key = api_key
+        self.default_model = default_model
+
+    def resolve_model(self, model=None):
+        return model or self.default_model or get_setting("MODEL_NAME", DEFAULT_MODEL_NAME)
+
+    def has_credentials(self):
+        # The OpenAI API needs a key, from the backend's configuration or the secrets
+        return bool(self.api_key or get_setting("OPENAI_API_KEY", ""))
+
+    def _client(self, model, max_tokens, streaming):
+        return get_chat_client(model=self.resolve_model(model), max_tokens=max_tokens, streaming=streaming,
+                               base_url=self.base_url, api_key=self.api_key)
+
+    def _acquire(self, messages, max_tokens, priority):
+        if self.rate_limited:
+            # Wait for rate limit budget; tutor replies go ahead of queued helper calls
+            get_llm_scheduler().acquire(priority, estimate_request_tokens(messages, max_tokens))
+
+    async def _acquire_async(self, messages, max_tokens, priority):
+        if self.rate_limited:
+            await get_llm_scheduler().acquire_async(priority, estimate_request_tokens(messages, max_tokens))
+
+    def _invoke(self, messages, max_tokens, response_format, model, priority):
+        chat = self._client(model, max_tokens, False)
+        self._acquire(messages, max_tokens, priority)
+        if response_format:
+            return chat.invoke(messages, response_format=response_format).content
+        return chat.invoke(messages).content
+
+    async def _ainvoke(self, messages, max_tokens, response_format, model, priority):
+        chat = self._client(model, max_tokens, False)
+        await self._acquire_async(messages, max_tokens, priority)
+        if response_format:
+            return (await chat.ainvoke(messages, response_format=response_format)).content
+        return (await chat.ainvoke(messages)).content
+
+    def _request_options(self, cache_key):
+        # Routes requests with the same prompt prefix to the same cache on OpenAI's side
+        return {"prompt_cache_key": cache_key} if cache_key else {}
+
+    def _stream(self, messages, max_tokens, model, priority, cache_key):
+        chat = self._client(model, max_tokens, True)
+        self._acquire(messages, max_tokens, priority)
+        for chunk in chat.stream(messages, **self._request_options(cache_key)):
+            yield chunk.content, _chunk_usage(chunk)
+
+    async def _astream(self, messages, max_tokens, model, priority, cache_key):
+        chat = self._client(model, max_tokens, True)
+        await self._acquire_async(messages, max_tokens, priority)
+        async for chunk in chat.astream(messages, **self._request_options(cache_key)):
+            yield chunk.content, _chunk_usage(chunk)
+
+class OpenAICompatibleBackend(OpenAIBackend):
+    """
+    Any server exposing the OpenAI chat completions API (vLLM, llama.cpp,
+    Ollama, LM Studio, ...), e.g. a small model on our own hardware. It has
+    its own capacity, so it does not use the OpenAI rate limiter.
+    """
+    name = "local"
+    rate_limited = False
+
+    def __init__(self, base_url, api_key=None, default_model=None, supports_response_format=True):
+        # Local servers usually ignore the key, but the client requires one
+        super().__init__(base_url=base_url, api_key=api_key or "not-needed", default_model=default_model)
+        self.supports_response_format = supports_response_format
+
+    def resolve_model(self, model=None):
+        # The server runs its own model, whatever the OpenAI-side policy picked
+        return self.default_model
+
+    def _request_options(self, cache_key):
+        # prompt_cache_key is OpenAI-specific
+        return {}
+
+    def _adapt_response_format(self, messages, response_format):
+        if response_format and not self.supports_response_format:
+            if response_format.get("type") == "json_schema":
+                # Ask for the schema in the prompt instead
+                schema = json.dumps(response_format["json_schema"]["schema"])
+                messages = [dict(messages[0], content=messages[0]["content"] +
+                                 f"\nReturn only a JSON document matching this JSON schema: {schema}")] + messages[1:]
+            response_format = None
+        return messages, response_format
+
+    def _invoke(self, messages, max_tokens, response_format, model, priority):
+        messages, response_format = self._adapt_response_format(messages, response_format)
+        return super()._invoke(messages, max_tokens, response_format, model, priority)
+
+    async def _ainvoke(self, messages, max_tokens, response_format, model, priority):
+        messages, response_format = self._adapt_response_format(messages, response_format)
+        return await super()._ainvoke(messages, max_tokens, response_format, model, priority)
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+# Function to get a configured LLM backend
+def get_backend(name="openai"):
+    """
+    Get a process-wide LLM backend by name, creating it on first use
+
+    Parameters:
+    - name: "openai" or "local" (LOCAL_LLM_BASE_URL and LOCAL_LLM_MODEL in secrets)
+
+    Returns:
+    - LLMBackend instance
+    """
+    with _backends_lock:
+        backend = _backends.get(name)
+        if backend is None:
+            if name == "local":
+                base_url = get_setting("LOCAL_LLM_BASE_URL", None)
+                if not base_url:
+                    raise ValueError("LOCAL_LLM_BASE_URL not configured in Streamlit secrets")
+                backend = OpenAICompatibleBackend(
+                    base_url=base_url,
+                    api_key=get_setting("LOCAL_LLM_API_KEY", None),
+                    default_model=get_setting("LOCAL_LLM_MODEL", "local-model"),
+                    supports_response_format=get_setting("LOCAL_LLM_RESPONSE_FORMAT", True)
+                )
+            elif name == "openai":
+                backend = OpenAIBackend()
+            else:
+                raise ValueError(f"Unknown LLM backend: {name}")
+            _backends[name] = backend
+        return backend
+
+# Function to get the backend for helper tasks
+def get_helper_backend():
+    """
+    Get the backend for helper tasks (language detection, topic extraction, ...)
+
+    Returns:
+    - LLMBackend named by HELPER_BACKEND (default "openai")
+    """
+    return get_backend(get_setting("HELPER_BACKEND", "openai"))
+
+# Function to get the backend for tutor replies
+def get_reply_backend():
+    """
+    Get the backend for streamed tutor replies
+
+    Returns:
+    - LLMBackend named by REPLY_BACKEND (default "openai")
+    """
+    return get_backend(get_setting("REPLY_BACKEND", "openai"))
+
+# Function to compare backends
+def get_backend_stats():
+    """
+    Report latency and throughput of every backend used so far, side by side
+
+    Returns:
+    - Dictionary of backend name to its statistics
+    """
+    with _backends_lock:
+        backends = dict(_backends)
+    return {name: backend.get_stats() for name, backend in backends.items()}
@@ -0,0 +1,349 @@
+import threading
+import functools
+import hashlib
+import json
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+import httpx
+import streamlit as st
+from langchain_openai import ChatOpenAI
+
+# Default model used when MODEL_NAME is not configured in Streamlit secrets
+DEFAULT_MODEL_NAME = "gpt-4.1-mini-2025-04-14"
+
+# Process-wide state shared by every Streamlit session and worker thread
+_registry_lock = threading.Lock()
+_clients = {}
+_http_clients = {}
+_pool_stats = {
+    "requests": 0,
+    "new_connections": 0,
+    "client_hits": 0,
+    "client_misses": 0
+}
+
+# Function to read an optional setting from Streamlit secrets
+def get_setting(name, default=None):
+    """
+    Read a configuration value from Streamlit secrets
+
+    Parameters:
+    - name: Secret name (e.g. MODEL_NAME)
+    - default: Value returned when the secret is missing or secrets are not configured
+
+    Returns:
+    - The configured value or the default
+    """
+    try:
+        return st.secrets.get(name, default)
+    except Exception:
+        return default
+
+def _count_request(request):
+    # Attach a trace callback so new TCP connections can be told apart from reused ones
+    request.extensions["trace"] = _trace_connection
+    with _registry_lock:
+        _pool_stats["requests"] += 1
+
+async def _count_request_async(request):
+    request.extensions["trace"] = _trace_connection_async
+    with _registry_lock:
+        _pool_stats["requests"] += 1
+
+def _trace_connection(event_name, info):
+    if event_name == "connection.connect_tcp.complete":
+        with _registry_lock:
+            _pool_stats["new_connections"] += 1
+
+async def _trace_connection_async(event_name, info):
+    _trace_connection(event_name, info)
+
+def _pool_limits():
+    return httpx.Limits(
+        max_connections=int(get_setting("LLM_POOL_MAX_CONNECTIONS", 20)),
+        max_keepalive_connections=int(get_setting("LLM_POOL_MAX_KEEPALIVE", 10)),
+        keepalive_expiry=float(get_setting("LLM_POOL_KEEPALIVE_EXPIRY", 30.0))
+    )
+
+def _get_http_clients():
+    """
+    Create (once) the keep-alive HTTP clients shared by every LLM client.
+    Must be called with _registry_lock held.
+    """
+    if not _http_clients:
+        limits = _pool_limits()
+        timeout = httpx.Timeout(float(get_setting("LLM_REQUEST_TIMEOUT", 60.0)), connect=10.0)
+        _http_clients["sync"] = httpx.Client(
+            limits=limits,
+            timeout=timeout,
+            event_hooks={"request": [_count_request]}
+        )
+        _http_clients["async"] = httpx.AsyncClient(
+            limits=limits,
+            timeout=timeout,
+            event_hooks={"request": [_count_request_async]}
+        )
+        _http_clients["limits"] = limits
+    return _http_clients["sync"], _http_clients["async"]
+
+# Function to get a pooled chat client
+def get_chat_client(model=None, max_tokens=None, streaming=False, base_url=None, api_key=None):
+    """
+    Get a shared ChatOpenAI client for the given configuration.
+    Clients are created once per (model, max_tokens, streaming, endpoint) and
+    reuse one keep-alive HTTP connection pool across all sessions and threads.
+
+    Parameters:
+    - model: Model name (defaults to MODEL_NAME from secrets)
+    - max_tokens: Maximum number of tokens in the response
+    - streaming: Whether the client is used for streamed responses
+    - base_url: OpenAI-compatible endpoint (defaults to the OpenAI API)
+    - api_key: API key for the endpoint (defaults to OPENAI_API_KEY from secrets)
+
+    Returns:
+    - ChatOpenAI instance
+    """
+    model = model or get_setting("MODEL_NAME", DEFAULT_MODEL_NAME)
+    key = (model, max_tokens, streaming, base_url, api_key)
+
+    with _registry_lock:
+        chat = _clients.get(key)
+        if chat is not None:
+            _pool_stats["client_hits"] += 1
+            return chat
+
+        api_key = api_key or get_setting("OPENAI_API_KEY", "")
+        if not api_key:
+            raise ValueError("OpenAI API key not configured in Streamlit secrets")
+
+        http_client, http_async_client = _get_http_clients()
+        endpoint = {"base_url": base_url} if base_url else {}
+        chat = ChatOpenAI(
+            openai_api_key=api_key,
+            model=model,
+            **endpoint,
+            max_tokens=max_tokens,
+            streaming=streaming,
+            # Report token usage (including cached prompt tokens) on streamed responses
+            stream_usage=streaming,
+            # Retries are handled by llm_resilience so they can be jittered and counted
+            max_retries=0,
+            http_client=http_client,
+            http_async_client=http_async_client
+        )
+        _clients[key] = chat
+        _pool_stats["client_misses"] += 1
+        return chat
+
+def _snapshot_pool(client):
+    # httpx does not expose pool state publicly, so read it defensively from the transport
+    pool = getattr(getattr(client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []) or [])
+    idle = sum(1 for conn in connections if conn.is_idle())
+    return len(connections), idle
+
+# Function to report connection pool usage
+def get_pool_stats():
+    """
+    Report utilisation and connection reuse for the shared LLM connection pool
+
+    Returns:
+    - Dictionary with registry size, request counts, new vs reused connections
+      and current pool occupancy
+    """
+    with _registry_lock:
+        stats = dict(_pool_stats)
+        stats["clients"] = len(_clients)
+        limits = _http_clients.get("limits")
+        sync_client = _http_clients.get("sync")
+        async_client = _http_clients.get("async")
+
+    open_connections = 0
+    idle_connections = 0
+    pools = 0
+    for client in (sync_client, async_client):
+        if client is not None:
+            total, idle = _snapshot_pool(client)
+            open_connections += total
+            idle_connections += idle
+            pools += 1
+
+    # The sync and async clients each hold their own pool with the same limits
+    max_connections = limits.max_connections * pools if limits else 0
+    active_connections = open_connections - idle_connections
+
+    stats["reused_connections"] = max(0, stats["requests"] - stats["new_connections"])
+    stats["reuse_ratio"] = stats["reused_connections"] / stats["requests"] if stats["requests"] else 0.0
+    stats["open_connections"] = open_connections
+    stats["idle_connections"] = idle_connections
+    stats["active_connections"] = active_connections
+    stats["max_connections"] = max_connections
+    stats["utilisation"] = active_connections / max_connections if max_connections else 0.0
+    return stats
+
+# Decorator for caching LLM helper results
+def llm_cache(maxsize=100):
+    """
+    Thread-safe LRU cache for LLM helper functions, similar to functools.lru_cache
+    but with a cache_put() method so one call can fill the caches of others
+
+    Parameters:
+    - maxsize: Maximum number of cached results
+
+    Returns:
+    - Decorator adding cache_put(), cache_info() and cache_clear() to the function
+    """
+    def decorator(func):
+        cache = OrderedDict()
+        lock = threading.Lock()
+        stats = {"hits": 0, "misses": 0}
+
+        def make_key(args, kwargs):
+            return args + tuple(sorted(kwargs.items())) if kwargs else args
+
+        def store(key, value):
+            with lock:
+                cache[key] = value
+                cache.move_to_end(key)
+                while len(cache) > maxsize:
+                    cache.popitem(last=False)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = make_key(args, kwargs)
+            with lock:
+                if key in cache:
+                    stats["hits"] += 1
+                    cache.move_to_end(key)
+                    return cache[key]
+                stats["misses"] += 1
+            result = func(*args, **kwargs)
+            store(key, result)
+            return result
+
+        def cache_put(*args, value, **kwargs):
+            store(make_key(args, kwargs), value)
+
+        def cache_info():
+            with lock:
+                return {"hits": stats["hits"], "misses": stats["misses"], "maxsize": maxsize, "currsize": len(cache)}
+
+        def cache_clear():
+            with lock:
+                cache.clear()
+                stats["hits"] = stats["misses"] = 0
+
+        wrapper.cache_put = cache_put
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = cache_clear
+        return wrapper
+    return decorator
+
+class _LeaderAborted(Exception):
+    """The leading call was interrupted (e.g. by a Streamlit rerun) rather than failing"""
+
+class SingleFlight:
+    """
+    Collapses concurrent identical calls into one: the first caller for a key
+    runs the function and every caller that arrives while it is in flight
+    shares its result (or its error)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._stats = {"calls": 0, "shared": 0}
+
+    def do(self, key, func):
+        """
+        Run func once for all concurrent callers with the same key
+
+        Parameters:
+        - key: Normalised request key (see request_key)
+        - func: Function without arguments performing the request
+
+        Returns:
+        - The function's result
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = Future()
+                self._calls[key] = call
+            else:
+                self._stats["shared"] += 1
+
+        if not leader:
+            try:
+                return call.result()
+            except _LeaderAborted:
+                # The leader was interrupted, so make the request ourselves
+                return func()
+
+        try:
+            result = func()
+            call.set_result(result)
+            return result
+        except Exception as e:
+            call.set_exception(e)
+            raise
+        except BaseException:
+            call.set_exception(_LeaderAborted())
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+
+    def get_stats(self):
+        """
+        Report how many calls were made and how many shared an in-flight result
+
+        Returns:
+        - Dictionary with calls, shared and in_flight counts
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+        return stats
+
+# Shared single-flight group for all LLM requests in this process
+llm_singleflight = SingleFlight()
+
+# Function to normalise text before comparing requests
+def normalize_request_text(text):
+    """
+    Normalise text so trivially different requests compare equal
+
+    Parameters:
+    - text: Request text
+
+    Returns:
+    - Text in NFC form with whitespace collapsed
+    """
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def _normalize_request_value(value):
+    if isinstance(value, str):
+        # Only the Unicode form is normalised, whitespace and layout can change the answer (code, poems, exercises)
+        return unicodedata.normalize("NFC", value)
+    if isinstance(value, dict):
+        return {k: _normalize_request_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize_request_value(v) for v in value]
+    return value
+
+# Function to build a single-flight key for an LLM request
+def request_key(*parts):
+    """
+    Build a key identifying an LLM request by its exact content (text in NFC form)
+
+    Parameters:
+    - parts: Anything that determines the response (model, max_tokens, messages, ...)
+
+    Returns:
+    - Hex digest string
+    """
+    payload = json.dumps(_normalize_request_value(list(parts)), sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
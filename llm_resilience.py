@@ -0,0 +1,406 @@
+import queue
+import random
+import threading
+import time
+import logging
+from collections import deque
+import httpx
+import openai
+from llm_client import get_setting
+from stream_control import CancellationToken
+
+# Stats shared by every session in the process
+_stats_lock = threading.Lock()
+_stats = {"retries": 0, "hedges": 0, "hedge_wins": 0}
+
+class LatencyTracker:
+    """Keeps recent time-to-first-token samples and derives the hedging delay from them"""
+    def __init__(self, name, max_samples=200):
+        self.name = name
+        self._samples = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, percent):
+        """
+        Get a percentile of the recent samples
+
+        Parameters:
+        - percent: Percentile between 0 and 100
+
+        Returns:
+        - Latency in seconds, or None if there are no samples
+        """
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        index = min(len(samples) - 1, int(round(percent / 100.0 * (len(samples) - 1))))
+        return samples[index]
+
+    def count(self):
+        with self._lock:
+            return len(self._samples)
+
+    def hedge_delay(self):
+        """
+        Seconds to wait for a first result before sending a hedged duplicate
+
+        Returns:
+        - Delay in seconds, or None if hedging is disabled or there are too few samples
+        """
+        if not get_setting("LLM_HEDGING", True):
+            return None
+        if self.count() < int(get_setting("LLM_HEDGE_MIN_SAMPLES", 20)):
+            return None
+        delay = self.percentile(float(get_setting("LLM_HEDGE_PERCENTILE", 95)))
+        return max(delay, float(get_setting("LLM_HEDGE_MIN_DELAY", 0.5)))
+
+# Time-to-first-token trackers for tutor replies and helper calls
+reply_latency = LatencyTracker("reply")
+helper_latency = LatencyTracker("helper")
+
+# Function to decide whether an error is worth retrying
+def is_transient_error(error):
+    """
+    Check whether an LLM error is likely to succeed on retry
+
+    Parameters:
+    - error: Exception raised by the LLM call
+
+    Returns:
+    - True for connection problems, timeouts, rate limits and server errors
+    """
+    if isinstance(error, openai.RateLimitError):
+        # An exhausted quota will not recover by retrying
+        return "insufficient_quota" not in str(error)
+    return isinstance(error, (
+        openai.APIConnectionError,  # Includes APITimeoutError
+        openai.InternalServerError,
+        httpx.TransportError,
+        TimeoutError
+    ))
+
+# Function to call an LLM with bounded retries
+def call_with_retry(func, deadline=None):
+    """
+    Call func, retrying transient errors with exponential backoff and full jitter
+
+    Parameters:
+    - func: Function without arguments performing the request
+    - deadline: Optional TurnDeadline; no retry is started that would end past it
+
+    Returns:
+    - The function's result
+    """
+    max_retries = int(get_setting("LLM_MAX_RETRIES", 3))
+    base_delay = float(get_setting("LLM_RETRY_BASE_DELAY", 0.5))
+    max_delay = float(get_setting("LLM_RETRY_MAX_DELAY", 8.0))
+
+    attempt = 0
+    while True:
+        try:
+            return func()
+        except Exception as e:
+            if attempt >= max_retries or not is_transient_error(e):
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+            if deadline and delay >= deadline.remaining():
+                raise
+            attempt += 1
+            with _stats_lock:
+                _stats["retries"] += 1
+            logging.warning(f"Transient LLM error: {str(e)}. Retry {attempt}/{max_retries} in {delay:.2f}s.")
+            time.sleep(delay)
+
+# Function to race a request against a delayed duplicate
+def call_hedged(attempt, tracker, discard=None):
+    """
+    Run attempt() and, if it has produced no result once the tracker's hedging
+    delay has passed, run a duplicate. The first successful result wins: the
+    other attempt's CancellationToken is cancelled right away, and a result it
+    still returns is passed to discard(). If the wait is interrupted (e.g. by a
+    Streamlit rerun), every attempt is cancelled.
+
+    Parameters:
+    - attempt: Function taking a CancellationToken and performing the request up to
+      its first result; cancelling the token should abort the request
+    - tracker: LatencyTracker for this kind of request
+    - discard: Optional function releasing a losing result (e.g. closing a stream)
+
+    Returns:
+    - The first successful result
+    """
+    results = queue.Queue()
+    lock = threading.Lock()
+    state = {"done": False}
+    tokens = []
+
+    def release(value, error):
+        if error is None and discard:
+            discard(value)
+
+    def run(token):
+        try:
+            value, error = attempt(token), None
+        except Exception as e:
+            value, error = None, e
+        with lock:
+            if not state["done"]:
+                results.put((token, value, error))
+                return
+        # Another attempt already won, or the caller stopped waiting
+        release(value, error)
+
+    def launch():
+        token = CancellationToken()
+        tokens.append(token)
+        threading.Thread(target=run, args=(token,), name=f"polyglot-hedge-{tracker.name}", daemon=True).start()
+
+    start = time.monotonic()
+    delay = tracker.hedge_delay()
+    if delay is None:
+        # Not enough samples yet (or hedging disabled), just run the request
+        value = attempt(CancellationToken())
+        tracker.record(time.monotonic() - start)
+        return value
+
+    winner = None
+    try:
+        launch()
+        errors = []
+        while True:
+            try:
+                token, value, error = results.get(timeout=delay if len(tokens) == 1 and not errors else None)
+            except queue.Empty:
+                # The first request is slower than usual, send a hedged duplicate
+                launch()
+                with _stats_lock:
+                    _stats["hedges"] += 1
+                continue
+
+            if error is not None:
+                errors.append(error)
+                if len(errors) == len(tokens):
+                    raise error
+                continue
+
+            winner = token
+            tracker.record(time.monotonic() - start)
+            if len(tokens) > 1 and len(errors) == 0 and time.monotonic() - start > delay:
+                with _stats_lock:
+                    _stats["hedge_wins"] += 1
+            return value
+    finally:
+        with lock:
+            state["done"] = True
+            # Results from other attempts that arrived at the same time
+            leftovers = []
+            while not results.empty():
+                leftovers.append(results.get_nowait())
+        # Abort every attempt but the winner, whether it is still running or not
+        for token in tokens:
+            if token is not winner:
+                token.cancel()
+        for _, leftover, leftover_error in leftovers:
+            release(leftover, leftover_error)
+
+# Function to invoke an LLM request resiliently
+def invoke_resilient(invoke, tracker=helper_latency):
+    """
+    Run a non-streaming LLM request with retries and hedging
+
+    Parameters:
+    - invoke: Function taking a CancellationToken and performing the request
+    - tracker: LatencyTracker for this kind of request
+
+    Returns:
+    - The request's result
+    """
+    return call_with_retry(lambda: call_hedged(invoke, tracker))
+
+# Function to open an LLM stream resiliently
+def stream_resilient(start_stream, tracker=reply_latency, deadline=None):
+    """
+    Stream an LLM response with retries and hedging up to the first chunk.
+    Errors after the first chunk are not retried, since part of the
+    response has already been delivered.
+
+    Parameters:
+    - start_stream: Function taking a CancellationToken and returning a new chunk iterator
+      (one upstream request per call) that ends when the token is cancelled
+    - tracker: LatencyTracker for this kind of request
+    - deadline: Optional TurnDeadline limiting retries
+
+    Returns:
+    - Generator of chunks from the winning request
+    """
+    def attempt(token):
+        iterator = start_stream(token)
+        try:
+            return iterator, next(iterator)
+        except StopIteration:
+            return iterator, None
+
+    def discard(result):
+        # Closing the generator closes the losing HTTP response
+        result[0].close()
+
+    iterator, first = call_with_retry(lambda: call_hedged(attempt, tracker, discard), deadline)
+    if first is None:
+        return
+    yield first
+    yield from iterator
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the LLM while a circuit breaker is open"""
+
+class CircuitBreaker:
+    """
+    Stops calling a failing dependency for a cool-down period. After
+    failure_threshold consecutive failures (errors or calls slower than
+    slow_call_seconds) the circuit opens and calls fail immediately with
+    CircuitOpenError. Once the cool-down has passed, a few trial calls are
+    let through: a success closes the circuit, a failure opens it again.
+    """
+    def __init__(self, name, failure_threshold=5, cooldown=30.0, slow_call_seconds=10.0, trial_calls=1):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.slow_call_seconds = slow_call_seconds
+        self.trial_calls = trial_calls
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trials_in_flight = 0
+        self._stats = {"calls": 0, "failures": 0, "short_circuited": 0, "trips": 0}
+
+    def _before_call(self):
+        with self._lock:
+            self._stats["calls"] += 1
+            if self._state == "open":
+                if time.monotonic() - self._opened_at < self.cooldown:
+                    self._stats["short_circuited"] += 1
+                    raise CircuitOpenError(f"{self.name} circuit breaker is open")
+                self._state = "half_open"
+                self._trials_in_flight = 0
+            if self._state == "half_open":
+                if self._trials_in_flight >= self.trial_calls:
+                    self._stats["short_circuited"] += 1
+                    raise CircuitOpenError(f"{self.name} circuit breaker is waiting for a trial request")
+                self._trials_in_flight += 1
+                return True
+            return False
+
+    def _after_call(self, trial, failed):
+        with self._lock:
+            if trial:
+                self._trials_in_flight -= 1
+            if not failed:
+                if self._state != "closed":
+                    logging.warning(f"{self.name} circuit breaker closed, the LLM has recovered.")
+                self._state = "closed"
+                self._failures = 0
+                return
+            self._stats["failures"] += 1
+            self._failures += 1
+            if trial or (self._state == "closed" and self._failures >= self.failure_threshold):
+                if self._state != "open":
+                    self._stats["trips"] += 1
+                    logging.warning(f"{self.name} circuit breaker opened for {self.cooldown}s after {self._failures} failures.")
+                self._state = "open"
+                self._opened_at = time.monotonic()
+
+    def call(self, func):
+        """
+        Call func through the circuit breaker
+
+        Parameters:
+        - func: Function without arguments performing the request
+
+        Returns:
+        - The function's result
+
+        Raises:
+        - CircuitOpenError without calling func while the circuit is open
+        """
+        trial = self._before_call()
+        start = time.monotonic()
+        try:
+            result = func()
+        except Exception:
+            self._after_call(trial, failed=True)
+            raise
+        except BaseException:
+            # Interrupted (e.g. by a Streamlit rerun), neither a success nor a failure
+            with self._lock:
+                if trial:
+                    self._trials_in_flight -= 1
+            raise
+        # A call that succeeds only after a long wait still counts as a timeout
+        self._after_call(trial, failed=time.monotonic() - start > self.slow_call_seconds)
+        return result
+
+    def get_stats(self):
+        """
+        Report the breaker's state and counters
+
+        Returns:
+        - Dictionary with state, consecutive failures, trips and short-circuited calls
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["state"] = self._state
+            stats["consecutive_failures"] = self._failures
+        return stats
+
+_breaker = None
+_breaker_lock = threading.Lock()
+
+# Function to get the circuit breaker shared by the helper LLM functions
+def get_helper_breaker():
+    """
+    Get the process-wide circuit breaker for helper LLM calls (topic
+    extraction, exercise parameters, language detection, turn analysis),
+    creating it on first use
+
+    Returns:
+    - CircuitBreaker instance
+    """
+    global _breaker
+    with _breaker_lock:
+        if _breaker is None:
+            _breaker = CircuitBreaker(
+                "Helper LLM",
+                failure_threshold=int(get_setting("HELPER_BREAKER_FAILURES", 5)),
+                cooldown=float(get_setting("HELPER_BREAKER_COOLDOWN", 30.0)),
+                slow_call_seconds=float(get_setting("HELPER_BREAKER_SLOW_CALL", 10.0)),
+                trial_calls=int(get_setting("HELPER_BREAKER_TRIAL_CALLS", 1))
+            )
+        return _breaker
+
+# Function to report retry and hedging activity
+def get_resilience_stats():
+    """
+    Report retries, hedged requests, the helper circuit breaker and
+    time-to-first-token percentiles
+
+    Returns:
+    - Dictionary with counters, breaker state and p50/p95/p99 per tracker
+    """
+    with _stats_lock:
+        stats = dict(_stats)
+    stats["helper_breaker"] = get_helper_breaker().get_stats()
+    for tracker in (reply_latency, helper_latency):
+        stats[tracker.name] = {
+            "samples": tracker.count(),
+            "p50": tracker.percentile(50),
+            "p95": tracker.percentile(95),
+            "p99": tracker.percentile(99),
+            "hedge_delay": tracker.hedge_delay()
+        }
+    return stats
@@ -0,0 +1,264 @@
+import heapq
+import asyncio
+import itertools
+import threading
+import time
+from contextlib import contextmanager
+from llm_client import get_setting
+from token_estimator import get_token_estimator
+
+# Request priorities, lower values are served first
+PRIORITY_INTERACTIVE = 0  # Streamed tutor replies
+PRIORITY_HELPER = 1       # Turn analysis, topic extraction, language detection, ...
+
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_HELPER: "helper"}
+
+# Upper bounds (seconds) of the wait-time histogram buckets
+WAIT_TIME_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+class TokenBucket:
+    """Token bucket refilled continuously up to a per-minute budget"""
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.tokens = self.capacity
+        self.rate = self.capacity / 60.0
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Seconds until amount can be taken (0 if available now)"""
+        if self.capacity <= 0:
+            return 0.0  # Unlimited
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        if self.capacity > 0:
+            self.tokens -= min(amount, self.capacity)
+
+class LLMScheduler:
+    """
+    Process-wide scheduler for LLM calls. Enforces requests-per-minute and
+    tokens-per-minute budgets and grants them in priority order, so streamed
+    tutor replies are always served before queued helper calls.
+    """
+    def __init__(self, requests_per_minute=500, tokens_per_minute=200000):
+        self._cond = threading.Condition()
+        self._requests = TokenBucket(requests_per_minute)
+        self._tokens = TokenBucket(tokens_per_minute)
+        self._waiting = []
+        # Futures of async waiters to wake (with their loop) when the queue changes
+        self._async_wakeups = []
+        self._sequence = itertools.count()
+        self._granted = {name: 0 for name in PRIORITY_NAMES.values()}
+        self._histograms = {name: [0] * len(WAIT_TIME_BUCKETS) for name in PRIORITY_NAMES.values()}
+        self._wait_totals = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self._peak_depth = 0
+
+    def acquire(self, priority, estimated_tokens, timeout=None):
+        """
+        Block until the request may be sent
+
+        Parameters:
+        - priority: PRIORITY_INTERACTIVE or PRIORITY_HELPER
+        - estimated_tokens: Estimated prompt plus completion tokens
+        - timeout: Maximum seconds to wait (None waits indefinitely)
+
+        Returns:
+        - Seconds spent waiting
+
+        Raises:
+        - TimeoutError if the budget is not available within the timeout
+        """
+        start = time.monotonic()
+        with self._cond:
+            entry = self._enqueue(priority, estimated_tokens)
+            try:
+                while True:
+                    granted, wait = self._try_grant(entry)
+                    if granted:
+                        break
+                    self._cond.wait(self._limit_wait(wait, start, timeout))
+            finally:
+                self._dequeue(entry)
+
+            waited = time.monotonic() - start
+            self._record_wait(priority, waited)
+        return waited
+
+    async def acquire_async(self, priority, estimated_tokens, timeout=None):
+        """
+        Async version of acquire(). The request joins the priority queue straight
+        away, so it never waits behind blocked threads for its turn, and the event
+        loop is not blocked while it waits.
+
+        Returns:
+        - Seconds spent waiting
+
+        Raises:
+        - TimeoutError if the budget is not available within the timeout
+        """
+        start = time.monotonic()
+        loop = asyncio.get_running_loop()
+        with self._cond:
+            entry = self._enqueue(priority, estimated_tokens)
+        try:
+            while True:
+                with self._cond:
+                    granted, wait = self._try_grant(entry)
+                    if granted:
+                        waited = time.monotonic() - start
+                        self._record_wait(priority, waited)
+                        return waited
+                    wait = self._limit_wait(wait, start, timeout)
+                    wakeup = loop.create_future()
+                    self._async_wakeups.append((loop, wakeup))
+                await asyncio.wait({wakeup}, timeout=wait)
+        finally:
+            with self._cond:
+                self._dequeue(entry)
+
+    def _enqueue(self, priority, estimated_tokens):
+        # Called with the lock held
+        entry = [priority, next(self._sequence), estimated_tokens, True]
+        heapq.heappush(self._waiting, entry)
+        self._peak_depth = max(self._peak_depth, len(self._waiting))
+        return entry
+
+    def _try_grant(self, entry):
+        # Called with the lock held. Grants the budget if the entry is first in line
+        # and the budget is available; otherwise returns how long to wait (None until
+        # the queue changes)
+        if self._waiting[0] is not entry:
+            return False, None
+        self._requests.refill()
+        self._tokens.refill()
+        wait = max(self._requests.wait_time(1), self._tokens.wait_time(entry[2]))
+        if wait > 0:
+            return False, wait
+        self._requests.take(1)
+        self._tokens.take(entry[2])
+        heapq.heappop(self._waiting)
+        entry[3] = False
+        self._notify_waiters()
+        return True, 0.0
+
+    def _limit_wait(self, wait, start, timeout):
+        if timeout is None:
+            return wait
+        remaining = timeout - (time.monotonic() - start)
+        if remaining <= 0:
+            raise TimeoutError("Timed out waiting for LLM rate limit budget")
+        return remaining if wait is None else min(wait, remaining)
+
+    def _dequeue(self, entry):
+        # Called with the lock held
+        if entry[3]:
+            # Gave up waiting, remove the entry and let the next request in
+            self._waiting.remove(entry)
+            heapq.heapify(self._waiting)
+            entry[3] = False
+            self._notify_waiters()
+
+    def _notify_waiters(self):
+        # Called with the lock held. Wakes the blocked threads and the async waiters
+        self._cond.notify_all()
+        wakeups, self._async_wakeups = self._async_wakeups, []
+        for loop, wakeup in wakeups:
+            try:
+                loop.call_soon_threadsafe(_wake, wakeup)
+            except RuntimeError:
+                # The waiter's event loop is closed
+                pass
+
+    def _record_wait(self, priority, waited):
+        name = PRIORITY_NAMES.get(priority, "helper")
+        self._granted[name] += 1
+        self._wait_totals[name] += waited
+        for index, bound in enumerate(WAIT_TIME_BUCKETS):
+            if waited <= bound:
+                self._histograms[name][index] += 1
+                break
+
+    @contextmanager
+    def slot(self, priority, estimated_tokens, timeout=None):
+        """Context manager form of acquire()"""
+        self.acquire(priority, estimated_tokens, timeout)
+        yield
+
+    def get_stats(self):
+        """
+        Report queue depth and wait-time histograms per priority
+
+        Returns:
+        - Dictionary with current and peak queue depth, remaining budgets and
+          per-priority granted counts, average waits and wait-time histograms
+        """
+        with self._cond:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for entry in self._waiting:
+                depth[PRIORITY_NAMES.get(entry[0], "helper")] += 1
+            self._requests.refill()
+            self._tokens.refill()
+            stats = {
+                "queue_depth": depth,
+                "peak_queue_depth": self._peak_depth,
+                "requests_available": self._requests.tokens,
+                "tokens_available": self._tokens.tokens,
+                "priorities": {}
+            }
+            for name in PRIORITY_NAMES.values():
+                granted = self._granted[name]
+                stats["priorities"][name] = {
+                    "granted": granted,
+                    "average_wait": self._wait_totals[name] / granted if granted else 0.0,
+                    "wait_histogram": {
+                        ("+inf" if bound == float("inf") else f"<={bound}s"): count
+                        for bound, count in zip(WAIT_TIME_BUCKETS, self._histograms[name])
+                    }
+                }
+        return stats
+
+def _wake(future):
+    if not future.done():
+        future.set_result(None)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+# Function to get the shared LLM scheduler
+def get_llm_scheduler():
+    """
+    Get the process-wide LLM scheduler, creating it on first use
+
+    Returns:
+    - LLMScheduler instance (a budget of 0 disables that limit)
+    """
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler(
+                requests_per_minute=float(get_setting("LLM_REQUESTS_PER_MINUTE", 500)),
+                tokens_per_minute=float(get_setting("LLM_TOKENS_PER_MINUTE", 200000))
+            )
+        return _scheduler
+
+# Function to estimate the token cost of a request for rate limiting
+def estimate_request_tokens(messages, max_tokens):
+    """
+    Roughly estimate the tokens a request counts against the tokens-per-minute budget
+
+    Parameters:
+    - messages: Chat messages (dicts with string or multi-part content)
+    - max_tokens: Maximum completion tokens
+
+    Returns:
+    - Estimated prompt tokens plus max_tokens
+    """
+    return get_token_estimator().estimate_messages(messages) + int(max_tokens or 0)
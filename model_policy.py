@@ -0,0 +1,136 @@
+import time
+import threading
+import logging
+from collections import deque
+from llm_client import get_setting, DEFAULT_MODEL_NAME
+from llm_scheduler import get_llm_scheduler
+
+class ModelPolicy:
+    """
+    Chooses the model for new tutor replies. While recent time to first
+    token, scheduler queue depth or reply error rate breach their thresholds,
+    new turns go to the fallback model. Switching back needs every metric to
+    be below recovery_ratio times its threshold and the fallback to have been
+    active for at least min_fallback_seconds, so the choice does not flap.
+    """
+    def __init__(self, primary_model, fallback_model, ttft_threshold=4.0, queue_threshold=10,
+                 error_rate_threshold=0.2, window_seconds=120.0, min_samples=5,
+                 recovery_ratio=0.7, min_fallback_seconds=60.0):
+        self.primary_model = primary_model
+        self.fallback_model = fallback_model
+        self.ttft_threshold = ttft_threshold
+        self.queue_threshold = queue_threshold
+        self.error_rate_threshold = error_rate_threshold
+        self.window_seconds = window_seconds
+        self.min_samples = min_samples
+        self.recovery_ratio = recovery_ratio
+        self.min_fallback_seconds = min_fallback_seconds
+        self._lock = threading.Lock()
+        # (time, model, ttft or None, ok) for recent replies
+        self._replies = deque(maxlen=500)
+        self._degraded_since = None
+        self._switches = 0
+        self._reason = None
+
+    def record_reply(self, model, ttft, ok=True):
+        """
+        Record the outcome of a tutor reply
+
+        Parameters:
+        - model: Model that produced the reply
+        - ttft: Seconds to the first streamed chunk (None if none arrived)
+        - ok: False if the reply failed
+        """
+        with self._lock:
+            self._replies.append((time.monotonic(), model, ttft, ok))
+
+    def _metrics(self):
+        # Only the primary model's recent replies say whether it is healthy
+        cutoff = time.monotonic() - self.window_seconds
+        recent = [r for r in self._replies if r[0] >= cutoff and r[1] == self.primary_model]
+        ttfts = sorted(r[2] for r in recent if r[2] is not None)
+        ttft_p90 = ttfts[int(0.9 * (len(ttfts) - 1))] if len(ttfts) >= self.min_samples else None
+        error_rate = sum(1 for r in recent if not r[3]) / len(recent) if len(recent) >= self.min_samples else None
+        queue_depth = sum(get_llm_scheduler().get_stats()["queue_depth"].values())
+        return {"ttft_p90": ttft_p90, "error_rate": error_rate, "queue_depth": queue_depth}
+
+    def _breaches(self, metrics, ratio):
+        reasons = []
+        if metrics["ttft_p90"] is not None and metrics["ttft_p90"] > self.ttft_threshold * ratio:
+            reasons.append(f"p90 time to first token {metrics['ttft_p90']:.2f}s")
+        if metrics["queue_depth"] > self.queue_threshold * ratio:
+            reasons.append(f"queue depth {metrics['queue_depth']}")
+        if metrics["error_rate"] is not None and metrics["error_rate"] > self.error_rate_threshold * ratio:
+            reasons.append(f"error rate {metrics['error_rate']:.0%}")
+        return reasons
+
+    def select_model(self):
+        """
+        Choose the model for a new turn
+
+        Returns:
+        - Model name
+        """
+        if not self.fallback_model or self.fallback_model == self.primary_model:
+            return self.primary_model
+
+        with self._lock:
+            metrics = self._metrics()
+            if self._degraded_since is None:
+                reasons = self._breaches(metrics, 1.0)
+                if reasons:
+                    self._degraded_since = time.monotonic()
+                    self._switches += 1
+                    self._reason = ", ".join(reasons)
+                    logging.warning(f"Switching tutor replies to {self.fallback_model}: {self._reason}")
+            elif (time.monotonic() - self._degraded_since >= self.min_fallback_seconds
+                    and not self._breaches(metrics, self.recovery_ratio)):
+                self._degraded_since = None
+                self._switches += 1
+                self._reason = None
+                logging.warning(f"Switching tutor replies back to {self.primary_model}")
+            return self.primary_model if self._degraded_since is None else self.fallback_model
+
+    def get_stats(self):
+        """
+        Report the active model, the reason for a downgrade and the current metrics
+
+        Returns:
+        - Dictionary with active model, degraded flag, reason, switch count and metrics
+        """
+        with self._lock:
+            degraded = self._degraded_since is not None
+            return {
+                "active_model": self.fallback_model if degraded else self.primary_model,
+                "degraded": degraded,
+                "reason": self._reason,
+                "switches": self._switches,
+                "metrics": self._metrics()
+            }
+
+_policy = None
+_policy_lock = threading.Lock()
+
+# Function to get the shared model policy
+def get_model_policy():
+    """
+    Get the process-wide model policy, creating it on first use.
+    Without FALLBACK_MODEL_NAME in secrets it always picks MODEL_NAME.
+
+    Returns:
+    - ModelPolicy instance
+    """
+    global _policy
+    with _policy_lock:
+        if _policy is None:
+            _policy = ModelPolicy(
+                primary_model=get_setting("MODEL_NAME", DEFAULT_MODEL_NAME),
+                fallback_model=get_setting("FALLBACK_MODEL_NAME", None),
+                ttft_threshold=float(get_setting("MODEL_DOWNGRADE_TTFT", 4.0)),
+                queue_threshold=int(get_setting("MODEL_DOWNGRADE_QUEUE_DEPTH", 10)),
+                error_rate_threshold=float(get_setting("MODEL_DOWNGRADE_ERROR_RATE", 0.2)),
+                window_seconds=float(get_setting("MODEL_POLICY_WINDOW", 120.0)),
+                recovery_ratio=float(get_setting("MODEL_RECOVERY_RATIO", 0.7)),
+                min_fallback_seconds=float(get_setting("MODEL_MIN_FALLBACK_SECONDS", 60.0))
+            )
+        return _policy
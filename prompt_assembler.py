@@ -0,0 +1,196 @@
+import re
+import logging
+
+# Tags of the SYSTEM_PROMPT sections; "always" fragments are sent with every request
+SECTION_TAGS = {
+    "CORE CAPABILITIES": "core",
+    "LEVEL ADAPTATION": "always",
+    "TRANSLATION & EXPLANATIONS": "explanations",
+    "EXERCISE TYPES": "exercises",
+    "FEEDBACK APPROACH": "feedback",
+    "PERSONALIZATION": "personalization",
+    "FILE HANDLING": "file",
+    "FORMATTING AND INTERACTION": "always"
+}
+
+# Fragments holding the CEFR and language guidelines rather than SYSTEM_PROMPT text
+GUIDELINE_FRAGMENTS = {"CEFR GUIDELINES", "LANGUAGE GUIDELINES", "VOCABULARY GUIDELINES", "GRAMMAR GUIDELINES",
+                       "EXAMPLE SENTENCES", "LEVEL RULES"}
+
+# Fragments each request type needs when the message gives no further cues
+INTENT_PROMPT_TAGS = {
+    "translation": {"explanations", "examples"},
+    "grammar": {"explanations", "grammar", "language_grammar", "examples", "personalization"},
+    "exercise": {"core", "exercises", "feedback", "vocabulary", "grammar", "language_grammar", "examples",
+                 "personalization"},
+    "answer_check": {"exercises", "feedback", "grammar", "language_grammar"},
+    "general": {"core", "explanations", "personalization", "vocabulary", "grammar", "language_grammar", "examples"}
+}
+
+# Exercise types of the EXERCISE TYPES catalogue and the words that ask for them
+EXERCISE_TYPE_PATTERNS = {
+    "reading": re.compile(r'\b(reading|read|story|stories|text)\b', re.IGNORECASE),
+    "vocabulary": re.compile(r'\b(vocabulary|vocab|words?)\b', re.IGNORECASE),
+    "writing": re.compile(r'\b(writing|write|translate (a|the) text)\b', re.IGNORECASE),
+    "quiz": re.compile(r'\b(quiz(zes)?|multiple choice|test)\b', re.IGNORECASE)
+}
+EXERCISE_CUE_PATTERN = re.compile(r'\b(exercises?|quiz(zes)?|practice|practise|drill)\b', re.IGNORECASE)
+
+# Every tag, i.e. the complete prompt
+ALL_PROMPT_TAGS = frozenset(
+    {"always", "file"} | set().union(*INTENT_PROMPT_TAGS.values())
+    | {f"exercise:{exercise_type}" for exercise_type in EXERCISE_TYPE_PATTERNS})
+
+# Prompt variants, from the complete prompt to the most compact one. "compact" keeps only
+# the learner's level in LEVEL ADAPTATION and states the level rules once; "minimal" also
+# drops fragments the CEFR guidelines already cover. evaluate_prompts.py compares them.
+PROMPT_VARIANTS = {
+    "full": {"compact": False, "drop": set()},
+    "compact": {"compact": True, "drop": set()},
+    "minimal": {"compact": True, "drop": {"CORE CAPABILITIES", "GRAMMAR GUIDELINES", "EXAMPLE SENTENCES"}}
+}
+
+# Closing reminder of SYSTEM_PROMPT, which repeats the level rules
+_CLOSING_REMINDER_PATTERN = re.compile(r'\n+Remember: It is ESSENTIAL.*', re.DOTALL)
+
+# Function to apply a prompt variant to the prompt fragments
+def apply_prompt_variant(fragments, variant, level_code):
+    """
+    Shorten or drop fragments for a compact prompt variant
+
+    Parameters:
+    - fragments: List of (name, tag, text) fragments
+    - variant: Name from PROMPT_VARIANTS (unknown names use "full")
+    - level_code: Learner's level code (A1, A2, etc.)
+
+    Returns:
+    - List of (name, tag, text) fragments
+    """
+    settings = PROMPT_VARIANTS.get(variant, PROMPT_VARIANTS["full"])
+    result = []
+    for name, tag, text in fragments:
+        if name in settings["drop"]:
+            continue
+        if settings["compact"]:
+            if name == "LEVEL ADAPTATION":
+                # Only the description of the learner's own level
+                lines = text.strip("\n").split("\n")
+                own_level = [line for line in lines if line.startswith(f"• {level_code}")]
+                text = "\n" + "\n".join(lines[:2] + own_level) + "\n"
+            elif name == "FORMATTING AND INTERACTION":
+                text = _CLOSING_REMINDER_PATTERN.sub("\n", text)
+            elif name == "LEVEL RULES":
+                text = (f"\nUse ONLY {level_code} vocabulary and grammar, keep explanations at {level_code} level "
+                        f"and show the {level_code} level indicator in your responses.\n")
+        result.append((name, tag, text))
+    return result
+
+# Function to split the exercise catalogue into one fragment per exercise type
+def split_exercise_catalogue(section):
+    """
+    Split the EXERCISE TYPES section into its introduction, one fragment per
+    numbered exercise type and the closing notes on reading and writing
+
+    Parameters:
+    - section: Text of the EXERCISE TYPES section
+
+    Returns:
+    - List of (name, tag, text) fragments
+    """
+    fragments = []
+    intro, _, rest = section.partition("\n1. ")
+    fragments.append(("EXERCISE TYPES", "exercises", intro))
+    items, _, notes = ("1. " + rest).partition("\n\n")
+    for item in re.split(r'\n(?=\d+\. )', items):
+        title = item.split(":", 1)[0].lower()
+        exercise_type = next((name for name in EXERCISE_TYPE_PATTERNS if name in title), None)
+        tag = f"exercise:{exercise_type}" if exercise_type else "exercises"
+        fragments.append((f"EXERCISE TYPES: {exercise_type or title}", tag, "\n" + item))
+    if notes:
+        # The notes are about reading and writing exercises
+        fragments.append(("EXERCISE TYPES: notes", "exercise:reading|exercise:writing", "\n\n" + notes))
+    return fragments
+
+# Function to get the tags of the fixed prompt prefix of a request type
+def get_prefix_prompt_tags(intent):
+    """
+    Get the tags of the fragments every request of a type is sent. They make up
+    the static system message, which then only depends on the language, level,
+    profile and prompt variant, so the provider can reuse its cached prefix.
+
+    Parameters:
+    - intent: Execution profile name
+
+    Returns:
+    - Frozenset of tags
+    """
+    return frozenset({"always"} | INTENT_PROMPT_TAGS.get(intent, INTENT_PROMPT_TAGS["general"]))
+
+# Function to choose the prompt fragments a request needs
+def select_prompt_tags(message, intent, file_attached=False):
+    """
+    Choose the tags of the prompt fragments relevant to a request, from its
+    intent and cheap checks on the message. The tags beyond get_prefix_prompt_tags
+    are the ones chosen for this message.
+
+    Parameters:
+    - message: User's message text (None uses the intent's defaults only)
+    - intent: Execution profile name
+    - file_attached: Whether an uploaded file is sent with the request
+
+    Returns:
+    - Frozenset of tags
+    """
+    tags = set(get_prefix_prompt_tags(intent))
+
+    if message and EXERCISE_CUE_PATTERN.search(message):
+        tags |= {"exercises", "feedback"}
+
+    if "exercises" in tags:
+        # Only the requested exercise types, or all of them when none is named
+        requested = {name for name, pattern in EXERCISE_TYPE_PATTERNS.items()
+                     if message and intent != "answer_check" and pattern.search(message)}
+        tags |= {f"exercise:{name}" for name in (requested or EXERCISE_TYPE_PATTERNS)}
+
+    if file_attached:
+        tags.add("file")
+
+    return frozenset(tags)
+
+# Function to join the relevant prompt fragments
+def assemble_prompt(fragments, tags):
+    """
+    Join the fragments whose tag was selected, keeping their order
+
+    Parameters:
+    - fragments: List of (name, tag, text); a tag may list alternatives separated by "|"
+    - tags: Selected tags
+
+    Returns:
+    - Tuple of (prompt text, names of the included fragments)
+    """
+    included = [(name, text) for name, tag, text in fragments if any(t in tags for t in tag.split("|"))]
+    return "".join(text for _, text in included), [name for name, _ in included]
+
+# Function to record what prompt assembly saved on a turn
+def record_prompt_assembly(session_state, intent, fragments, prompt_tokens, full_tokens):
+    """
+    Keep the prompt assembly report of the turn in session_state.prompt_assembly and log it
+
+    Parameters:
+    - session_state: Streamlit session state
+    - intent: Execution profile name
+    - fragments: Names of the included fragments
+    - prompt_tokens: Estimated tokens of the assembled static prompt
+    - full_tokens: Estimated tokens of the prompt with every fragment
+    """
+    report = {
+        "intent": intent,
+        "fragments": fragments,
+        "prompt_tokens": prompt_tokens,
+        "full_prompt_tokens": full_tokens,
+        "tokens_saved": max(full_tokens - prompt_tokens, 0)
+    }
+    session_state.prompt_assembly = report
+    logging.info(f"Prompt assembly for {intent}: {prompt_tokens} of {full_tokens} tokens "
+                 f"({report['tokens_saved']} saved), fragments: {', '.join(fragments)}")
@@ -0,0 +1,175 @@
+import os
+import re
+import json
+import hmac
+import time
+import hashlib
+import logging
+from llm_client import get_setting
+from token_estimator import get_token_estimator
+
+# Function to get the secret that signs session tokens
+def _checkpoint_secret():
+    secret = get_setting("REPLY_CHECKPOINT_SECRET", "")
+    return str(secret).encode("utf-8") if secret else None
+
+# Function to get the durable checkpoint file of a session
+def _checkpoint_path(session_id):
+    directory = get_setting("REPLY_CHECKPOINT_DIR", None)
+    if not directory or not session_id:
+        return None
+    if _checkpoint_secret() is None:
+        # Without a secret the session id in the URL cannot be verified, so the
+        # checkpoints of one learner could be loaded by anyone who guesses it
+        logging.warning("REPLY_CHECKPOINT_DIR is set without REPLY_CHECKPOINT_SECRET, checkpoints are kept in the session only")
+        return None
+    # Keep only safe characters, the id ends up in a file name
+    safe_id = re.sub(r'[^A-Za-z0-9_-]', '', str(session_id))
+    return os.path.join(directory, f"{safe_id}.json") if safe_id else None
+
+# Function to sign a session id for the URL
+def sign_session_id(session_id):
+    """
+    Build the session token kept in the URL, the session id followed by its
+    HMAC, so only ids this server handed out can select a checkpoint file
+
+    Parameters:
+    - session_id: Session id (a random UUID)
+
+    Returns:
+    - Token "<session id>.<signature>", or None without REPLY_CHECKPOINT_SECRET
+    """
+    secret = _checkpoint_secret()
+    if secret is None:
+        return None
+    signature = hmac.new(secret, str(session_id).encode("utf-8"), hashlib.sha256).hexdigest()
+    return f"{session_id}.{signature}"
+
+# Function to check a session token from the URL
+def verify_session_token(token):
+    """
+    Check the signature of a session token from the URL
+
+    Parameters:
+    - token: Token built by sign_session_id (may be None or tampered with)
+
+    Returns:
+    - The session id when the signature is valid, otherwise None
+    """
+    if not token or "." not in token:
+        return None
+    session_id = token.rsplit(".", 1)[0]
+    expected = sign_session_id(session_id)
+    if expected is None or not hmac.compare_digest(expected, token):
+        return None
+    return session_id
+
+class ReplyCheckpointer:
+    """
+    Saves a streamed reply into session state (and, with REPLY_CHECKPOINT_DIR
+    set, a JSON file per session) every few tokens or milliseconds, so an
+    interrupted reply can be shown, resumed or finalised on the next run
+    instead of being generated again
+    """
+    def __init__(self, session_state, question, level, lang_code, model=None, intent=None):
+        self.session_state = session_state
+        self.min_tokens = int(get_setting("REPLY_CHECKPOINT_TOKENS", 50))
+        self.min_interval = float(get_setting("REPLY_CHECKPOINT_INTERVAL_MS", 500)) / 1000.0
+        self.checkpoint = {
+            "question": question,
+            "partial": "",
+            "level": level,
+            "language": lang_code,
+            "model": model,
+            "intent": intent,
+            "status": "streaming",
+            "updated": time.time()
+        }
+        self._saved_chars = 0
+        self._saved_at = time.monotonic()
+        self._save()
+
+    def update(self, text):
+        """
+        Record the reply received so far, saving it when enough text or time has passed
+
+        Parameters:
+        - text: Complete reply text received so far
+        """
+        self.checkpoint["partial"] = text
+        if (get_token_estimator().count(text[self._saved_chars:]) >= self.min_tokens
+                or time.monotonic() - self._saved_at >= self.min_interval):
+            self._save()
+
+    def interrupted(self, text):
+        """Save the final partial reply of an interrupted stream"""
+        self.checkpoint["partial"] = text
+        self.checkpoint["status"] = "interrupted"
+        self._save()
+
+    def finish(self):
+        """The reply is complete and stored in the chat, so drop the checkpoint"""
+        clear_reply_checkpoint(self.session_state)
+
+    def _save(self):
+        self.checkpoint["updated"] = time.time()
+        self._saved_chars = len(self.checkpoint["partial"])
+        self._saved_at = time.monotonic()
+        self.session_state.reply_checkpoint = dict(self.checkpoint)
+
+        path = _checkpoint_path(getattr(self.session_state, 'session_id', None))
+        if path:
+            try:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Write to a temporary file first so a crash never leaves a half-written checkpoint
+                temp_path = path + ".tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    json.dump(self.checkpoint, f, ensure_ascii=False)
+                os.replace(temp_path, path)
+            except OSError as e:
+                logging.warning(f"Could not write reply checkpoint: {str(e)}")
+
+# Function to get an interrupted reply of this session
+def get_reply_checkpoint(session_state):
+    """
+    Get the checkpoint of a reply that did not finish, from session state or
+    the durable store (e.g. after a server restart)
+
+    Parameters:
+    - session_state: Streamlit session state
+
+    Returns:
+    - Checkpoint dictionary with question, partial reply, level, language,
+      model, intent and status, or None
+    """
+    checkpoint = session_state.reply_checkpoint if hasattr(session_state, 'reply_checkpoint') else None
+    if checkpoint:
+        return checkpoint
+
+    path = _checkpoint_path(getattr(session_state, 'session_id', None))
+    if path and os.path.exists(path):
+        try:
+            with open(path, encoding="utf-8") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read reply checkpoint: {str(e)}")
+            return None
+        session_state.reply_checkpoint = checkpoint
+        return checkpoint
+    return None
+
+# Function to drop the checkpoint of this session
+def clear_reply_checkpoint(session_state):
+    """
+    Remove the reply checkpoint from session state and the durable store
+
+    Parameters:
+    - session_state: Streamlit session state
+    """
+    session_state.reply_checkpoint = None
+    path = _checkpoint_path(getattr(session_state, 'session_id', None))
+    if path and os.path.exists(path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            logging.warning(f"Could not remove reply checkpoint: {str(e)}")
@@ -0,0 +1,121 @@
+import asyncio
+import queue
+import threading
+
+# Marker appended to replies that were stopped before they were complete
+TRUNCATED_NOTE = "\n\n*⏹ Response stopped before it was complete.*"
+
+class CancellationToken:
+    """
+    Thread-safe cancellation flag for one streamed reply. Cancelling it aborts
+    the upstream request of every stream registered with it.
+    """
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        # Reply text received so far, kept if the reply is stopped
+        self.partial = ""
+
+    @property
+    def cancelled(self):
+        return self._event.is_set()
+
+    def cancel(self):
+        """Cancel the reply (safe to call from any thread, more than once)"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks)
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """Register a callback run once on cancellation (immediately if already cancelled)"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+_loop = None
+_loop_lock = threading.Lock()
+
+def _get_stream_loop():
+    """Event loop on a background thread that runs every async stream in the process"""
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="polyglot-stream-loop", daemon=True).start()
+        return _loop
+
+_DONE = object()
+
+# Function to consume an async stream from synchronous code
+def iterate_async_stream(make_stream, token=None):
+    """
+    Run an async generator on the background event loop and yield its items.
+    Cancelling the token (or closing this generator) cancels the task, which
+    closes the upstream HTTP response immediately; iteration then just ends.
+
+    Parameters:
+    - make_stream: Function without arguments returning an async generator
+    - token: Optional CancellationToken
+
+    Returns:
+    - Generator of the async generator's items
+    """
+    items = queue.Queue()
+
+    async def pump():
+        try:
+            async for item in make_stream():
+                items.put((item, None))
+        except Exception as e:
+            items.put((None, e))
+
+    task = asyncio.run_coroutine_threadsafe(pump(), _get_stream_loop())
+    # Also signals the end when the task is cancelled before it starts
+    task.add_done_callback(lambda _: items.put((_DONE, None)))
+
+    def cancel():
+        # Thread-safe, cancels the task on the loop
+        task.cancel()
+
+    if token is not None:
+        token.on_cancel(cancel)
+    try:
+        while True:
+            item, error = items.get()
+            if error is not None:
+                raise error
+            if item is _DONE:
+                return
+            yield item
+    finally:
+        if not task.done():
+            cancel()
+
+# Function to run a coroutine from synchronous code
+def run_async(make_coroutine, token=None):
+    """
+    Run a coroutine on the background event loop and wait for its result.
+    Cancelling the token cancels the task, which closes its HTTP request.
+
+    Parameters:
+    - make_coroutine: Function without arguments returning a coroutine
+    - token: Optional CancellationToken
+
+    Returns:
+    - The coroutine's result (raises CancelledError if the token was cancelled)
+    """
+    task = asyncio.run_coroutine_threadsafe(make_coroutine(), _get_stream_loop())
+    if token is not None:
+        token.on_cancel(task.cancel)
+    try:
+        return task.result()
+    finally:
+        if not task.done():
+            task.cancel()
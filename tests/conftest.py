@@ -0,0 +1,17 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+# The modules live at the top level of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def session_state():
+    """A minimal stand-in for Streamlit's session state"""
+    return SimpleNamespace(messages=[], chat_history=[], selected_level="B1 (Intermediate)", selected_language="fin",
+                           user_topics={}, level_history=[], current_level_changed=False, language_changed=False,
+                           uploaded_file=None, chat_started=False, session_id="test-session",
+                           pending_turn_analyses=[])
@@ -0,0 +1,107 @@
+import json
+import threading
+
+import pytest
+
+import helper_gateway
+from helper_gateway import BATCH_ITEM_OVERHEAD_TOKENS, HelperBatchGateway
+
+
+class BatchBackend:
+    """Answers batched prompts with one output per index, except for the indexes in skip"""
+    def __init__(self, skip=()):
+        self.skip = set(skip)
+        self.calls = []
+
+    def invoke(self, messages, max_tokens, response_format=None):
+        items = json.loads(messages[-1]["content"])
+        self.calls.append({"max_tokens": max_tokens, "size": len(items)})
+        results = [{"index": item["index"], "output": item["input"].upper()}
+                   for item in items if item["index"] not in self.skip]
+        return json.dumps({"results": results})
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = BatchBackend()
+    monkeypatch.setattr(helper_gateway, "get_helper_backend", lambda: backend)
+    return backend
+
+
+@pytest.fixture
+def direct_calls(monkeypatch):
+    calls = []
+
+    def invoke_direct(messages, max_tokens, response_format=None):
+        calls.append((messages[-1]["content"], max_tokens))
+        return "direct " + messages[-1]["content"]
+
+    monkeypatch.setattr(helper_gateway, "invoke_helper_direct", invoke_direct)
+    return calls
+
+
+def make_request(text, max_tokens=100):
+    messages = [{"role": "system", "content": "Upper-case the input"}, {"role": "user", "content": text}]
+    return helper_gateway._HelperRequest(messages, max_tokens, None)
+
+
+def test_batch_token_limit_is_the_sum_of_its_requests(backend):
+    gateway = HelperBatchGateway()
+    batch = [make_request("a", 50), make_request("b", 250), make_request("c", 200)]
+
+    gateway._send_batch(batch)
+
+    assert backend.calls[0]["max_tokens"] == 500 + 3 * BATCH_ITEM_OVERHEAD_TOKENS
+
+
+def test_outputs_are_fanned_out_by_index(backend, direct_calls):
+    gateway = HelperBatchGateway()
+    batch = [make_request("first"), make_request("second"), make_request("third")]
+
+    gateway._dispatch(batch)
+
+    assert [request.future.result(timeout=1) for request in batch] == ["FIRST", "SECOND", "THIRD"]
+    assert direct_calls == []
+
+
+def test_a_missing_index_falls_back_to_a_single_call(monkeypatch, direct_calls):
+    backend = BatchBackend(skip={1})
+    monkeypatch.setattr(helper_gateway, "get_helper_backend", lambda: backend)
+    gateway = HelperBatchGateway()
+    batch = [make_request("first"), make_request("second", 80), make_request("third")]
+
+    gateway._dispatch(batch)
+
+    assert [request.future.result(timeout=1) for request in batch] == ["FIRST", "direct second", "THIRD"]
+    assert direct_calls == [("second", 80)]
+    assert gateway.get_stats()["fallbacks"] == 1
+
+
+def test_requests_are_packed_only_while_their_limits_fit(backend, direct_calls):
+    gateway = HelperBatchGateway(window_ms=200, batch_max_tokens=2 * (250 + BATCH_ITEM_OVERHEAD_TOKENS))
+    barrier = threading.Barrier(3)
+    futures = []
+
+    def submit(text):
+        barrier.wait()
+        futures.append(gateway.submit(make_request(text, 250).messages, 250))
+
+    threads = [threading.Thread(target=submit, args=(text,)) for text in ("a", "b", "c")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    results = sorted(future.result(timeout=5) for future in futures)
+
+    # Two requests fill the token limit, the third goes out on its own
+    assert [call["size"] for call in backend.calls] == [2]
+    assert len(direct_calls) == 1
+    assert len(results) == 3
+    assert all(call["max_tokens"] <= gateway.batch_max_tokens for call in backend.calls)
+
+
+def test_stats_report_averages_without_the_raw_totals():
+    stats = HelperBatchGateway().get_stats()
+
+    assert stats["average_fill_ratio"] == 0.0
+    assert "fill_ratio_total" not in stats
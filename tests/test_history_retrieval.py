@@ -0,0 +1,75 @@
+import chatbot
+from history_retrieval import ExchangeIndex, RETRIEVED_HEADING, retrieve_relevant_history
+from llm_backends import OpenAIBackend
+from turn_deadline import TurnDeadline
+
+
+def exchange(question, reply, language="fin"):
+    return [{"role": "user", "content": question, "kind": "dialogue", "language": language, "timestamp": "2026-10-01 10:00:00"},
+            {"role": "assistant", "content": reply, "kind": "dialogue", "language": language}]
+
+
+HISTORY = (
+    exchange("How does the partitive case work?", "The partitive case marks partial objects: juon kahvia.")      # 0
+    + exchange("Give me food vocabulary", "leipä, juusto, maito")                                              # 2
+    + exchange("When do I use the partitive case with numbers?", "After numbers the partitive is used: kaksi kahvia.")  # 4
+    + [{"role": "assistant", "content": "Your language has been changed to Spanish.", "kind": "notice"}]      # 6
+    + exchange("Explain the partitive article in Spanish", "Spanish has no partitive case.", language="spa")   # 7
+)
+
+
+def build_index():
+    index = ExchangeIndex()
+    index.update(HISTORY)
+    return index
+
+
+def test_search_finds_the_exchanges_about_the_query():
+    ids = [exchange_id for exchange_id, _ in build_index().search("partitive case", k=5)]
+    assert set(ids) == {0, 4, 7}
+    assert 2 not in ids
+
+
+def test_search_only_considers_exchanges_before_a_position():
+    ids = [exchange_id for exchange_id, _ in build_index().search("partitive case", k=5, before=4)]
+    assert ids == [0]
+
+
+def test_search_only_considers_exchanges_in_a_language():
+    index = build_index()
+    assert [exchange_id for exchange_id, _ in index.search("partitive", k=5, language="spa")] == [7]
+    assert 7 not in [exchange_id for exchange_id, _ in index.search("partitive", k=5, language="fin")]
+
+
+def test_index_starts_over_when_the_conversation_is_reset():
+    index = build_index()
+    index.update(exchange("Numbers from one to ten", "yksi, kaksi, kolme"))
+    assert index.search("partitive", k=5) == []
+    assert [exchange_id for exchange_id, _ in index.search("numbers", k=5)] == [0]
+
+
+def test_retrieval_brings_back_exchanges_before_the_window(session_state):
+    session_state.chat_history = list(HISTORY)
+    session_state.messages = [dict(entry) for entry in HISTORY]
+    message = retrieve_relevant_history(session_state, "More food vocabulary please", 4, "fin")
+    assert message["content"].startswith(RETRIEVED_HEADING)
+    assert "leipä, juusto, maito" in message["content"] and "kahvia" not in message["content"]
+
+
+def test_no_retrieval_when_messages_and_chat_history_are_out_of_step(session_state):
+    session_state.chat_history = list(HISTORY)
+    session_state.messages = [dict(entry) for entry in HISTORY[:-2]]
+    assert retrieve_relevant_history(session_state, "More food vocabulary please", 4, "fin") is None
+
+
+def test_retrieval_is_skipped_when_only_the_reply_reserve_is_left(session_state, monkeypatch):
+    session_state.chat_history = list(HISTORY)
+    session_state.messages = [dict(entry) for entry in HISTORY]
+    calls = []
+    monkeypatch.setattr(chatbot, "retrieve_relevant_history", lambda *args: calls.append(args))
+    monkeypatch.setattr(chatbot, "get_reply_backend", lambda: OpenAIBackend(api_key="sk-test"))
+    monkeypatch.setattr(chatbot, "stream_resilient", lambda *args, **kwargs: iter(()))
+    deadline = TurnDeadline(5.0, optional_reserve=8.0)
+    chatbot.call_openai_api(session_state, deadline)
+    assert calls == []
+    assert "history_retrieval" in deadline.get_report()["skipped"]
@@ -0,0 +1,72 @@
+from history_window import ELIDED_NOTE, fit_history
+from token_estimator import MESSAGE_OVERHEAD_TOKENS, get_token_estimator
+
+EXERCISE = """Here is an exercise on the partitive case. Fill in the blanks:
+1. Juon ____ (kahvi).
+2. Ostan ____ (leipä).
+3. Syön ____ (omena)."""
+
+
+def conversation(turns, words=40):
+    messages = []
+    for turn in range(turns):
+        messages.append({"role": "user", "content": f"Question {turn}: " + "sana " * words})
+        messages.append({"role": "assistant", "content": f"Answer {turn}: " + "vastaus " * words})
+    return messages
+
+
+def tokens(messages):
+    estimator = get_token_estimator()
+    return sum(estimator.estimate_content(m["content"]) + MESSAGE_OVERHEAD_TOKENS for m in messages)
+
+
+def test_short_history_is_sent_whole():
+    messages = conversation(3)
+    kept, dropped, report = fit_history(messages, budget_tokens=10000, keep_turns=2)
+    assert kept == messages and dropped == []
+    assert report["messages_included"] == 6 and report["messages_dropped"] == 0
+
+
+def test_oldest_messages_are_dropped_to_fit_the_budget():
+    messages = conversation(10)
+    budget = tokens(messages[-6:]) + 10
+    kept, dropped, report = fit_history(messages, budget_tokens=budget, keep_turns=2)
+    assert kept == messages[-6:]
+    assert dropped == messages[:-6]
+    assert report["tokens_included"] <= budget
+    assert report["messages_total"] == len(kept) + len(dropped)
+
+
+def test_first_message_that_does_not_fit_is_shortened():
+    messages = conversation(4, words=200)
+    budget = tokens(messages[-4:]) + 120
+    kept, dropped, report = fit_history(messages, budget_tokens=budget, keep_turns=2)
+    assert report["messages_elided"] == 1
+    assert kept[0]["content"].endswith(ELIDED_NOTE)
+    assert messages[-5]["content"].startswith(kept[0]["content"][:-len(ELIDED_NOTE)])
+    assert kept[1:] == messages[-4:]
+    assert dropped == messages[:-5]
+
+
+def test_latest_turns_are_kept_even_over_budget():
+    messages = conversation(4)
+    kept, dropped, report = fit_history(messages, budget_tokens=1, keep_turns=2)
+    assert kept == messages[-4:]
+    assert report["tokens_included"] > 1
+
+
+def test_exercise_in_progress_is_kept():
+    messages = conversation(3) + [{"role": "assistant", "content": EXERCISE},
+                                  {"role": "user", "content": "1. kahvia 2. leipää 3. omenaa"}]
+    messages += [{"role": "assistant", "content": "Hyvä! " + "selitys " * 40}]
+    # Keeping only the last turn would leave the exercise out
+    kept, _, _ = fit_history(messages, budget_tokens=1, keep_turns=1)
+    assert kept[0]["content"] == EXERCISE
+
+
+def test_finished_exercise_is_not_pinned():
+    messages = [{"role": "assistant", "content": EXERCISE},
+                {"role": "user", "content": "1. kahvia 2. leipää 3. omenaa"}] + conversation(3)
+    kept, dropped, _ = fit_history(messages, budget_tokens=1, keep_turns=1)
+    assert kept == messages[-2:]
+    assert dropped[0]["content"] == EXERCISE
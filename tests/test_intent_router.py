@@ -0,0 +1,70 @@
+import pytest
+
+import intent_router
+from intent_router import route_intent, is_exercise, get_profile_max_tokens, EXECUTION_PROFILES
+
+EXERCISE = """Here is a vocabulary exercise about shopping. Fill in the missing words:
+1. Minä ostan ____ (bread).
+2. Kauppa on ____ (open).
+3. Paljonko tämä ____ (costs)?"""
+
+
+def assistant(session_state, content):
+    session_state.messages.append({"role": "assistant", "content": content})
+
+
+@pytest.mark.parametrize("message, intent", [
+    ("T: Minä asun Helsingissä.", "translation"),
+    ("Give me a vocabulary exercise about shopping", "exercise"),
+    ("Can you check my translation: Hier, je suis allé au marché.", "answer_check"),
+    ("Why is it talossa and not talolla?", "grammar"),
+    ("Explain the difference between ser and estar", "grammar"),
+    ("How do the verb endings change in the past tense?", "grammar"),
+    ("I have a job interview in German next week. How should I prepare?", "general"),
+])
+def test_routes_requests(session_state, message, intent):
+    assert route_intent(message, session_state)[0] == intent
+
+
+@pytest.mark.parametrize("message", [
+    "Why not?",
+    "Why do people in Finland love saunas so much?",
+    "Can you explain what happened at the market yesterday?",
+])
+def test_why_and_explain_alone_are_not_grammar(session_state, message):
+    assert route_intent(message, session_state)[0] == "general"
+
+
+def test_answers_after_an_exercise_are_checked(session_state):
+    assistant(session_state, EXERCISE)
+    assert route_intent("leipää, auki, maksaa", session_state)[0] == "answer_check"
+
+
+@pytest.mark.parametrize("sign_off", [
+    "Great job today! Any other questions?",
+    "Do you have questions about the partitive? Just ask.",
+    "That was a nice exercise in patience! See you tomorrow.",
+])
+def test_sign_offs_are_not_exercises(session_state, sign_off):
+    assistant(session_state, sign_off)
+    assert not is_exercise(sign_off)
+    assert route_intent("I went to the cinema yesterday", session_state)[0] == "general"
+
+
+def test_numbered_explanation_is_not_an_exercise():
+    # Numbered items alone (e.g. a list of rules) are not an exercise
+    assert not is_exercise("The partitive is used:\n1. After numbers\n2. For uncountable things")
+    assert is_exercise(EXERCISE)
+
+
+def test_changes_force_the_general_profile(session_state):
+    session_state.language_changed = True
+    assert route_intent("T: hola", session_state)[0] == "general"
+
+
+def test_profile_token_limits_are_configurable(monkeypatch):
+    settings = {"TRANSLATION_MAX_TOKENS": "300", "MAX_TOKENS": 6000}
+    monkeypatch.setattr(intent_router, "get_setting", lambda name, default=None: settings.get(name, default))
+    assert get_profile_max_tokens(EXECUTION_PROFILES["translation"]) == 300
+    assert get_profile_max_tokens(EXECUTION_PROFILES["grammar"]) == 2000
+    assert get_profile_max_tokens(EXECUTION_PROFILES["general"]) == 6000
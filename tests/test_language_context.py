@@ -0,0 +1,46 @@
+from concurrent.futures import Future
+
+import chatbot
+from history_window import get_context_positions, MESSAGE_KIND_NOTICE
+from intent_router import EXECUTION_PROFILES
+
+GENERAL = EXECUTION_PROFILES["general"]
+
+
+def finished(analysis):
+    future = Future()
+    future.set_result(analysis)
+    return future
+
+
+def test_topics_are_kept_per_language(session_state):
+    session_state.pending_turn_analyses = [(finished({"topics": ["partitive"]}), "fin"),
+                                           (finished({"topics": ["ser and estar"]}), "spa")]
+    chatbot.collect_turn_analyses(session_state)
+
+    spanish = chatbot.get_dynamic_prompt_parts(session_state, GENERAL, "spa", "Spanish", "A2 (Elementary)")
+    finnish = chatbot.get_dynamic_prompt_parts(session_state, GENERAL, "fin", "Finnish", "B1 (Intermediate)")
+    assert "ser and estar" in spanish["topics"] and "partitive" not in spanish["topics"]
+    assert "partitive" in finnish["topics"] and "ser and estar" not in finnish["topics"]
+
+
+def test_level_history_is_kept_per_language(session_state):
+    session_state.level_history = [
+        {"from": "A1 (Beginner)", "to": "A2 (Elementary)", "timestamp": "2026-10-01 10:00:00", "language": "fin"},
+        {"from": "B1 (Intermediate)", "to": "B2 (Upper Intermediate)", "timestamp": "2026-10-02 10:00:00", "language": "spa"},
+    ]
+    spanish = chatbot.get_dynamic_prompt_parts(session_state, GENERAL, "spa", "Spanish", "B2 (Upper Intermediate)")
+    assert "B1 (Intermediate) to B2" in spanish["level_history"]
+    assert "A1 (Beginner)" not in spanish["level_history"]
+
+
+def test_notices_and_other_languages_are_left_out(session_state):
+    chatbot.add_notice_message(session_state, "Hyvää päivää! I'm your Finnish tutor.")
+    session_state.messages.append({"role": "user", "content": "Moi", "kind": "dialogue", "language": "fin"})
+    session_state.selected_language = "spa"
+    chatbot.add_notice_message(session_state, "Your target language has been changed to Spanish.")
+    session_state.messages.append({"role": "user", "content": "Hola", "kind": "dialogue", "language": "spa"})
+
+    assert session_state.messages[0]["kind"] == MESSAGE_KIND_NOTICE
+    assert get_context_positions(session_state.messages, "fin") == [1]
+    assert get_context_positions(session_state.messages, "spa") == [3]
@@ -0,0 +1,95 @@
+import threading
+
+import learner_memory
+from learner_memory import (LEARNER_MEMORY_HEADING, collect_learner_memory, fold_into_summary, get_learner_memory,
+                            get_learner_memory_message, schedule_learner_memory, start_learner_memory_update)
+
+
+def dialogue(role, content, language="fin"):
+    return {"role": role, "content": content, "kind": "dialogue", "language": language}
+
+
+def test_fold_sends_the_current_summary_and_the_new_messages(monkeypatch):
+    prompts = []
+    monkeypatch.setattr(learner_memory, "invoke_helper", lambda prompt, max_tokens: prompts.append(prompt) or " - partitive practised \n")
+    messages = [dialogue("user", "Mikä on partitiivi?"),
+                dialogue("assistant", '<span class="level-badge">B1</span> Partitiivi on sijamuoto.')]
+    summary = fold_into_summary("- likes coffee", messages, "Finnish", "B1 (Intermediate)", 200)
+
+    assert summary == "- partitive practised"
+    system, user = prompts[0]
+    assert "Finnish at B1 (Intermediate) level" in system["content"]
+    assert "Current memory:\n- likes coffee" in user["content"]
+    assert "USER: Mikä on partitiivi?" in user["content"]
+    assert "ASSISTANT: Partitiivi on sijamuoto." in user["content"]
+    assert "level-badge" not in user["content"]
+
+
+def test_dropped_messages_are_folded_after_the_turn(session_state, monkeypatch):
+    prompts = []
+    monkeypatch.setattr(learner_memory, "invoke_helper", lambda prompt, max_tokens: prompts.append(prompt) or "- asked about the partitive")
+    session_state.messages = [
+        dialogue("user", "Mikä on partitiivi?"),
+        {"role": "assistant", "content": "Your language has been changed to Spanish.", "kind": "notice", "language": "spa"},
+        dialogue("user", "¿Qué es ser?", language="spa"),
+        dialogue("assistant", "Partitiivi on sijamuoto."),
+        dialogue("user", "Kiitos!"),
+    ]
+    assert get_learner_memory_message(session_state, "fin") is None
+
+    schedule_learner_memory(session_state, "fin", 4)
+    start_learner_memory_update(session_state, "fin")
+    collect_learner_memory(session_state, timeout=5)
+
+    memory = get_learner_memory(session_state, "fin")
+    assert memory["summary"] == "- asked about the partitive" and memory["covered"] == 4
+    # Notices and the Spanish conversation are not part of the Finnish memory
+    excerpt = prompts[0][1]["content"]
+    assert "Partitiivi on sijamuoto." in excerpt and "ser" not in excerpt and "Spanish" not in excerpt
+    assert get_learner_memory_message(session_state, "fin")["content"] == f"{LEARNER_MEMORY_HEADING}\n- asked about the partitive"
+    assert get_learner_memory_message(session_state, "spa") is None
+
+
+def test_one_update_runs_at_a_time_and_the_next_one_continues(session_state, monkeypatch):
+    release = threading.Event()
+    excerpts = []
+
+    def helper(prompt, max_tokens):
+        excerpts.append(prompt[1]["content"])
+        release.wait(5)
+        return f"- summary {len(excerpts)}"
+
+    monkeypatch.setattr(learner_memory, "invoke_helper", helper)
+    session_state.messages = [dialogue("user" if index % 2 == 0 else "assistant", f"viesti {index}") for index in range(6)]
+
+    schedule_learner_memory(session_state, "fin", 2)
+    start_learner_memory_update(session_state, "fin")
+    collect_learner_memory(session_state)  # Still running, nothing applied yet
+    schedule_learner_memory(session_state, "fin", 4)
+    start_learner_memory_update(session_state, "fin")  # Waits for the running update
+    assert get_learner_memory(session_state, "fin")["covered"] == 0
+
+    release.set()
+    collect_learner_memory(session_state, timeout=5)
+    assert get_learner_memory(session_state, "fin")["covered"] == 2
+    start_learner_memory_update(session_state, "fin")
+    collect_learner_memory(session_state, timeout=5)
+
+    memory = get_learner_memory(session_state, "fin")
+    assert memory["covered"] == 4 and memory["summary"] == "- summary 2"
+    assert len(excerpts) == 2
+    assert "Current memory:\n- summary 1" in excerpts[1] and "viesti 2" in excerpts[1] and "viesti 1" not in excerpts[1]
+
+
+def test_failed_update_leaves_the_messages_to_fold_again(session_state, monkeypatch):
+    def failing(prompt, max_tokens):
+        raise ConnectionError("helper down")
+
+    monkeypatch.setattr(learner_memory, "invoke_helper", failing)
+    session_state.messages = [dialogue("user", "Moi"), dialogue("assistant", "Moi moi")]
+    schedule_learner_memory(session_state, "fin", 2)
+    start_learner_memory_update(session_state, "fin")
+    collect_learner_memory(session_state, timeout=5)
+
+    memory = get_learner_memory(session_state, "fin")
+    assert memory["covered"] == 0 and memory["pending"] is None and memory["fold_until"] == 2
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+import chatbot
+import llm_backends
+from llm_backends import LLMBackend, OpenAIBackend, OpenAICompatibleBackend
+
+
+class EchoBackend(LLMBackend):
+    """Answers with the last message, one word per chunk"""
+    name = "echo"
+
+    def resolve_model(self, model=None):
+        return model or "echo-1"
+
+    def _invoke(self, messages, max_tokens, response_format, model, priority):
+        return messages[-1]["content"]
+
+    async def _ainvoke(self, messages, max_tokens, response_format, model, priority):
+        return messages[-1]["content"]
+
+    def _stream(self, messages, max_tokens, model, priority, cache_key):
+        words = messages[-1]["content"].split()
+        for index, word in enumerate(words):
+            usage = {"input_tokens": 10, "cached_tokens": 4} if index == len(words) - 1 else None
+            yield word + " ", usage
+
+    async def _astream(self, messages, max_tokens, model, priority, cache_key):
+        for text, usage in self._stream(messages, max_tokens, model, priority, cache_key):
+            yield text, usage
+
+
+def test_the_interface_cannot_be_instantiated():
+    with pytest.raises(TypeError):
+        LLMBackend()
+
+
+def test_a_backend_must_implement_every_primitive():
+    class NoAsyncStream(EchoBackend):
+        _astream = LLMBackend._astream
+
+    with pytest.raises(TypeError, match="_astream"):
+        NoAsyncStream()
+
+
+def test_streams_record_usage_and_stats():
+    backend = EchoBackend()
+    usage = {}
+    assert "".join(backend.stream([{"role": "user", "content": "hei maailma"}], 50, usage=usage)) == "hei maailma "
+    assert usage == {"input_tokens": 10, "cached_tokens": 4}
+
+    async def collect():
+        return [text async for text in backend.astream([{"role": "user", "content": "moi"}], 50)]
+
+    assert asyncio.run(collect()) == ["moi "]
+    assert asyncio.run(backend.ainvoke([{"role": "user", "content": "kiitos"}], 50)) == "kiitos"
+    stats = backend.get_stats()
+    assert stats["streams"] == 2 and stats["requests"] == 3 and stats["errors"] == 0
+    assert stats["cache_hit_rate"] == pytest.approx(0.4)
+    assert stats["model"] == "echo-1"
+
+
+def test_unused_backend_reports_averages_without_the_raw_totals():
+    stats = EchoBackend().get_stats()
+    assert stats["average_latency"] == 0.0
+    assert "latency_total" not in stats
+
+
+def test_only_the_openai_backend_needs_an_openai_key(monkeypatch):
+    settings = {}
+    monkeypatch.setattr(llm_backends, "get_setting", lambda name, default=None: settings.get(name, default))
+    assert not OpenAIBackend().has_credentials()
+    assert OpenAIBackend(api_key="sk-test").has_credentials()
+    assert OpenAICompatibleBackend("http://localhost:8000/v1", default_model="qwen").has_credentials()
+    settings["OPENAI_API_KEY"] = "sk-test"
+    assert OpenAIBackend().has_credentials()
+
+
+def test_local_reply_backend_works_without_an_openai_key(session_state, monkeypatch):
+    local = OpenAICompatibleBackend("http://localhost:8000/v1", default_model="qwen")
+    monkeypatch.setattr(chatbot, "get_reply_backend", lambda: local)
+    monkeypatch.setattr(chatbot, "stream_resilient", lambda *args, **kwargs: iter(["Hei!"]))
+    session_state.messages = [{"role": "user", "content": "Moi!"}]
+    response = chatbot.call_openai_api(session_state)
+    assert "API key not configured" not in response and response.endswith("Hei!")
+
+    monkeypatch.setattr(chatbot, "get_reply_backend", lambda: OpenAIBackend())
+    assert "API key not configured" in chatbot.call_openai_api(session_state)
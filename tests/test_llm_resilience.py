@@ -0,0 +1,218 @@
+import queue
+import threading
+import time
+
+import pytest
+
+import llm_resilience
+from llm_resilience import CircuitBreaker, CircuitOpenError, LatencyTracker, call_hedged, stream_resilient
+
+
+class FixedDelayTracker(LatencyTracker):
+    """Hedges after a fixed delay, whatever the samples say"""
+    def __init__(self, delay):
+        super().__init__("test")
+        self.delay = delay
+
+    def hedge_delay(self):
+        return self.delay
+
+
+def test_fast_first_attempt_is_not_hedged():
+    calls = []
+
+    def attempt(token):
+        calls.append(token)
+        return "first"
+
+    assert call_hedged(attempt, FixedDelayTracker(0.5)) == "first"
+    assert len(calls) == 1
+
+
+def test_loser_is_cancelled_as_soon_as_the_hedge_wins():
+    started = []
+    loser_cancelled = threading.Event()
+    discarded = []
+
+    def attempt(token):
+        started.append(token)
+        if len(started) == 1:
+            # Slow first attempt that stops as soon as it is cancelled
+            token.on_cancel(loser_cancelled.set)
+            assert loser_cancelled.wait(5)
+            return "slow"
+        return "fast"
+
+    assert call_hedged(attempt, FixedDelayTracker(0.05), discarded.append) == "fast"
+    assert loser_cancelled.wait(1)
+    assert started[0].cancelled and not started[1].cancelled
+    # The loser's late result is released
+    deadline = time.monotonic() + 1
+    while not discarded and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert discarded == ["slow"]
+
+
+def test_all_attempts_failing_raises_the_error():
+    def attempt(token):
+        time.sleep(0.1)
+        raise ValueError("boom")
+
+    with pytest.raises(ValueError):
+        call_hedged(attempt, FixedDelayTracker(0.05))
+
+
+def test_interrupted_wait_cancels_every_attempt(monkeypatch):
+    tokens = []
+
+    def attempt(token):
+        tokens.append(token)
+        token.on_cancel(lambda: None)
+        while not token.cancelled:
+            time.sleep(0.01)
+        return "late"
+
+    class InterruptedQueue(queue.Queue):
+        def get(self, *args, **kwargs):
+            # A Streamlit rerun or stop arrives while waiting for the first result
+            raise KeyboardInterrupt
+
+    discarded = []
+    monkeypatch.setattr(llm_resilience.queue, "Queue", InterruptedQueue)
+    with pytest.raises(KeyboardInterrupt):
+        call_hedged(attempt, FixedDelayTracker(0.05), discarded.append)
+    monkeypatch.undo()
+
+    assert tokens and all(token.cancelled for token in tokens)
+    deadline = time.monotonic() + 1
+    while not discarded and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert discarded == ["late"]
+
+
+def test_losing_stream_is_closed():
+    closed = []
+
+    def start_stream(token):
+        slow = len(streams) == 0
+        streams.append(token)
+
+        def chunks():
+            try:
+                if slow:
+                    while not token.cancelled:
+                        time.sleep(0.01)
+                    return
+                yield "Hei"
+                yield "!"
+            finally:
+                closed.append(slow)
+        return chunks()
+
+    streams = []
+    assert "".join(stream_resilient(start_stream, FixedDelayTracker(0.05))) == "Hei!"
+    assert streams[0].cancelled
+    deadline = time.monotonic() + 1
+    while True not in closed and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert True in closed
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake = FakeClock()
+    monkeypatch.setattr(llm_resilience.time, "monotonic", fake)
+    return fake
+
+
+def fail():
+    raise ConnectionError("upstream down")
+
+
+def test_breaker_opens_after_consecutive_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, cooldown=30.0)
+    for _ in range(3):
+        with pytest.raises(ConnectionError):
+            breaker.call(fail)
+    calls = []
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: calls.append(True))
+    assert calls == []
+    stats = breaker.get_stats()
+    assert stats["state"] == "open" and stats["trips"] == 1 and stats["short_circuited"] == 1
+
+
+def test_success_resets_the_failure_count(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            breaker.call(fail)
+    assert breaker.call(lambda: "ok") == "ok"
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+    assert breaker.get_stats()["state"] == "closed"
+
+
+def test_slow_calls_count_as_failures(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, slow_call_seconds=10.0)
+
+    def slow():
+        clock.now += 11.0
+        return "late"
+
+    assert breaker.call(slow) == "late"
+    assert breaker.get_stats()["state"] == "open"
+
+
+def test_half_open_trial_success_closes_the_circuit(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, cooldown=30.0, trial_calls=1)
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+    clock.now += 31.0
+
+    # Only one trial call goes through while it is in flight
+    def trial():
+        with pytest.raises(CircuitOpenError):
+            breaker.call(lambda: "second")
+        return "recovered"
+
+    assert breaker.call(trial) == "recovered"
+    assert breaker.get_stats()["state"] == "closed"
+    assert breaker.call(lambda: "ok") == "ok"
+
+
+def test_half_open_trial_failure_opens_the_circuit_again(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2, cooldown=30.0)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            breaker.call(fail)
+    clock.now += 31.0
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+    assert breaker.get_stats()["state"] == "open"
+    assert breaker.get_stats()["trips"] == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.call(lambda: "too soon")
+
+
+def test_interrupted_trial_frees_its_slot(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, cooldown=30.0)
+    with pytest.raises(ConnectionError):
+        breaker.call(fail)
+    clock.now += 31.0
+
+    def interrupted():
+        raise KeyboardInterrupt()
+
+    with pytest.raises(KeyboardInterrupt):
+        breaker.call(interrupted)
+    assert breaker.get_stats()["state"] == "half_open"
+    assert breaker.call(lambda: "ok") == "ok"
@@ -0,0 +1,157 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import llm_backends
+import llm_scheduler
+from llm_backends import OpenAIBackend
+from llm_scheduler import LLMScheduler, PRIORITY_HELPER, PRIORITY_INTERACTIVE, TokenBucket
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(llm_scheduler.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_bucket_refills_at_its_per_minute_rate(clock):
+    bucket = TokenBucket(120)  # 2 per second
+    bucket.take(120)
+    assert bucket.wait_time(10) == pytest.approx(5.0)
+    clock[0] += 3.0
+    bucket.refill()
+    assert bucket.tokens == pytest.approx(6.0)
+    assert bucket.wait_time(10) == pytest.approx(2.0)
+
+
+def test_bucket_never_exceeds_its_capacity(clock):
+    bucket = TokenBucket(120)
+    bucket.take(30)
+    clock[0] += 600.0
+    bucket.refill()
+    assert bucket.tokens == 120
+    # Requests larger than the whole budget wait for a full bucket, not forever
+    assert bucket.wait_time(500) == 0.0
+
+
+def test_zero_budget_is_unlimited():
+    bucket = TokenBucket(0)
+    bucket.take(1000)
+    assert bucket.wait_time(1000) == 0.0
+
+
+def wait_for_queue(scheduler, depth):
+    deadline = time.monotonic() + 5
+    while len(scheduler._waiting) < depth:
+        assert time.monotonic() < deadline, "request was not queued"
+        time.sleep(0.005)
+
+
+def test_interactive_requests_are_served_before_queued_helpers():
+    scheduler = LLMScheduler(requests_per_minute=120, tokens_per_minute=0)  # 2 requests per second
+    with scheduler._cond:
+        scheduler._requests.tokens = 0.0
+    order = []
+
+    def request(name, priority):
+        scheduler.acquire(priority, 100, timeout=5)
+        order.append(name)
+
+    helpers = [threading.Thread(target=request, args=(f"helper{index}", PRIORITY_HELPER)) for index in range(2)]
+    for index, thread in enumerate(helpers):
+        thread.start()
+        wait_for_queue(scheduler, index + 1)
+    interactive = threading.Thread(target=request, args=("reply", PRIORITY_INTERACTIVE))
+    interactive.start()
+    for thread in helpers + [interactive]:
+        thread.join(5)
+
+    assert order == ["reply", "helper0", "helper1"]
+    stats = scheduler.get_stats()
+    assert stats["priorities"]["interactive"]["granted"] == 1
+    assert stats["priorities"]["helper"]["granted"] == 2
+    assert stats["peak_queue_depth"] == 3
+
+
+def test_timed_out_request_leaves_the_queue():
+    scheduler = LLMScheduler(requests_per_minute=1, tokens_per_minute=0)
+    scheduler.acquire(PRIORITY_INTERACTIVE, 100)
+    with pytest.raises(TimeoutError):
+        scheduler.acquire(PRIORITY_HELPER, 100, timeout=0.05)
+    assert scheduler.get_stats()["queue_depth"] == {"interactive": 0, "helper": 0}
+
+
+class FakeChat:
+    def __init__(self, name, order):
+        self.name = name
+        self.order = order
+
+    async def ainvoke(self, messages, **kwargs):
+        self.order.append(self.name)
+        return SimpleNamespace(content=self.name)
+
+
+def test_async_reply_goes_before_more_queued_helpers_than_executor_workers(monkeypatch):
+    scheduler = LLMScheduler(requests_per_minute=120, tokens_per_minute=0)  # 2 requests per second
+    with scheduler._cond:
+        scheduler._requests.tokens = 0.0
+    monkeypatch.setattr(llm_backends, "get_llm_scheduler", lambda: scheduler)
+    order = []
+    backend = OpenAIBackend(api_key="test")
+    monkeypatch.setattr(backend, "_client", lambda model, max_tokens, streaming: FakeChat(
+        "reply" if max_tokens == 1000 else "helper", order))
+    helper_count = 40  # More than the default executor has workers on most machines
+
+    async def run():
+        messages = [{"role": "user", "content": "Moi"}]
+        helpers = [asyncio.ensure_future(backend.ainvoke(messages, 100, priority=PRIORITY_HELPER))
+                   for _ in range(helper_count)]
+        while len(scheduler._waiting) < helper_count:
+            await asyncio.sleep(0.005)
+        started = time.monotonic()
+        assert await backend.ainvoke(messages, 1000, priority=PRIORITY_INTERACTIVE) == "reply"
+        elapsed = time.monotonic() - started
+        for helper in helpers:
+            helper.cancel()
+        await asyncio.gather(*helpers, return_exceptions=True)
+        return elapsed
+
+    elapsed = asyncio.run(run())
+    assert order[0] == "reply"
+    assert elapsed < 1.5  # One refill interval, not behind the queued helpers
+    assert scheduler.get_stats()["queue_depth"] == {"interactive": 0, "helper": 0}
+
+
+def test_async_and_blocking_requests_share_one_queue():
+    scheduler = LLMScheduler(requests_per_minute=120, tokens_per_minute=0)
+    with scheduler._cond:
+        scheduler._requests.tokens = 0.0
+    order = []
+
+    def helper():
+        scheduler.acquire(PRIORITY_HELPER, 100, timeout=5)
+        order.append("helper")
+
+    thread = threading.Thread(target=helper)
+    thread.start()
+    wait_for_queue(scheduler, 1)
+
+    async def reply():
+        await scheduler.acquire_async(PRIORITY_INTERACTIVE, 100, timeout=5)
+        order.append("reply")
+
+    asyncio.run(reply())
+    thread.join(5)
+    assert order == ["reply", "helper"]
+
+
+def test_async_request_times_out_and_leaves_the_queue():
+    scheduler = LLMScheduler(requests_per_minute=1, tokens_per_minute=0)
+    scheduler.acquire(PRIORITY_INTERACTIVE, 100)
+    with pytest.raises(TimeoutError):
+        asyncio.run(scheduler.acquire_async(PRIORITY_HELPER, 100, timeout=0.05))
+    assert scheduler.get_stats()["queue_depth"] == {"interactive": 0, "helper": 0}
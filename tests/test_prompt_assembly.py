@@ -0,0 +1,142 @@
+import pytest
+
+import chatbot
+from intent_router import EXECUTION_PROFILES
+from languages import SUPPORTED_LANGUAGES
+from prompt_assembler import ALL_PROMPT_TAGS, assemble_prompt, get_prefix_prompt_tags, select_prompt_tags
+from utils import get_level_appropriate_content
+
+LEVELS = ["A1 (Beginner)", "B1 (Intermediate)", "C2 (Proficiency)"]
+
+
+def pre_assembly_prompt(lang_code, lang_name, lang_flag, level, intent):
+    """The static prompt as it was built before it was split into fragments"""
+    profile = EXECUTION_PROFILES[intent]
+    level_code = level.split()[0]
+    prompt = chatbot.get_system_prompt(profile["sections"]) + f"""
+
+## CURRENT LEARNER LANGUAGE: {lang_flag} {lang_name}
+## CURRENT LEARNER LEVEL: {level} 
+"""
+    if not profile["level_guidelines"]:
+        return prompt + f"\nKeep all explanations and examples at {level_code} level.\n"
+    level_content = get_level_appropriate_content(level_code, lang_code)
+    return prompt + f"""{chatbot.get_cefr_level_guidelines(level_code, lang_code)}
+
+VOCABULARY GUIDELINES FOR {lang_name} {level_code}:
+{', '.join(level_content.get('vocabulary', ['No specific vocabulary guidelines available']))}
+
+GRAMMAR GUIDELINES FOR {lang_name} {level_code}:
+{', '.join(level_content.get('grammar', ['No specific grammar guidelines available']))}
+
+EXAMPLE SENTENCES FOR {lang_name} {level_code}:
+{' '.join(level_content.get('example_sentences', ['No example sentences available']))}
+
+YOU MUST STRICTLY ADHERE TO THESE GUIDELINES FOR {lang_name} {level_code} LEVEL:
+1. ONLY use vocabulary appropriate for {level_code} level
+2. ONLY use grammar structures appropriate for {level_code} level
+3. Keep explanations appropriate for {level_code} level complexity
+4. Format your responses clearly with the level indicator
+
+Remember: Always visually include the {level_code} level indicator in your responses using a badge or highlight.
+"""
+
+
+@pytest.mark.parametrize("lang_code", sorted(SUPPORTED_LANGUAGES))
+@pytest.mark.parametrize("intent", sorted(EXECUTION_PROFILES))
+def test_every_fragment_gives_the_pre_assembly_prompt(lang_code, intent):
+    info = SUPPORTED_LANGUAGES[lang_code]
+    for level in LEVELS:
+        assert chatbot.build_static_prompt(lang_code, info["name"], info["flag"], level, intent, ALL_PROMPT_TAGS) == \
+            pre_assembly_prompt(lang_code, info["name"], info["flag"], level, intent)
+
+
+def fragment_names(message, intent, file_attached=False):
+    fragments = chatbot.get_prompt_fragments("fin", "Finnish", "🇫🇮", "B1 (Intermediate)", intent)
+    return assemble_prompt(fragments, select_prompt_tags(message, intent, file_attached))[1]
+
+
+def test_assembled_prompt_keeps_the_fragment_order():
+    fragments = chatbot.get_prompt_fragments("fin", "Finnish", "🇫🇮", "B1 (Intermediate)", "general")
+    names = fragment_names("Mitä kuuluu?", "general")
+    order = [name for name, _, _ in fragments]
+    assert names == sorted(names, key=order.index)
+    assert names[0] == "INTRO" and names[-1] == "LEVEL RULES"
+
+
+def test_only_the_requested_exercise_type_is_sent():
+    names = fragment_names("Give me a vocabulary exercise about food", "exercise")
+    assert "EXERCISE TYPES: vocabulary" in names
+    assert "EXERCISE TYPES: quiz" not in names and "EXERCISE TYPES: reading" not in names
+
+
+def test_every_exercise_type_is_sent_when_none_is_named():
+    names = fragment_names("Give me an exercise", "exercise")
+    assert {"EXERCISE TYPES: vocabulary", "EXERCISE TYPES: quiz", "EXERCISE TYPES: reading",
+            "EXERCISE TYPES: writing"} <= set(names)
+
+
+def test_translations_leave_out_exercises_and_file_handling():
+    names = fragment_names("Translate 'good morning'", "translation")
+    assert not any(name.startswith("EXERCISE TYPES") for name in names)
+    assert "FILE HANDLING" not in names
+
+
+def test_file_handling_is_sent_only_with_an_uploaded_file():
+    assert "FILE HANDLING" not in fragment_names("What does this say?", "general")
+    assert "FILE HANDLING" in fragment_names("What does this say?", "general", file_attached=True)
+
+
+def test_fragments_with_alternative_tags_are_included_for_either():
+    fragments = [("A", "always", "a"), ("NOTES", "exercise:reading|exercise:writing", "n"), ("B", "file", "b")]
+    assert assemble_prompt(fragments, {"always", "exercise:writing"}) == ("an", ["A", "NOTES"])
+    assert assemble_prompt(fragments, {"always"}) == ("a", ["A"])
+
+
+MESSAGES = {
+    "exercise": ["Give me a vocabulary exercise about food", "Can I have a quiz on the partitive?",
+                 "Let's practise reading with a short story", "Give me an exercise"],
+    "general": ["Mitä kuuluu?", "Can we practise some exercises?", "Tell me about Finnish saunas"],
+    "grammar": ["Explain the rule for the partitive", "Why is it talossa and not talolla?"],
+    "translation": ["Translate 'good morning'", "What is 'kiitos' in English?"],
+    "answer_check": ["1. kahvia 2. leipää", "Is this right: minä olen opettaja"]
+}
+
+
+@pytest.mark.parametrize("intent", sorted(MESSAGES))
+def test_static_prompt_is_the_same_for_every_message_of_a_profile(intent):
+    prompts = []
+    for message in MESSAGES[intent]:
+        for file_attached in (False, True):
+            static, request, included = chatbot.build_request_prompt(
+                "fin", "Finnish", "🇫🇮", "B1 (Intermediate)", intent, message, file_attached)
+            prompts.append(static)
+            # Nothing is lost by moving the fragments chosen for the message out of the prefix
+            fragments = chatbot.get_prompt_fragments("fin", "Finnish", "🇫🇮", "B1 (Intermediate)", intent)
+            assert sorted(included) == sorted(fragment_names(message, intent, file_attached))
+            assert static == assemble_prompt(fragments, get_prefix_prompt_tags(intent))[0]
+            if not file_attached:
+                assert "FILE HANDLING" not in included
+    assert len(set(prompts)) == 1
+    assert prompts[0] == chatbot.build_static_prompt("fin", "Finnish", "🇫🇮", "B1 (Intermediate)", intent)
+
+
+def test_fragments_chosen_for_the_message_are_returned_separately():
+    fragments = dict((name, text) for name, _, text in
+                     chatbot.get_prompt_fragments("fin", "Finnish", "🇫🇮", "B1 (Intermediate)", "general"))
+    static, request, included = chatbot.build_request_prompt(
+        "fin", "Finnish", "🇫🇮", "B1 (Intermediate)", "general", "Give me a vocabulary exercise", True)
+    assert {"EXERCISE TYPES", "EXERCISE TYPES: vocabulary", "FILE HANDLING"} <= set(included)
+    for name in ("EXERCISE TYPES", "EXERCISE TYPES: vocabulary", "FILE HANDLING"):
+        assert fragments[name] in request and fragments[name] not in static
+    assert "EXERCISE TYPES: quiz" not in included
+
+
+def test_attached_file_is_only_the_one_uploaded_for_this_request(session_state):
+    session_state.uploaded_file = {"name": "teksti.txt", "type": "text/plain"}
+    session_state.messages = [{"role": "assistant", "content": "📎 File 'teksti.txt' has been uploaded.", "kind": "notice"},
+                              {"role": "user", "content": "What does it say?"}]
+    assert chatbot.get_attached_file(session_state) is session_state.uploaded_file
+    session_state.messages += [{"role": "assistant", "content": "It says hello."},
+                               {"role": "user", "content": "Thanks!"}]
+    assert chatbot.get_attached_file(session_state) is None
@@ -0,0 +1,97 @@
+import os
+
+import pytest
+
+import chatbot
+import reply_checkpoint
+from reply_checkpoint import (ReplyCheckpointer, get_reply_checkpoint, sign_session_id, verify_session_token)
+
+SETTINGS = {}
+
+
+@pytest.fixture(autouse=True)
+def checkpoint_settings(monkeypatch, tmp_path):
+    SETTINGS.clear()
+    SETTINGS.update({"REPLY_CHECKPOINT_DIR": str(tmp_path), "REPLY_CHECKPOINT_SECRET": "test-secret"})
+    monkeypatch.setattr(reply_checkpoint, "get_setting", lambda name, default=None: SETTINGS.get(name, default))
+
+
+def test_signed_token_round_trips():
+    token = sign_session_id("0b7c6f9e-session")
+    assert token.startswith("0b7c6f9e-session.")
+    assert verify_session_token(token) == "0b7c6f9e-session"
+
+
+@pytest.mark.parametrize("token", [None, "", "0b7c6f9e-session", "0b7c6f9e-session.deadbeef", "other-session.{sig}"])
+def test_unsigned_or_tampered_tokens_are_rejected(token):
+    signature = sign_session_id("0b7c6f9e-session").rsplit(".", 1)[1]
+    assert verify_session_token(token.format(sig=signature) if token else token) is None
+
+
+def test_tokens_signed_with_another_secret_are_rejected():
+    token = sign_session_id("0b7c6f9e-session")
+    SETTINGS["REPLY_CHECKPOINT_SECRET"] = "rotated-secret"
+    assert verify_session_token(token) is None
+
+
+def test_no_durable_store_without_a_secret(session_state, tmp_path):
+    del SETTINGS["REPLY_CHECKPOINT_SECRET"]
+    assert sign_session_id("0b7c6f9e-session") is None
+    ReplyCheckpointer(session_state, "Mikä on partitiivi?", "B1 (Intermediate)", "fin")
+    assert os.listdir(tmp_path) == []
+
+
+def test_checkpoint_is_reloaded_from_the_durable_store(session_state):
+    ReplyCheckpointer(session_state, "Mikä on partitiivi?", "B1 (Intermediate)", "fin").interrupted("Partitiivi on")
+    session_state.reply_checkpoint = None
+    assert get_reply_checkpoint(session_state)["partial"] == "Partitiivi on"
+
+
+def test_resume_uses_the_language_and_level_of_the_checkpoint(session_state, monkeypatch):
+    session_state.reply_checkpoint = {"question": "Mikä on partitiivi?", "partial": "Partitiivi on", "level": "A2 (Elementary)",
+                                      "language": "fin", "model": None, "intent": "general", "status": "interrupted"}
+    session_state.active_stream = None
+    session_state.last_reply_usage = None
+    # The learner switched to Spanish B2 after the reply was interrupted
+    session_state.selected_language = "spa"
+    session_state.selected_level = "B2 (Upper Intermediate)"
+    seen = {}
+
+    def fake_call(state, *args, **kwargs):
+        seen["context"] = (state.selected_language, state.selected_level)
+        return kwargs["resume_from"] + " sijamuoto."
+
+    monkeypatch.setattr(chatbot, "call_openai_api", fake_call)
+    chatbot.resume_interrupted_reply(session_state)
+
+    assert seen["context"] == ("fin", "A2 (Elementary)")
+    assert (session_state.selected_language, session_state.selected_level) == ("spa", "B2 (Upper Intermediate)")
+    assert session_state.messages[-1]["language"] == "fin"
+    assert session_state.messages[-1]["content"].endswith("Partitiivi on sijamuoto.")
+
+
+class RerunRequested(BaseException):
+    """Stands in for the exception Streamlit raises in a script run it stops"""
+
+
+def test_stop_keeps_the_partial_reply_marked_as_truncated(session_state, monkeypatch):
+    session_state.active_stream = None
+    session_state.last_reply_usage = None
+    monkeypatch.setattr(chatbot, "start_turn_analysis", lambda question, state: None)
+
+    def interrupted_call(state, deadline, model, profile, cancel_token, checkpointer, *args, **kwargs):
+        checkpointer.update("Partitiivi on")
+        cancel_token.partial = "Partitiivi on"
+        raise RerunRequested()
+
+    monkeypatch.setattr(chatbot, "call_openai_api", interrupted_call)
+    with pytest.raises(RerunRequested):
+        chatbot.process_question("Mikä on partitiivi?", session_state)
+
+    # The next run shows the checkpoint; Stop's callback keeps it as it is
+    assert session_state.active_stream is None
+    assert get_reply_checkpoint(session_state)["status"] == "interrupted"
+    chatbot.finalize_interrupted_reply(session_state)
+    assert session_state.messages[-1]["content"].endswith("Partitiivi on" + chatbot.TRUNCATED_NOTE)
+    assert session_state.chat_history[-1]["truncated"] is True
+    assert get_reply_checkpoint(session_state) is None
@@ -0,0 +1,129 @@
+import threading
+import time
+
+import pytest
+
+from llm_client import SingleFlight, request_key
+
+
+class Interrupted(BaseException):
+    """Stands in for Streamlit's rerun exception"""
+
+
+def start_followers(flight, key, func, count):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do(key, func))) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    return threads, results
+
+
+def wait_for_followers(flight, count):
+    deadline = time.monotonic() + 5
+    while flight.get_stats()["shared"] < count:
+        assert time.monotonic() < deadline, "followers did not join the call"
+        time.sleep(0.01)
+
+
+def test_followers_share_the_leaders_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def leader_func():
+        calls.append("leader")
+        release.wait(5)
+        return "vastaus"
+
+    leader = threading.Thread(target=lambda: calls.append(flight.do("key", leader_func)))
+    leader.start()
+    while flight.get_stats()["in_flight"] == 0:
+        time.sleep(0.01)
+    threads, results = start_followers(flight, "key", lambda: calls.append("follower") or "own", 3)
+    wait_for_followers(flight, 3)
+    release.set()
+    for thread in threads + [leader]:
+        thread.join(5)
+
+    assert results == ["vastaus"] * 3
+    assert calls.count("leader") == 1 and "follower" not in calls
+    assert flight.get_stats() == {"calls": 4, "shared": 3, "in_flight": 0}
+
+
+def test_followers_share_the_leaders_error():
+    flight = SingleFlight()
+    release = threading.Event()
+    errors = []
+
+    def failing():
+        release.wait(5)
+        raise ValueError("rate limited")
+
+    def follow():
+        try:
+            flight.do("key", lambda: "own")
+        except ValueError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=lambda: pytest.raises(ValueError, flight.do, "key", failing))
+    leader.start()
+    while flight.get_stats()["in_flight"] == 0:
+        time.sleep(0.01)
+    follower = threading.Thread(target=follow)
+    follower.start()
+    wait_for_followers(flight, 1)
+    release.set()
+    for thread in (leader, follower):
+        thread.join(5)
+    assert errors == ["rate limited"]
+
+
+def test_followers_run_the_call_themselves_when_the_leader_is_aborted():
+    flight = SingleFlight()
+    release = threading.Event()
+    aborted = []
+
+    def interrupted():
+        release.wait(5)
+        raise Interrupted()
+
+    def lead():
+        try:
+            flight.do("key", interrupted)
+        except Interrupted:
+            aborted.append(True)
+
+    leader = threading.Thread(target=lead)
+    leader.start()
+    while flight.get_stats()["in_flight"] == 0:
+        time.sleep(0.01)
+    threads, results = start_followers(flight, "key", lambda: "own", 2)
+    wait_for_followers(flight, 2)
+    release.set()
+    for thread in threads + [leader]:
+        thread.join(5)
+
+    assert aborted == [True]
+    assert results == ["own", "own"]
+    assert flight.get_stats()["in_flight"] == 0
+
+
+def test_calls_after_the_leader_finished_run_again():
+    flight = SingleFlight()
+    assert flight.do("key", lambda: 1) == 1
+    assert flight.do("key", lambda: 2) == 2
+    assert flight.get_stats()["shared"] == 0
+
+
+def test_request_keys_keep_the_exact_text():
+    # Layout matters for poems, code blocks and exercises
+    assert request_key("reply", "s1", [{"content": "Lue runo:\n  Kesä\n  on"}]) != \
+        request_key("reply", "s1", [{"content": "Lue runo: Kesä on"}])
+    assert request_key("helper", 100, [{"content": "Mikä  on partitiivi?"}]) != \
+        request_key("helper", 100, [{"content": "Mikä on partitiivi?"}])
+    assert request_key("reply", "s1", "kysymys") != request_key("reply", "s2", "kysymys")
+
+
+def test_request_keys_ignore_the_unicode_form():
+    composed, decomposed = "Hyv\u00e4\u00e4", "Hyva\u0308a\u0308"
+    assert request_key("helper", [{"content": composed}]) == request_key("helper", [{"content": decomposed}])
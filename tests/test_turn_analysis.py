@@ -0,0 +1,48 @@
+from concurrent.futures import Future
+
+import chatbot
+import utils
+
+
+def test_failed_analysis_falls_back_without_more_llm_calls(monkeypatch):
+    calls = []
+
+    def failing_helper(*args, **kwargs):
+        calls.append(args)
+        raise ConnectionError("API down")
+
+    monkeypatch.setattr(chatbot, "invoke_helper", failing_helper)
+    monkeypatch.setattr(utils, "invoke_helper", failing_helper)
+
+    analysis = chatbot.analyze_turn("Give me a reading exercise about the partitive case", "Finnish", "B1 (Intermediate)")
+
+    assert len(calls) == 1
+    assert "case" in analysis["topics"]
+    assert analysis["exercise_parameters"]["exercise_type"] == "reading"
+    assert analysis["exercise_parameters"]["topic"] == "the partitive case"
+    assert analysis["language"] == "eng"
+
+
+def test_short_message_is_analysed_without_llm_calls(monkeypatch):
+    def unexpected_helper(*args, **kwargs):
+        raise AssertionError("short messages must not reach the helper model")
+
+    monkeypatch.setattr(chatbot, "invoke_helper", unexpected_helper)
+    monkeypatch.setattr(utils, "invoke_helper", unexpected_helper)
+
+    analysis = chatbot.analyze_turn("Hei!", "Finnish", "A1 (Beginner)")
+
+    assert analysis["topics"] == []
+    assert analysis["language"] == chatbot.detect_language_traditional("Hei!")
+
+
+def test_collect_turn_analyses_merges_topics_only(session_state):
+    future = Future()
+    future.set_result({"topics": ["case"], "exercise_parameters": {"exercise_type": "reading"}, "language": "fin"})
+    session_state.pending_turn_analyses = [(future, "fin")]
+
+    chatbot.collect_turn_analyses(session_state)
+
+    assert "case" in session_state.user_topics["fin"]
+    assert session_state.pending_turn_analyses == []
+    assert not hasattr(session_state, "turn_analysis")
@@ -0,0 +1,49 @@
+import chatbot
+from llm_resilience import LatencyTracker
+from turn_deadline import TurnDeadline
+
+
+def test_reply_estimate_uses_the_reserve_until_there_are_samples(monkeypatch):
+    monkeypatch.setattr(chatbot, "reply_latency", LatencyTracker("reply"))
+    deadline = TurnDeadline(20.0, optional_reserve=8.0)
+    assert chatbot.estimate_reply_seconds(deadline) == 8.0
+
+
+def test_reply_estimate_adds_the_time_to_read_a_file(monkeypatch):
+    tracker = LatencyTracker("reply")
+    for seconds in range(1, 11):
+        tracker.record(seconds)
+    monkeypatch.setattr(chatbot, "reply_latency", tracker)
+    deadline = TurnDeadline(20.0, optional_reserve=8.0)
+    # p90 of the samples plus 4000 tokens at the default 2000 tokens per second
+    assert chatbot.estimate_reply_seconds(deadline, 4000) == 9.0 + 2.0
+
+
+def test_optional_work_leaves_the_reply_reserve():
+    deadline = TurnDeadline(20.0, optional_reserve=8.0)
+    assert 11.5 < deadline.optional_timeout() <= 12.0
+    assert deadline.optional_timeout(1.5) == 1.5
+    assert TurnDeadline(5.0, optional_reserve=8.0).optional_timeout(1.5) == 0.0
+
+
+def run_turn(session_state, monkeypatch, budget):
+    started = []
+    monkeypatch.setattr(chatbot, "start_turn_deadline", lambda: TurnDeadline(budget, optional_reserve=0.0))
+    monkeypatch.setattr(chatbot, "start_turn_analysis", lambda question, state: None)
+    monkeypatch.setattr(chatbot, "call_openai_api", lambda state, *args, **kwargs: "Hei!")
+    monkeypatch.setattr(chatbot, "start_learner_memory_update", lambda state, lang_code: started.append(lang_code))
+    session_state.active_stream = None
+    session_state.last_reply_usage = None
+    chatbot.process_question("Moi!", session_state)
+    return started
+
+
+def test_learner_memory_update_starts_within_the_budget(session_state, monkeypatch):
+    assert run_turn(session_state, monkeypatch, 20.0) == ["fin"]
+    assert "learner_memory" not in session_state.turn_budget_report["skipped"]
+
+
+def test_learner_memory_update_waits_when_the_budget_is_spent(session_state, monkeypatch):
+    assert run_turn(session_state, monkeypatch, 0.0) == []
+    assert "learner_memory" in session_state.turn_budget_report["skipped"]
+    assert session_state.messages[-1]["role"] == "assistant"
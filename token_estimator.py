@@ -0,0 +1,200 @@
+import math
+import logging
+import threading
+from llm_client import get_setting
+
+# Characters per token of each script, measured on OpenAI's tokenizers. Latin text
+# with accents (Finnish, German, ...) needs more tokens than plain English, and
+# Cyrillic or Greek text about half again as many per character.
+DEFAULT_CHARS_PER_TOKEN = {
+    "latin": 3.8,
+    "cyrillic": 2.8,
+    "greek": 2.5,
+    "cjk": 1.1,
+    "other": 2.0
+}
+
+# Tokens added to every chat message for its role and separators
+MESSAGE_OVERHEAD_TOKENS = 4
+
+# Rough token estimate for an attached image
+IMAGE_TOKEN_ESTIMATE = 765
+
+# Function to get the script of a character
+def _char_script(char):
+    code = ord(char)
+    if code < 0x250:
+        # ASCII, Latin-1 and Latin Extended, including digits, spaces and punctuation
+        return "latin"
+    if 0x400 <= code <= 0x52F:
+        return "cyrillic"
+    if 0x370 <= code <= 0x3FF:
+        return "greek"
+    if 0x3040 <= code <= 0x30FF or 0x4E00 <= code <= 0x9FFF or 0xAC00 <= code <= 0xD7AF:
+        return "cjk"
+    return "other"
+
+class TokenEstimator:
+    """
+    Offline token estimator: counts the characters of each script and divides
+    them by that script's characters per token. No tokenizer is needed, and
+    the ratios can be calibrated against token counts reported by the API.
+    """
+    def __init__(self, chars_per_token=None):
+        self._lock = threading.Lock()
+        self.chars_per_token = dict(DEFAULT_CHARS_PER_TOKEN)
+        if chars_per_token:
+            self.chars_per_token.update(chars_per_token)
+
+    def script_counts(self, text):
+        """
+        Count the characters of each script in a text
+
+        Parameters:
+        - text: Text to count
+
+        Returns:
+        - Dictionary of script name to number of characters
+        """
+        if text.isascii():
+            return {"latin": len(text)}
+        counts = {}
+        for char in text:
+            script = _char_script(char)
+            counts[script] = counts.get(script, 0) + 1
+        return counts
+
+    def count(self, text):
+        """Estimated tokens of a text, as a float so small chunks can be added up"""
+        if not text:
+            return 0.0
+        ratios = self.chars_per_token
+        return sum(chars / ratios.get(script, ratios["other"]) for script, chars in self.script_counts(text).items())
+
+    def estimate(self, text):
+        """
+        Estimate the tokens of a text
+
+        Parameters:
+        - text: Text to estimate
+
+        Returns:
+        - Estimated number of tokens
+        """
+        return math.ceil(self.count(text))
+
+    def estimate_content(self, content):
+        """Estimate the tokens of a message content (a string or a list of text and image parts)"""
+        if isinstance(content, str):
+            return self.estimate(content)
+        tokens = 0
+        for part in content:
+            if part.get("type") == "text":
+                tokens += self.estimate(part["text"])
+            else:
+                tokens += IMAGE_TOKEN_ESTIMATE
+        return tokens
+
+    def estimate_messages(self, messages):
+        """
+        Estimate the prompt tokens of chat messages
+
+        Parameters:
+        - messages: Chat messages (dicts with string or multi-part content)
+
+        Returns:
+        - Estimated number of prompt tokens
+        """
+        return sum(self.estimate_content(message["content"]) + MESSAGE_OVERHEAD_TOKENS for message in messages)
+
+    def calibrate(self, samples):
+        """
+        Fit the characters per token of each script to measured token counts.
+        Each sample is attributed to its dominant script, after the tokens of
+        its other scripts are estimated with the current ratios.
+
+        Parameters:
+        - samples: List of (text, actual tokens)
+
+        Returns:
+        - Dictionary of the calibrated characters per token
+        """
+        fitted = {}
+        for text, tokens in samples:
+            counts = self.script_counts(text)
+            if not counts:
+                continue
+            script = max(counts, key=counts.get)
+            other_tokens = sum(chars / self.chars_per_token.get(s, self.chars_per_token["other"])
+                               for s, chars in counts.items() if s != script)
+            remaining = tokens - other_tokens
+            if remaining > 0:
+                fitted.setdefault(script, []).append(counts[script] / remaining)
+        with self._lock:
+            for script, ratios in fitted.items():
+                self.chars_per_token[script] = round(sum(ratios) / len(ratios), 2)
+            return dict(self.chars_per_token)
+
+_token_estimator = None
+_token_estimator_lock = threading.Lock()
+
+# Function to get the shared token estimator
+def get_token_estimator():
+    """
+    Get the process-wide token estimator
+
+    Returns:
+    - TokenEstimator with the ratios from TOKEN_CHARS_PER_TOKEN in secrets, if set
+    """
+    global _token_estimator
+    with _token_estimator_lock:
+        if _token_estimator is None:
+            _token_estimator = TokenEstimator(get_setting("TOKEN_CHARS_PER_TOKEN", None))
+        return _token_estimator
+
+# Function to estimate the tokens of a text
+def estimate_tokens(text):
+    """
+    Estimate the tokens of a text with the shared estimator
+
+    Parameters:
+    - text: Text to estimate
+
+    Returns:
+    - Estimated number of tokens
+    """
+    return get_token_estimator().estimate(text)
+
+# Function to break the tokens of a request down by section
+def analyze_request_tokens(sections, max_tokens=None):
+    """
+    Estimate the tokens of each section of an assembled request
+
+    Parameters:
+    - sections: Dictionary of section name to text, or to a list of chat messages
+    - max_tokens: Optional response token limit of the request
+
+    Returns:
+    - Dictionary with the tokens per section, the prompt total and max_tokens
+    """
+    estimator = get_token_estimator()
+    breakdown = {}
+    for name, value in sections.items():
+        if isinstance(value, list):
+            breakdown[name] = estimator.estimate_messages(value)
+        else:
+            breakdown[name] = estimator.estimate(value or "")
+    return {"sections": breakdown, "prompt_tokens": sum(breakdown.values()), "max_tokens": max_tokens}
+
+# Function to record the token breakdown of a turn
+def record_token_breakdown(session_state, breakdown):
+    """
+    Keep the token breakdown of the turn in session_state.token_breakdown and log it
+
+    Parameters:
+    - session_state: Streamlit session state
+    - breakdown: Output of analyze_request_tokens
+    """
+    session_state.token_breakdown = breakdown
+    parts = ", ".join(f"{name} {tokens}" for name, tokens in breakdown["sections"].items() if tokens)
+    logging.info(f"Request tokens: {breakdown['prompt_tokens']} ({parts}), max_tokens {breakdown['max_tokens']}")
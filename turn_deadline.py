@@ -0,0 +1,118 @@
+import time
+import logging
+from contextlib import contextmanager
+from llm_client import get_setting
+
+class TurnDeadline:
+    """
+    Latency budget for one chat turn. Created when the turn starts and passed
+    through every stage, so optional stages can be skipped or shortened when
+    the budget is nearly spent. Stage durations and skip reasons are recorded
+    for inspection.
+    """
+    def __init__(self, budget_seconds, optional_reserve=0.0):
+        self.budget = float(budget_seconds)
+        self.optional_reserve = float(optional_reserve)
+        self.started = time.monotonic()
+        self.expires = self.started + self.budget
+        self.stages = {}
+        self.skipped = {}
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def remaining(self):
+        """Seconds left in the budget (never negative)"""
+        return max(0.0, self.expires - time.monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def timeout(self, cap=None):
+        """
+        Timeout for a blocking wait, limited by the remaining budget
+
+        Parameters:
+        - cap: The stage's own timeout in seconds (optional)
+
+        Returns:
+        - The smaller of cap and the remaining budget
+        """
+        remaining = self.remaining()
+        return remaining if cap is None else min(float(cap), remaining)
+
+    def optional_timeout(self, cap=None):
+        """
+        Timeout for waiting on optional work, leaving the reply's reserve
+
+        Parameters:
+        - cap: The stage's own timeout in seconds (optional)
+
+        Returns:
+        - Seconds the optional work may take (0 when only the reserve is left)
+        """
+        available = max(0.0, self.remaining() - self.optional_reserve)
+        return available if cap is None else min(float(cap), available)
+
+    def nearly_spent(self):
+        """True when no more than the reply's reserve is left"""
+        return self.remaining() <= self.optional_reserve
+
+    def allows_optional(self, stage):
+        """
+        Check whether an optional stage still fits in the budget, leaving the
+        reserve for the tutor reply. Records the skip reason if it does not.
+
+        Parameters:
+        - stage: Stage name (e.g. "turn_analysis")
+
+        Returns:
+        - True if the stage should run
+        """
+        if not self.nearly_spent():
+            return True
+        remaining = self.remaining()
+        self.skip(stage, f"{remaining:.2f}s of {self.budget:.1f}s budget left, {self.optional_reserve:.1f}s reserved for the reply")
+        return False
+
+    def skip(self, stage, reason):
+        """Record that a stage was skipped or shortened and why"""
+        self.skipped[stage] = reason
+        logging.info(f"Turn stage '{stage}' skipped or shortened: {reason}")
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager recording how long a stage took"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + time.monotonic() - start
+
+    def get_report(self):
+        """
+        Summarise the turn's use of its budget
+
+        Returns:
+        - Dictionary with budget, elapsed time, per-stage durations and skip reasons
+        """
+        return {
+            "budget": self.budget,
+            "elapsed": self.elapsed(),
+            "remaining": self.remaining(),
+            "stages": dict(self.stages),
+            "skipped": dict(self.skipped)
+        }
+
+# Function to start the latency budget for a chat turn
+def start_turn_deadline():
+    """
+    Create the deadline for a new chat turn from the configured budget
+
+    Returns:
+    - TurnDeadline instance
+    """
+    return TurnDeadline(
+        budget_seconds=float(get_setting("TURN_BUDGET_SECONDS", 20.0)),
+        optional_reserve=float(get_setting("TURN_OPTIONAL_RESERVE", 8.0))
+    )